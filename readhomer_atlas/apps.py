@@ -1,6 +1,25 @@
 from django.apps import AppConfig as BaseAppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
 
 
 class AppConfig(BaseAppConfig):
 
     name = "readhomer_atlas"
+
+    def ready(self):
+        if settings.DB_READ_ONLY:
+            connection_created.connect(tweak_sqlite_pragma_for_serving)
+
+
+def tweak_sqlite_pragma_for_serving(sender, connection, **kwargs):
+    """
+    Customize PRAGMA settings for SQLite when serving a read-only database;
+    runs after scaife_viewer.atlas's `tweak_sqlite_pragma`
+    """
+    if connection.vendor == "sqlite" and connection.alias == settings.SV_ATLAS_DB_LABEL:
+        cursor = connection.cursor()
+        cursor.execute(f"PRAGMA mmap_size={settings.DB_MMAP_SIZE};")
+        # NOTE: pages read via mmap are shared across processes, so the private
+        # page cache can be much smaller than the one used for ingestion
+        cursor.execute(f"PRAGMA cache_size=-{settings.DB_READ_ONLY_CACHE_SIZE};")
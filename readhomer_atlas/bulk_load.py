@@ -0,0 +1,93 @@
+"""
+Trades durability for speed while `prepare_db --bulk-load` builds the
+database; the built database is only ever read, so a failed build is
+simply rebuilt.
+"""
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+
+
+# NOTE: negative values are in KiB
+BULK_LOAD_CACHE_SIZE = -512 * 1024
+
+
+def apply_bulk_load_pragmas(connection, journal_mode):
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"PRAGMA journal_mode={journal_mode};")
+        cursor.execute("PRAGMA synchronous=OFF;")
+        cursor.execute(f"PRAGMA cache_size={BULK_LOAD_CACHE_SIZE};")
+        cursor.execute("PRAGMA temp_store=MEMORY;")
+
+
+class BulkLoader:
+    """
+    Applies bulk-load pragmas to every connection (including those opened by
+    worker processes) and defers the non-unique indexes on the tables each
+    step loads until that step has completed.
+
+    Journaling is only turned off when steps run serially: without a journal
+    a write transaction can't be rolled back, which corrupts the database
+    when concurrent writers contend for it.  Concurrent steps keep the
+    in-memory rollback journal that scaife_viewer.atlas configures.
+
+    Unique indexes are left in place, since they enforce constraints.
+    """
+
+    def __init__(self, concurrent=False):
+        # NOTE: there is nothing to roll back to; a failed build is discarded
+        self.journal_mode = "MEMORY" if concurrent else "OFF"
+        # step name -> CREATE INDEX statements to run when it completes
+        self.deferred = {}
+
+    def apply_pragmas(self, sender, connection, **kwargs):
+        apply_bulk_load_pragmas(connection, self.journal_mode)
+
+    def enable(self):
+        # NOTE: connected after scaife_viewer.atlas's receiver, so these
+        # pragmas take precedence
+        connection_created.connect(self.apply_pragmas)
+        connections.close_all()
+
+    def disable(self):
+        connection_created.disconnect(self.apply_pragmas)
+        connections.close_all()
+
+    def drop_indexes(self, step):
+        tables = step.get("deferred_indexes", [])
+        if not tables:
+            return
+        statements = []
+        with connection.cursor() as cursor:
+            for table in tables:
+                cursor.execute(
+                    "SELECT name, sql FROM sqlite_master "
+                    "WHERE type = 'index' AND tbl_name = %s AND sql IS NOT NULL "
+                    "AND sql NOT LIKE 'CREATE UNIQUE%%'",
+                    [table],
+                )
+                for name, sql in cursor.fetchall():
+                    cursor.execute(f'DROP INDEX "{name}"')
+                    statements.append(sql)
+        self.deferred[step["name"]] = statements
+        # NOTE: ensures worker processes are never forked with an open connection
+        connections.close_all()
+
+    def create_indexes(self, step):
+        statements = self.deferred.pop(step["name"], [])
+        if not statements:
+            return
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+        connections.close_all()
+
+    def finalize(self):
+        """
+        Updates query planner statistics and compacts the database
+        """
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE;")
+            cursor.execute("VACUUM;")
+        connections.close_all()
@@ -0,0 +1,218 @@
+"""
+Fingerprints the inputs used to build the database, so that views can emit
+validators (ETag / Last-Modified) that only change when the data does.
+
+The fingerprint is written by the `prepare_db` management command.
+"""
+import datetime
+import hashlib
+import json
+import os
+import subprocess
+import threading
+import time
+
+from django.conf import settings
+from django.utils.timezone import utc
+from django.views.decorators.http import condition
+
+
+HASH_CHUNK_SIZE = 1024 * 1024
+# the content codings that responses may be pre-compressed with
+ENCODINGS = ["br", "gzip"]
+
+
+def parse_accept_encoding(value):
+    """
+    Returns the quality value of each coding listed in an Accept-Encoding
+    header, keyed by lowercased coding
+    """
+    qualities = {}
+    for item in value.split(","):
+        coding, *params = [part.strip() for part in item.split(";")]
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, param_value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(param_value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.lower()] = quality
+    return qualities
+
+
+def get_accepted_encodings(request, encodings=ENCODINGS):
+    """
+    Returns the `encodings` accepted by the request (those not listed, or
+    refused with `q=0`, are excluded), in order of preference
+    """
+    qualities = parse_accept_encoding(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+    wildcard = qualities.get("*", 0.0)
+    accepted = []
+    for position, encoding in enumerate(encodings):
+        quality = qualities.get(encoding, wildcard)
+        if quality > 0:
+            accepted.append((-quality, position, encoding))
+    return [encoding for _, _, encoding in sorted(accepted)]
+
+
+def get_code_version():
+    # NOTE: Heroku exposes the commit being built as SOURCE_VERSION;
+    # the slug itself does not include the git repository
+    source_version = os.environ.get("SOURCE_VERSION")
+    if source_version:
+        return source_version
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=settings.PROJECT_ROOT,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def iter_data_files(path):
+    for dirpath, dirnames, filenames in os.walk(path):
+        # sorted in place so that os.walk descends deterministically
+        dirnames.sort()
+        for filename in sorted(filenames):
+            yield os.path.join(dirpath, filename)
+
+
+def hash_file(path, hasher):
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher
+
+
+def hash_directory(path, hasher):
+    for file_path in iter_data_files(path):
+        hasher.update(os.path.relpath(file_path, path).encode("utf-8"))
+        hash_file(file_path, hasher)
+
+
+def compute_data_version():
+    hasher = hashlib.sha256()
+    hasher.update(get_code_version().encode("utf-8"))
+    hash_directory(settings.SV_ATLAS_DATA_DIR, hasher)
+    return hasher.hexdigest()
+
+
+def write_data_version():
+    data = {"version": compute_data_version(), "created": time.time()}
+    # NOTE: replaced atomically, since running processes may read it at any time
+    path = f"{settings.DATA_VERSION_PATH}.tmp"
+    with open(path, "w") as f:
+        json.dump(data, f)
+    os.replace(path, settings.DATA_VERSION_PATH)
+    data_version_file.clear()
+    return data
+
+
+def remove_data_version():
+    if os.path.exists(settings.DATA_VERSION_PATH):
+        os.remove(settings.DATA_VERSION_PATH)
+    data_version_file.clear()
+
+
+class WatchedJsonFile:
+    """
+    Holds the contents of a JSON file, re-reading it whenever its path,
+    modification time or size changes, so that long-running processes pick
+    up files rewritten by management commands
+    """
+
+    def __init__(self, get_path):
+        self.get_path = get_path
+        self.lock = threading.Lock()
+        self.stat = None
+        self.data = None
+
+    def get(self):
+        path = self.get_path()
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        stat = (path, stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            if stat != self.stat:
+                try:
+                    with open(path) as f:
+                        self.data = json.load(f)
+                except (OSError, ValueError):
+                    self.data = None
+                self.stat = stat
+            return self.data
+
+    def clear(self):
+        with self.lock:
+            self.stat = None
+            self.data = None
+
+
+data_version_file = WatchedJsonFile(lambda: settings.DATA_VERSION_PATH)
+
+
+def get_data_version():
+    """
+    Returns the fingerprint written by `prepare_db`, or None if the
+    database was not built by it (in which case no validators are sent)
+    """
+    return data_version_file.get()
+
+
+def condition_on_data_version(vary_on_encoding=False, get_content_version=None):
+    """
+    Sends a strong ETag and Last-Modified derived from the data version,
+    returning `304 Not Modified` for matching conditional requests.
+
+    `vary_on_encoding` should be set for views that may serve a
+    pre-compressed representation, since strong ETags must differ
+    between encodings.
+
+    `get_content_version` is for views that serve files which may change
+    without the database being rebuilt; it is called with the view's
+    arguments and returns a (content hash, modification timestamp or None)
+    pair to include in the validators, or None.
+    """
+
+    def get_versions(request, *args, **kwargs):
+        content_version = None
+        if get_content_version is not None:
+            content_version = get_content_version(request, *args, **kwargs)
+        return get_data_version(), content_version
+
+    def etag_func(request, *args, **kwargs):
+        data_version, content_version = get_versions(request, *args, **kwargs)
+        if data_version is None and content_version is None:
+            return None
+        parts = []
+        if data_version is not None:
+            parts.append(data_version["version"])
+        parts.append(request.get_full_path())
+        if content_version is not None:
+            parts.append(content_version[0])
+        if vary_on_encoding:
+            accepted = get_accepted_encodings(request)
+            parts.append("+".join(accepted) or "identity")
+        return hashlib.sha256(":".join(parts).encode("utf-8")).hexdigest()
+
+    def last_modified_func(request, *args, **kwargs):
+        data_version, content_version = get_versions(request, *args, **kwargs)
+        timestamps = []
+        if data_version is not None:
+            timestamps.append(data_version["created"])
+        if content_version is not None and content_version[1] is not None:
+            timestamps.append(content_version[1])
+        if not timestamps:
+            return None
+        return datetime.datetime.fromtimestamp(max(timestamps), tz=utc)
+
+    return condition(etag_func=etag_func, last_modified_func=last_modified_func)
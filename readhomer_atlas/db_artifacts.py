@@ -0,0 +1,79 @@
+"""
+Stores compressed snapshots of the database built by `prepare_db`, keyed by
+everything that determines its contents, so that builds from unchanged
+inputs can restore a snapshot instead of re-running ingestion.
+"""
+import glob
+import gzip
+import hashlib
+import os
+import shutil
+
+from django.conf import settings
+
+import pkg_resources
+
+from .data_version import hash_directory, hash_file, iter_data_files
+
+
+# NOTE: every Python module (including migrations) in the project is hashed,
+# rather than just those known to write to the database, so that new code
+# that does can't silently reuse a stale snapshot
+CODE_EXTENSIONS = (".py",)
+
+
+def iter_code_files(path):
+    for file_path in iter_data_files(path):
+        if file_path.endswith(CODE_EXTENSIONS):
+            yield file_path
+
+
+def get_installed_packages():
+    return sorted(
+        f"{dist.project_name}=={dist.version}" for dist in pkg_resources.working_set
+    )
+
+
+def compute_artifact_key():
+    hasher = hashlib.sha256()
+    for package in get_installed_packages():
+        hasher.update(package.encode("utf-8"))
+    for path in iter_code_files(settings.PACKAGE_ROOT):
+        hasher.update(os.path.relpath(path, settings.PACKAGE_ROOT).encode("utf-8"))
+        hash_file(path, hasher)
+    hash_directory(settings.SV_ATLAS_DATA_DIR, hasher)
+    return hasher.hexdigest()
+
+
+def get_artifact_path(artifact_dir, key):
+    return os.path.join(artifact_dir, f"{key}.sqlite3.gz")
+
+
+def restore_artifact(artifact_path, db_path):
+    tmp_path = f"{db_path}.tmp"
+    with gzip.open(artifact_path, "rb") as src, open(tmp_path, "wb") as dest:
+        shutil.copyfileobj(src, dest)
+    os.replace(tmp_path, db_path)
+
+
+def store_artifact(db_path, artifact_path):
+    os.makedirs(os.path.dirname(artifact_path), exist_ok=True)
+    tmp_path = f"{artifact_path}.tmp"
+    # mtime=0 keeps the output deterministic across builds
+    with open(db_path, "rb") as src, gzip.GzipFile(
+        tmp_path, mode="wb", mtime=0
+    ) as dest:
+        shutil.copyfileobj(src, dest)
+    # NOTE: renamed into place so that an interrupted build never leaves
+    # behind a truncated snapshot
+    os.replace(tmp_path, artifact_path)
+
+
+def prune_artifacts(artifact_dir, keep):
+    paths = sorted(
+        glob.glob(os.path.join(artifact_dir, "*.sqlite3.gz")),
+        key=os.path.getmtime,
+        reverse=True,
+    )
+    for path in paths[keep:]:
+        os.remove(path)
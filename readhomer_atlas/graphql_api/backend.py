@@ -0,0 +1,80 @@
+"""
+A GraphQL backend that keeps the most recently used documents parsed and
+validated, so that repeated (and persisted) queries skip straight to
+execution.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import partial
+
+from django.conf import settings
+
+from graphql import parse, validate
+from graphql.backend.base import GraphQLBackend, GraphQLDocument
+from graphql.execution import ExecutionResult, execute
+
+from .limits import validate_cost, validate_depth
+
+
+def get_query_hash(query):
+    return hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+
+def execute_with_limits(schema, document_ast, validation_errors, **kwargs):
+    if validation_errors:
+        return ExecutionResult(errors=validation_errors, invalid=True)
+    cost_errors = validate_cost(
+        schema, document_ast, kwargs.get("variables"), kwargs.get("operation_name")
+    )
+    if cost_errors:
+        return ExecutionResult(errors=cost_errors, invalid=True)
+    return execute(schema, document_ast, **kwargs)
+
+
+class CachedDocumentBackend(GraphQLBackend):
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # query hash -> (document AST, validation errors)
+        self.documents = OrderedDict()
+
+    def get_max_size(self):
+        if self.max_size is None:
+            return settings.GRAPHQL_DOCUMENT_CACHE_SIZE
+        return self.max_size
+
+    def get_validated_document(self, schema, query):
+        key = get_query_hash(query)
+        with self.lock:
+            document = self.documents.get(key)
+            if document is not None:
+                self.documents.move_to_end(key)
+                return document
+
+        # NOTE: syntax errors are raised (and reported by the view) rather
+        # than cached
+        document_ast = parse(query)
+        validation_errors = validate(schema, document_ast)
+        if not validation_errors:
+            validation_errors = validate_depth(schema, document_ast)
+        document = (document_ast, validation_errors)
+
+        with self.lock:
+            self.documents[key] = document
+            while len(self.documents) > self.get_max_size():
+                self.documents.popitem(last=False)
+        return document
+
+    def document_from_string(self, schema, document_string):
+        document_ast, validation_errors = self.get_validated_document(
+            schema, document_string
+        )
+        return GraphQLDocument(
+            schema=schema,
+            document_string=document_string,
+            document_ast=document_ast,
+            execute=partial(
+                execute_with_limits, schema, document_ast, validation_errors
+            ),
+        )
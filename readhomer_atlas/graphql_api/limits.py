@@ -0,0 +1,218 @@
+"""
+Measures the depth and cost of GraphQL operations, so that pathological
+queries can be rejected before they are executed.
+
+The cost of an operation is the number of fields it may resolve: each field
+costs 1, and the fields selected within a connection are multiplied by its
+`first` / `last` argument (or `GRAPHQL_DEFAULT_CONNECTION_SIZE` when neither
+is given, which `ConnectionSizeMiddleware` then passes as `first`, so that
+no connection returns more items than it was costed for).
+"""
+from django.conf import settings
+
+from graphql.error import GraphQLError
+from graphql.language import ast
+from graphql.type.definition import (
+    GraphQLInterfaceType,
+    GraphQLObjectType,
+    get_named_type,
+)
+
+
+# fields that are not counted, along with anything selected within them
+INTROSPECTION_FIELDS = {"__schema", "__type", "__typename"}
+CONNECTION_FIELDS = {"edges", "pageInfo"}
+
+
+def is_connection(graphql_type):
+    graphql_type = get_named_type(graphql_type)
+    if not isinstance(graphql_type, (GraphQLObjectType, GraphQLInterfaceType)):
+        return False
+    return CONNECTION_FIELDS.issubset(graphql_type.fields)
+
+
+def get_argument_value(value, variables):
+    if isinstance(value, ast.Variable):
+        value = variables.get(value.name.value)
+        return value if isinstance(value, int) else None
+    if isinstance(value, ast.IntValue):
+        return int(value.value)
+    return None
+
+
+def get_variable_defaults(operation):
+    defaults = {}
+    for definition in operation.variable_definitions or []:
+        if definition.default_value is not None:
+            defaults[definition.variable.name.value] = get_argument_value(
+                definition.default_value, {}
+            )
+    return defaults
+
+
+class OperationAnalysis:
+    """
+    Walks the selections of an operation, following fragments, to find its
+    depth and cost.  Expects a document that has already been validated.
+    """
+
+    def __init__(self, schema, document_ast, variables=None):
+        self.schema = schema
+        self.fragments = {
+            definition.name.value: definition
+            for definition in document_ast.definitions
+            if isinstance(definition, ast.FragmentDefinition)
+        }
+        self.variables = variables or {}
+
+    def get_root_type(self, operation):
+        if operation.operation == "mutation":
+            return self.schema.get_mutation_type()
+        if operation.operation == "subscription":
+            return self.schema.get_subscription_type()
+        return self.schema.get_query_type()
+
+    def iter_fields(self, selection_set, parent_type):
+        """
+        Yields each field selected from `parent_type`, along with the type
+        it is selected from (which differs within type conditions)
+        """
+        for selection in selection_set.selections:
+            if isinstance(selection, ast.Field):
+                yield selection, parent_type
+                continue
+            if isinstance(selection, ast.FragmentSpread):
+                fragment = self.fragments[selection.name.value]
+            else:
+                fragment = selection
+            fragment_type = parent_type
+            if fragment.type_condition is not None:
+                fragment_type = self.schema.get_type(fragment.type_condition.name.value)
+            yield from self.iter_fields(fragment.selection_set, fragment_type)
+
+    def get_field_type(self, field, parent_type):
+        parent_type = get_named_type(parent_type)
+        fields = getattr(parent_type, "fields", {})
+        if field.name.value not in fields:
+            return None
+        return fields[field.name.value].type
+
+    def get_multiplier(self, field, field_type, variables):
+        if not is_connection(field_type):
+            return 1
+        for argument in field.arguments or []:
+            if argument.name.value in ("first", "last"):
+                value = get_argument_value(argument.value, variables)
+                if value is not None:
+                    return max(value, 0)
+        return settings.GRAPHQL_DEFAULT_CONNECTION_SIZE
+
+    def get_depth(self, selection_set, parent_type):
+        if selection_set is None:
+            return 0
+        depth = 0
+        for field, field_parent_type in self.iter_fields(selection_set, parent_type):
+            if field.name.value in INTROSPECTION_FIELDS:
+                continue
+            field_type = self.get_field_type(field, field_parent_type)
+            depth = max(depth, 1 + self.get_depth(field.selection_set, field_type))
+        return depth
+
+    def get_cost(self, selection_set, parent_type, variables):
+        if selection_set is None:
+            return 0
+        cost = 0
+        for field, field_parent_type in self.iter_fields(selection_set, parent_type):
+            if field.name.value in INTROSPECTION_FIELDS:
+                continue
+            field_type = self.get_field_type(field, field_parent_type)
+            multiplier = self.get_multiplier(field, field_type, variables)
+            cost += 1 + multiplier * self.get_cost(
+                field.selection_set, field_type, variables
+            )
+        return cost
+
+    def depth(self, operation):
+        return self.get_depth(operation.selection_set, self.get_root_type(operation))
+
+    def cost(self, operation):
+        variables = get_variable_defaults(operation)
+        variables.update(self.variables)
+        return self.get_cost(
+            operation.selection_set, self.get_root_type(operation), variables
+        )
+
+
+class ConnectionSizeMiddleware:
+    """
+    Pages connections requested without `first` or `last` by
+    `GRAPHQL_DEFAULT_CONNECTION_SIZE`, as they are costed
+    """
+
+    def resolve(self, next, root, info, **args):
+        if (
+            args.get("first") is None
+            and args.get("last") is None
+            and is_connection(info.return_type)
+        ):
+            args["first"] = settings.GRAPHQL_DEFAULT_CONNECTION_SIZE
+        return next(root, info, **args)
+
+
+def get_operations(document_ast):
+    return [
+        definition
+        for definition in document_ast.definitions
+        if isinstance(definition, ast.OperationDefinition)
+    ]
+
+
+def get_operation(document_ast, operation_name):
+    for operation in get_operations(document_ast):
+        if operation_name is None or (
+            operation.name and operation.name.value == operation_name
+        ):
+            return operation
+    return None
+
+
+def validate_depth(schema, document_ast):
+    """
+    Returns errors for any operation nested more than `GRAPHQL_MAX_DEPTH`
+    fields deep
+    """
+    analysis = OperationAnalysis(schema, document_ast)
+    errors = []
+    for operation in get_operations(document_ast):
+        depth = analysis.depth(operation)
+        if depth > settings.GRAPHQL_MAX_DEPTH:
+            errors.append(
+                GraphQLError(
+                    f"Query depth of {depth} exceeds the maximum of "
+                    f"{settings.GRAPHQL_MAX_DEPTH}",
+                    [operation],
+                )
+            )
+    return errors
+
+
+def validate_cost(schema, document_ast, variables, operation_name):
+    """
+    Returns errors if the operation to be executed costs more than
+    `GRAPHQL_MAX_COST`
+    """
+    operation = get_operation(document_ast, operation_name)
+    if operation is None:
+        # NOTE: reported by the executor
+        return []
+    cost = OperationAnalysis(schema, document_ast, variables).cost(operation)
+    if cost > settings.GRAPHQL_MAX_COST:
+        return [
+            GraphQLError(
+                f"Query cost of {cost} exceeds the maximum of "
+                f"{settings.GRAPHQL_MAX_COST}; request fewer items with "
+                "`first` or `last`",
+                [operation],
+            )
+        ]
+    return []
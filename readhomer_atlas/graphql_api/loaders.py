@@ -0,0 +1,438 @@
+"""
+Batches the nested lookups made while resolving a GraphQL query, which would
+otherwise be made once per parent object:
+
+- related objects (e.g. the text part of each token)
+- pages of connections over reverse foreign keys (e.g. the first tokens of
+  each text part, or of the annotations of each collection)
+- pages of connections over many-to-many fields (e.g. the first text parts
+  of each annotation, or of the annotations of each text part)
+
+Only the requested page of each connection is loaded: rows are numbered
+within each parent by a window function, and only those within the bounds
+given by `first` / `last` / `before` / `after` are selected, along with the
+number of rows for each parent.  Connections that are filtered, or that add
+fields beyond `edges` and `pageInfo`, are resolved as before (as are any
+without `first` or `last`, although `ConnectionSizeMiddleware` gives every
+connection a `first` by default), as are all connections on databases
+without window functions (such as SQLite before 3.25).
+
+Loaders are created per request, so results are only shared within a query.
+"""
+from collections import defaultdict
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections, models
+from django.db.models import Count, F, Window
+from django.db.models.functions import RowNumber
+
+from graphene import Dynamic
+from graphene.relay import PageInfo
+from graphene.utils.str_converters import to_snake_case
+from graphene_django.fields import DjangoConnectionField
+from graphene_django.types import DjangoObjectType
+from graphql_relay.connection.arrayconnection import (
+    connection_from_list_slice,
+    get_offset_with_default,
+)
+from promise import Promise
+from promise.dataloader import DataLoader
+from scaife_viewer.atlas.schema import PassageTextPartConnection
+
+
+# keeps each batch within SQLite's limit on query parameters
+MAX_BATCH_SIZE = 500
+PAGINATION_ARGS = {"first", "last", "before", "after"}
+CONNECTION_FIELDS = {"edges", "page_info"}
+
+
+class ObjectLoader(DataLoader):
+    """
+    Loads objects from `queryset` by primary key
+    """
+
+    max_batch_size = MAX_BATCH_SIZE
+
+    def __init__(self, queryset):
+        self.queryset = queryset
+        super().__init__()
+
+    def batch_load_fn(self, keys):
+        objects = self.queryset.in_bulk(keys)
+        return Promise.resolve([objects.get(key) for key in keys])
+
+
+def get_slice_bounds(args, length):
+    """
+    Returns the offsets of the first and last (exclusive) items of the page
+    selected by `args` from a connection of `length` items, as computed by
+    `connection_from_list_slice`
+    """
+    start = max(get_offset_with_default(args.get("after"), -1), -1) + 1
+    end = min(get_offset_with_default(args.get("before"), length), length)
+    if isinstance(args.get("first"), int):
+        end = min(end, start + args["first"])
+    if isinstance(args.get("last"), int):
+        start = max(start, end - args["last"])
+    return start, end
+
+
+def get_page_condition(args, position, total):
+    """
+    Returns SQL (and its parameters) selecting the rows within the page
+    selected by `args`, given the columns holding each row's 1-based
+    `position` and the `total` rows of its parent; see `get_slice_bounds`
+    """
+    start = max(get_offset_with_default(args.get("after"), -1), -1) + 1
+    # the bounds on the end of the page, other than the total
+    ends = []
+    before = get_offset_with_default(args.get("before"), None)
+    if before is not None:
+        ends.append(before)
+    if isinstance(args.get("first"), int):
+        ends.append(start + args["first"])
+
+    conditions = [f"{position} > %s"]
+    params = [start]
+    for end in ends:
+        conditions.append(f"{position} <= %s")
+        params.append(end)
+    if isinstance(args.get("last"), int):
+        # NOTE: the page ends at the smallest of `ends` and the total
+        last = args["last"]
+        last_conditions = [f"{position} + %s > {total}"]
+        params.append(last)
+        for end in ends:
+            last_conditions.append(f"{position} + %s > %s")
+            params.extend([last, end])
+        conditions.append(f"({' OR '.join(last_conditions)})")
+    return " AND ".join(conditions), params
+
+
+def supports_window_functions(connection):
+    # NOTE: Django 2.2 doesn't declare window functions as supported by
+    # SQLite, which added them in 3.25
+    if connection.vendor == "sqlite":
+        return connection.Database.sqlite_version_info >= (3, 25, 0)
+    return connection.features.supports_over_clause
+
+
+def get_ordering_expressions(ordering):
+    expressions = []
+    for name in ordering:
+        if not isinstance(name, str):
+            expressions.append(name)
+        elif name.startswith("-"):
+            expressions.append(F(name[1:]).desc())
+        else:
+            expressions.append(F(name).asc())
+    return expressions
+
+
+class PageLoader(DataLoader):
+    """
+    Loads the page selected by `args` from the rows of `queryset` related to
+    each key by the `key_field` column, numbered by `ordering`.
+
+    Returns the total number of rows for each key and the value of
+    `value_field` for each row within the page, in order.
+    """
+
+    max_batch_size = MAX_BATCH_SIZE
+
+    def __init__(self, queryset, key_field, value_field, ordering, args):
+        self.queryset = queryset
+        self.key_field = key_field
+        self.value_field = value_field
+        self.ordering = get_ordering_expressions(ordering)
+        self.args = args
+        super().__init__()
+
+    def get_totals(self, keys):
+        return dict(
+            self.queryset.filter(**{f"{self.key_field}__in": keys})
+            .order_by()
+            .values_list(self.key_field)
+            .annotate(total=Count("pk"))
+        )
+
+    def batch_load_fn(self, keys):
+        partition = [F(self.key_field)]
+        numbered = (
+            self.queryset.filter(**{f"{self.key_field}__in": keys})
+            .order_by()
+            .annotate(
+                page_key=F(self.key_field),
+                page_value=F(self.value_field),
+                page_position=Window(
+                    RowNumber(), partition_by=partition, order_by=self.ordering
+                ),
+                page_total=Window(Count("pk"), partition_by=partition),
+            )
+            .values_list("page_key", "page_value", "page_position", "page_total")
+        )
+        sql, params = numbered.query.sql_with_params()
+        # NOTE: window functions can't be filtered on directly
+        condition, condition_params = get_page_condition(
+            self.args, "page_position", "page_total"
+        )
+        with connections[numbered.db].cursor() as cursor:
+            cursor.execute(
+                f"SELECT page_key, page_value, page_total FROM ({sql}) numbered "
+                f"WHERE {condition} ORDER BY page_key, page_position",
+                list(params) + condition_params,
+            )
+            rows = cursor.fetchall()
+
+        totals = {}
+        values = defaultdict(list)
+        for key, value, total in rows:
+            totals[key] = total
+            values[key].append(value)
+        # NOTE: keys with no rows within the page still need their totals
+        missing = [key for key in keys if key not in totals]
+        if missing:
+            totals.update(self.get_totals(missing))
+        return Promise.resolve([(totals.get(key, 0), values[key]) for key in keys])
+
+
+class ReverseRelationPageLoader(PageLoader):
+    """
+    Loads the primary keys of the page of objects in `queryset` related to
+    each key by `field`
+    """
+
+    def __init__(self, queryset, field, args):
+        ordering = queryset.query.order_by or queryset.model._meta.ordering
+        # NOTE: matches the order of the per-object lookups, with ties
+        # broken by primary key so that pages are stable
+        ordering = list(ordering or []) + ["pk"]
+        super().__init__(queryset, field.attname, "pk", ordering, args)
+
+
+class ManyToManyPageLoader(PageLoader):
+    """
+    Loads the primary keys of the page of objects related to each key by a
+    many-to-many `relation` (a field, or the reverse of one), in the order
+    of the per-object lookups
+    """
+
+    def __init__(self, relation, args):
+        if relation.concrete:
+            field = relation
+            source = field.m2m_field_name()
+            target = field.m2m_reverse_field_name()
+        else:
+            field = relation.field
+            source = field.m2m_reverse_field_name()
+            target = field.m2m_field_name()
+        through = field.remote_field.through
+        ordering = self.get_ordering(relation, through, target) + ["pk"]
+        super().__init__(
+            through.objects.all(), f"{source}_id", f"{target}_id", ordering, args
+        )
+
+    def get_ordering(self, relation, through, target):
+        # NOTE: only forward sorted many-to-many fields are ordered by position
+        sort_field_name = getattr(through, "_sort_field_name", None)
+        if sort_field_name and relation.concrete:
+            return [sort_field_name]
+        ordering = []
+        for name in relation.related_model._meta.ordering:
+            descending = name.startswith("-")
+            ordering.append(f"{'-' if descending else ''}{target}__{name.lstrip('-')}")
+        return ordering or [f"{target}_id"]
+
+
+class Loaders:
+    """
+    Holds the loaders for a single request
+    """
+
+    def __init__(self):
+        self.loaders = {}
+
+    def get(self, key, build):
+        loader = self.loaders.get(key)
+        if loader is None:
+            loader = self.loaders[key] = build()
+        return loader
+
+
+def get_loaders(info):
+    loaders = getattr(info.context, "graphql_loaders", None)
+    if loaders is None:
+        loaders = info.context.graphql_loaders = Loaders()
+    return loaders
+
+
+def get_graphene_field(graphene_type, name):
+    field = graphene_type._meta.fields.get(name)
+    if isinstance(field, Dynamic):
+        field = field.get_type()
+    return field
+
+
+def is_plain_connection(graphene_field):
+    connection_type = graphene_field.connection_type
+    if issubclass(connection_type, PassageTextPartConnection):
+        # NOTE: its metadata is resolved from the request's passage
+        return True
+    return set(connection_type._meta.fields) == CONNECTION_FIELDS
+
+
+def has_default_queryset(node_type):
+    return node_type.get_queryset.__func__ is DjangoObjectType.get_queryset.__func__
+
+
+def get_relation(parent_type, field_name):
+    """
+    Returns the model field and graphene field for a relation resolved by
+    default from instances of `parent_type`, or None if it can't be batched
+    """
+    graphene_type = getattr(parent_type, "graphene_type", None)
+    if graphene_type is None or not issubclass(graphene_type, DjangoObjectType):
+        return None
+    name = to_snake_case(field_name)
+    if getattr(graphene_type, f"resolve_{name}", None) is not None:
+        return None
+    graphene_field = get_graphene_field(graphene_type, name)
+    if graphene_field is None or getattr(graphene_field, "resolver", None):
+        return None
+    try:
+        model_field = graphene_type._meta.model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+
+    if model_field.many_to_one and model_field.concrete:
+        return model_field, graphene_field
+    if not isinstance(graphene_field, DjangoConnectionField):
+        return None
+    if not is_plain_connection(graphene_field):
+        return None
+    if model_field.one_to_many or model_field.many_to_many:
+        return model_field, graphene_field
+    return None
+
+
+class DataLoaderMiddleware:
+    def __init__(self):
+        # (parent type name, field name) -> relation (or None)
+        self.relations = {}
+
+    def get_relation(self, info):
+        key = (info.parent_type.name, info.field_name)
+        if key not in self.relations:
+            self.relations[key] = get_relation(info.parent_type, info.field_name)
+        return self.relations[key]
+
+    def resolve(self, next, root, info, **args):
+        if isinstance(root, models.Model):
+            relation = self.get_relation(info)
+            if relation is not None:
+                result = self.load(root, info, args, *relation)
+                if result is not None:
+                    return result
+        return next(root, info, **args)
+
+    def load(self, root, info, args, model_field, graphene_field):
+        loaders = get_loaders(info)
+        if model_field.many_to_one:
+            key = getattr(root, model_field.attname)
+            if key is None or model_field.is_cached(root):
+                return None
+            related_model = model_field.related_model
+            loader = loaders.get(
+                ("objects", related_model),
+                lambda: ObjectLoader(related_model._base_manager.all()),
+            )
+            return loader.load(key)
+
+        if set(args) - PAGINATION_ARGS or not self.is_bounded(graphene_field, args):
+            return None
+
+        node_type = graphene_field.node_type
+        queryset = node_type.get_queryset(
+            node_type._meta.model._default_manager.all(), info
+        )
+        if not supports_window_functions(connections[queryset.db]):
+            # NOTE: pages are numbered with window functions
+            return None
+        args_key = tuple(sorted(args.items()))
+        if model_field.one_to_many:
+            page_loader = loaders.get(
+                ("reverse", model_field, args_key),
+                lambda: ReverseRelationPageLoader(queryset, model_field.field, args),
+            )
+        else:
+            if not has_default_queryset(node_type):
+                # NOTE: the through table can't be filtered by the node's queryset
+                return None
+            page_loader = loaders.get(
+                ("many", model_field, args_key),
+                lambda: ManyToManyPageLoader(model_field, args),
+            )
+        loader = loaders.get(("nodes", node_type), lambda: ObjectLoader(queryset))
+
+        connection_type = graphene_field.connection_type
+
+        def resolve_page(page):
+            total, ids = page
+            return loader.load_many(ids).then(
+                lambda objects: self.resolve_connection(
+                    connection_type, args, total, objects
+                )
+            )
+
+        return page_loader.load(root.pk).then(resolve_page)
+
+    def resolve_connection(self, connection_type, args, total, objects):
+        """
+        Resolves the connection from the objects within the page, as
+        `DjangoConnectionField.resolve_connection` would from all of them
+        """
+        start, _ = get_slice_bounds(args, total)
+        objects = [obj for obj in objects if obj is not None]
+        connection = connection_from_list_slice(
+            objects,
+            args,
+            slice_start=start,
+            list_length=total,
+            list_slice_length=len(objects),
+            connection_type=connection_type,
+            edge_type=connection_type.Edge,
+            pageinfo_type=PageInfo,
+        )
+        connection.iterable = objects
+        connection.length = total
+        return connection
+
+    def is_bounded(self, graphene_field, args):
+        """
+        Returns whether the requested page is bounded and within the
+        connection's limits; otherwise the connection's own resolver loads
+        it (or reports the error)
+        """
+        first = args.get("first")
+        last = args.get("last")
+        if first is None and last is None:
+            return False
+        if (first is not None and first < 0) or (last is not None and last < 0):
+            return False
+        return self.within_limit(graphene_field, args)
+
+    def within_limit(self, graphene_field, args):
+        """
+        Returns whether the requested page is within the connection's limits;
+        otherwise the connection's own resolver reports the error
+        """
+        if graphene_field.enforce_first_or_last and not (
+            args.get("first") or args.get("last")
+        ):
+            return False
+        max_limit = graphene_field.max_limit
+        if not max_limit:
+            return True
+        return (args.get("first") or 0) <= max_limit and (
+            args.get("last") or 0
+        ) <= max_limit
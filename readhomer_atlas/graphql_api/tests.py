@@ -0,0 +1,209 @@
+import json
+import sqlite3
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+import pytest
+from graphql import parse
+from graphql_relay.connection.arrayconnection import (
+    connection_from_list_slice,
+    offset_to_cursor,
+)
+from hypothesis import given
+from hypothesis import strategies as st
+from scaife_viewer.atlas.models import Node, Token
+
+from ..schema import schema
+from . import loaders
+from .limits import (
+    OperationAnalysis,
+    get_operation,
+    validate_cost,
+    validate_depth,
+)
+from .loaders import get_page_condition, get_slice_bounds
+
+
+VERSIONS_QUERY = "{ versions(first: 2) { edges { node { urn } } } }"
+
+offsets = st.none() | st.integers(min_value=-2, max_value=15)
+counts = st.none() | st.integers(min_value=0, max_value=10)
+pagination_args = st.fixed_dictionaries(
+    {"first": counts, "last": counts, "after": offsets, "before": offsets}
+).map(
+    lambda args: {
+        name: offset_to_cursor(value) if name in ("after", "before") else value
+        for name, value in args.items()
+        if value is not None
+    }
+)
+
+
+def analyze(query, variables=None, operation_name=None):
+    document_ast = parse(query)
+    operation = get_operation(document_ast, operation_name)
+    analysis = OperationAnalysis(schema, document_ast, variables)
+    return analysis.depth(operation), analysis.cost(operation)
+
+
+def test_cost_multiplies_connections_by_first():
+    # versions + 2 * (edges + node + urn)
+    assert analyze(VERSIONS_QUERY) == (4, 7)
+
+
+def test_cost_of_unbounded_connections(settings):
+    settings.GRAPHQL_DEFAULT_CONNECTION_SIZE = 10
+    assert analyze("{ versions { edges { node { urn } } } }") == (4, 31)
+
+
+def test_cost_of_nested_connections():
+    query = """
+    {
+        versions(first: 2) {
+            edges { node { urn textAlignmentRecords(last: 3) { edges { node { idx } } } } }
+        }
+    }
+    """
+    # versions + 2 * (edges + node + urn + textAlignmentRecords + 3 * 3)
+    assert analyze(query) == (7, 1 + 2 * (4 + 3 * 3))
+
+
+def test_cost_follows_fragments_and_variables():
+    query = """
+    query Versions($count: Int = 3) { ...versions }
+    fragment versions on Query { versions(first: $count) { edges { node { urn } } } }
+    """
+    assert analyze(query) == (4, 10)
+    assert analyze(query, {"count": 5}) == (4, 16)
+
+
+def test_introspection_is_not_counted():
+    assert analyze(
+        "{ __typename versions(first: 2) { __typename edges { node { urn } } } }"
+    ) == (4, 7)
+
+
+def test_validate_depth(settings):
+    settings.GRAPHQL_MAX_DEPTH = 3
+    errors = validate_depth(schema, parse(VERSIONS_QUERY))
+    assert [error.message for error in errors] == [
+        "Query depth of 4 exceeds the maximum of 3"
+    ]
+    settings.GRAPHQL_MAX_DEPTH = 4
+    assert validate_depth(schema, parse(VERSIONS_QUERY)) == []
+
+
+def test_validate_cost(settings):
+    settings.GRAPHQL_MAX_COST = 6
+    errors = validate_cost(schema, parse(VERSIONS_QUERY), {}, None)
+    assert len(errors) == 1
+    assert errors[0].message.startswith("Query cost of 7 exceeds the maximum of 6")
+    settings.GRAPHQL_MAX_COST = 7
+    assert validate_cost(schema, parse(VERSIONS_QUERY), {}, None) == []
+
+
+@given(pagination_args, st.integers(min_value=0, max_value=12))
+def test_slice_bounds_match_connections(args, length):
+    items = list(range(length))
+    connection = connection_from_list_slice(items, args, list_length=length)
+    start, end = get_slice_bounds(args, length)
+    assert [edge.node for edge in connection.edges] == items[start:end]
+
+
+@given(pagination_args, st.integers(min_value=0, max_value=12))
+def test_page_condition_matches_slice_bounds(args, length):
+    condition, params = get_page_condition(args, "position", "total")
+    db = sqlite3.connect(":memory:")
+    db.execute("CREATE TABLE numbered (position INTEGER, total INTEGER)")
+    db.executemany(
+        "INSERT INTO numbered VALUES (?, ?)",
+        [(position, length) for position in range(1, length + 1)],
+    )
+    rows = db.execute(
+        f"SELECT position FROM numbered WHERE {condition} ORDER BY position".replace(
+            "%s", "?"
+        ),
+        params,
+    ).fetchall()
+    start, end = get_slice_bounds(args, length)
+    assert [position - 1 for position, in rows] == list(range(start, max(start, end)))
+
+
+@pytest.fixture
+def versions(db):
+    work = Node.add_root(urn="urn:cts:", kind="nid")
+    for urn, kind in [
+        ("urn:cts:greekLit:", "namespace"),
+        ("urn:cts:greekLit:tlg0012:", "textgroup"),
+        ("urn:cts:greekLit:tlg0012.tlg001:", "work"),
+    ]:
+        work = work.add_child(urn=urn, kind=kind)
+    return [
+        work.add_child(urn=f"urn:cts:greekLit:tlg0012.tlg001.{name}:", kind="version")
+        for name in ["msA", "perseus-grc2", "perseus-eng3"]
+    ]
+
+
+def post_query(client, query):
+    response = client.post(
+        reverse("graphql_endpoint"),
+        json.dumps({"query": query}),
+        content_type="application/json",
+    )
+    return response.json()
+
+
+def test_connections_are_paged_by_default(client, settings, versions):
+    settings.GRAPHQL_DEFAULT_CONNECTION_SIZE = 2
+    query = "{ versions { edges { node { urn } } pageInfo { hasNextPage } } }"
+    data = post_query(client, query)["data"]["versions"]
+    assert [edge["node"]["urn"] for edge in data["edges"]] == [
+        version.urn for version in versions[:2]
+    ]
+    assert data["pageInfo"]["hasNextPage"]
+
+    data = post_query(client, "{ versions(first: 3) { edges { cursor } } }")
+    assert len(data["data"]["versions"]["edges"]) == 3
+
+
+@pytest.fixture
+def tokens(versions):
+    lines = []
+    for ref in range(1, 4):
+        line = versions[0].add_child(
+            urn=f"{versions[0].urn}1.{ref}", kind="line", ref=f"1.{ref}", rank=1
+        )
+        for position in range(1, 4):
+            Token.objects.create(
+                text_part=line,
+                value=f"word{ref}.{position}",
+                position=position,
+                idx=position - 1,
+            )
+        lines.append(line)
+    return lines
+
+
+@pytest.mark.parametrize("window_functions", [True, False])
+def test_nested_connections_are_paged(client, monkeypatch, tokens, window_functions):
+    monkeypatch.setattr(
+        loaders, "supports_window_functions", lambda connection: window_functions
+    )
+    query = """
+    {
+        textParts(urn_Startswith: "urn:cts:greekLit:tlg0012.tlg001.msA:1.") {
+            edges { node { tokens(last: 2) { edges { node { value } } } } }
+        }
+    }
+    """
+    with CaptureQueriesContext(connection) as queries:
+        edges = post_query(client, query)["data"]["textParts"]["edges"]
+    # NOTE: the text parts are counted and loaded, and then either a page
+    # of tokens and the tokens themselves, or each text part's tokens
+    assert len(queries) == (4 if window_functions else 2 + 2 * len(tokens))
+    assert [
+        [token["node"]["value"] for token in edge["node"]["tokens"]["edges"]]
+        for edge in edges
+    ] == [[f"word{ref}.2", f"word{ref}.3"] for ref in range(1, 4)]
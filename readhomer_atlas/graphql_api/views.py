@@ -0,0 +1,112 @@
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponseBadRequest
+
+from graphene_django.views import GraphQLView, HttpError
+from graphql.error import GraphQLError
+from graphql.execution import ExecutionResult
+
+from ..data_version import WatchedJsonFile
+from .backend import CachedDocumentBackend, get_query_hash
+from .limits import ConnectionSizeMiddleware
+from .loaders import DataLoaderMiddleware
+
+
+# NOTE: the messages expected by Apollo-compatible clients
+PERSISTED_QUERY_NOT_FOUND = "PersistedQueryNotFound"
+PERSISTED_QUERY_HASH_MISMATCH = "provided sha does not match query"
+PERSISTED_QUERY_VERSION = 1
+PERSISTED_QUERY_CACHE = "graphql"
+
+backend = CachedDocumentBackend()
+persisted_queries_file = WatchedJsonFile(
+    lambda: settings.GRAPHQL_PERSISTED_QUERIES_PATH or ""
+)
+
+
+def get_persisted_query_key(query_hash):
+    return f"graphql-persisted-query:{query_hash}"
+
+
+def get_persisted_query(query_hash):
+    """
+    Returns the query persisted under `query_hash` at build time
+    (see `GRAPHQL_PERSISTED_QUERIES_PATH`) or by a client, if any
+    """
+    query = (persisted_queries_file.get() or {}).get(query_hash)
+    if query is None:
+        query = caches[PERSISTED_QUERY_CACHE].get(get_persisted_query_key(query_hash))
+    return query
+
+
+def persist_query(query_hash, query):
+    if not settings.GRAPHQL_PERSISTED_QUERY_REGISTRATION:
+        return
+    if (persisted_queries_file.get() or {}).get(query_hash) == query:
+        return
+    caches[PERSISTED_QUERY_CACHE].set(get_persisted_query_key(query_hash), query)
+
+
+def get_persisted_query_hash(request, data):
+    """
+    Returns the hash of the persisted query from the request's `extensions`,
+    if any
+    """
+    extensions = request.GET.get("extensions") or data.get("extensions")
+    if not extensions:
+        return None
+    if isinstance(extensions, str):
+        try:
+            extensions = json.loads(extensions)
+        except ValueError:
+            raise HttpError(HttpResponseBadRequest("Extensions are invalid JSON."))
+    persisted_query = extensions.get("persistedQuery") or {}
+    if persisted_query.get("version") != PERSISTED_QUERY_VERSION:
+        return None
+    return persisted_query.get("sha256Hash")
+
+
+class AtlasGraphQLView(GraphQLView):
+    """
+    Serves the atlas schema with request-scoped dataloaders, depth and cost
+    limits, and persisted queries: queries are registered by sending them
+    along with their SHA-256 hash (in `extensions.persistedQuery`), and
+    then requested by hash alone.
+
+    Registered queries are held by each process for a limited time, so
+    clients re-send them after a `PersistedQueryNotFound` error; queries
+    listed in `GRAPHQL_PERSISTED_QUERIES_PATH` are always available.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault("backend", backend)
+        # NOTE: the last middleware is the outermost, so that connections
+        # are paged before their loaders are chosen
+        kwargs.setdefault(
+            "middleware", [DataLoaderMiddleware(), ConnectionSizeMiddleware()]
+        )
+        super().__init__(**kwargs)
+
+    def execute_graphql_request(
+        self, request, data, query, variables, operation_name, show_graphiql=False
+    ):
+        query_hash = get_persisted_query_hash(request, data)
+        if query_hash is not None:
+            if query:
+                if get_query_hash(query) != query_hash:
+                    return ExecutionResult(
+                        errors=[GraphQLError(PERSISTED_QUERY_HASH_MISMATCH)],
+                        invalid=True,
+                    )
+                persist_query(query_hash, query)
+            else:
+                query = get_persisted_query(query_hash)
+                if query is None:
+                    return ExecutionResult(
+                        errors=[GraphQLError(PERSISTED_QUERY_NOT_FOUND)]
+                    )
+        return super().execute_graphql_request(
+            request, data, query, variables, operation_name, show_graphiql
+        )
@@ -1,6 +1,8 @@
 from posixpath import join as urljoin
 from urllib.parse import quote_plus, unquote
 
+from django.utils.functional import cached_property
+
 
 class IIIFResolver:
     BASE_URL = "https://image.library.jhu.edu/iiif/"
@@ -18,28 +20,31 @@ class IIIFResolver:
     def __init__(self, urn):
         """
         IIIFResolver("urn:cite2:hmt:vaimg.2017a:VA012VN_0514")
+
+        URLs are computed once per instance, since resolvers are shared
+        across annotations on the same folio.
         """
         self.urn = urn
 
-    @property
+    @cached_property
     def munged_image_path(self):
         image_part = self.urn.rsplit(":", maxsplit=1).pop()
         return image_part.replace("_", "-")
 
-    @property
+    @cached_property
     def collection_manifest_url(self):
         return urljoin(self.CANVAS_BASE_URL, self.COLLECTION_SUBDIR, "manifest")
 
-    @property
+    @cached_property
     def iiif_image_id(self):
         path = urljoin(self.COLLECTION_SUBDIR, self.munged_image_path)
         return quote_plus(path)
 
-    @property
+    @cached_property
     def identifier(self):
         return urljoin(self.BASE_URL, self.iiif_image_id)
 
-    @property
+    @cached_property
     def info_url(self):
         info_path = "image.json"
         return urljoin(self.identifier, info_path)
@@ -53,11 +58,11 @@ class IIIFResolver:
             "{region}/{size}/{rotation}/{quality}.{format}".format(**iruri_kwargs),
         )
 
-    @property
+    @cached_property
     def image_url(self):
         return self.build_image_request_url()
 
-    @property
+    @cached_property
     def canvas_url(self):
         path = unquote(self.iiif_image_id)
         return urljoin(self.CANVAS_BASE_URL, path, "canvas")
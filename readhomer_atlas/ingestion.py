@@ -0,0 +1,326 @@
+"""
+Declares the steps run by the `prepare_db` management command, along with
+the steps each depends on, and schedules independent steps concurrently.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connections
+
+from contexttimer import Timer
+from scaife_viewer.atlas import tokenizers
+from scaife_viewer.atlas.importers import (
+    alignments,
+    audio_annotations,
+    image_annotations,
+    metrical_annotations,
+    named_entities,
+    text_annotations,
+    token_annotations,
+    versions,
+)
+
+from .data_version import get_code_version, hash_file, iter_data_files
+
+
+def build_web_annotation_index(reset=False):
+    # NOTE: the index is always rebuilt from scratch
+    call_command("build_web_annotation_index")
+
+
+# NOTE: steps are listed in the order they were historically run serially;
+# `exclusive` steps run in the main process while no other step is running.
+# `data_paths` are the directories under SV_ATLAS_DATA_DIR read by each step;
+# see `get_incremental_steps`.
+# `deferred_indexes` are tables that only the step reads from or writes to
+# while it runs; see `BulkLoader`
+STEPS = [
+    {
+        "name": "versions",
+        "label": "Loading versions",
+        "callback": versions.import_versions,
+        "depends_on": [],
+        "data_paths": ["library"],
+    },
+    {
+        "name": "text_annotations",
+        "label": "Loading text annotations",
+        "callback": text_annotations.import_text_annotations,
+        "depends_on": ["versions"],
+        "data_paths": [
+            os.path.join("annotations", "text-annotations"),
+            os.path.join("annotations", "syntax-trees"),
+        ],
+    },
+    {
+        "name": "metrical_annotations",
+        "label": "Loading metrical annotations",
+        "callback": metrical_annotations.import_metrical_annotations,
+        "depends_on": ["versions"],
+        "data_paths": [os.path.join("annotations", "metrical-annotations")],
+    },
+    {
+        "name": "image_annotations",
+        "label": "Loading image annotations",
+        "callback": image_annotations.import_image_annotations,
+        "depends_on": ["versions"],
+        "data_paths": [os.path.join("annotations", "image-annotations")],
+        "deferred_indexes": ["scaife_viewer_atlas_imageroi_text_parts"],
+    },
+    {
+        "name": "audio_annotations",
+        "label": "Loading audio annotations",
+        "callback": audio_annotations.import_audio_annotations,
+        "depends_on": ["versions"],
+        "data_paths": [os.path.join("annotations", "audio-annotations")],
+    },
+    {
+        "name": "tokenization",
+        "label": "Tokenizing versions/exemplars",
+        "callback": tokenizers.tokenize_all_text_parts,
+        "depends_on": [
+            "text_annotations",
+            "metrical_annotations",
+            "image_annotations",
+            "audio_annotations",
+        ],
+        # NOTE: Tokenizing should never be ran in parallel, because
+        # it is already parallel
+        "exclusive": True,
+        "data_paths": [],
+        "deferred_indexes": ["scaife_viewer_atlas_token"],
+    },
+    {
+        "name": "token_annotations",
+        "label": "Loading token annotations",
+        "callback": token_annotations.apply_token_annotations,
+        "depends_on": ["tokenization"],
+        "data_paths": [os.path.join("annotations", "token-annotations")],
+        "deferred_indexes": ["scaife_viewer_atlas_tokenannotation"],
+    },
+    {
+        "name": "named_entities",
+        "label": "Loading named entity annotations",
+        "callback": named_entities.apply_named_entities,
+        "depends_on": ["tokenization"],
+        "data_paths": [os.path.join("annotations", "named-entities")],
+        "deferred_indexes": ["scaife_viewer_atlas_namedentity_tokens"],
+    },
+    {
+        "name": "alignments",
+        "label": "Loading alignments",
+        "callback": alignments.process_alignments,
+        "depends_on": ["tokenization"],
+        "data_paths": ["alignments", os.path.join("annotations", "text-alignments")],
+        "deferred_indexes": ["scaife_viewer_atlas_textalignmentrecordrelation_tokens"],
+    },
+    {
+        "name": "web_annotation_index",
+        "label": "Indexing web annotations",
+        "callback": build_web_annotation_index,
+        "depends_on": [
+            "image_annotations",
+            "audio_annotations",
+            "token_annotations",
+            "named_entities",
+            "alignments",
+        ],
+        "data_paths": [],
+    },
+]
+STEPS_BY_NAME = {step["name"]: step for step in STEPS}
+
+
+def run_step(name, reset=False):
+    """
+    Runs a step and returns its elapsed time; module-level so that it can
+    be sent to worker processes
+    """
+    step = STEPS_BY_NAME[name]
+    with Timer() as t:
+        if reset:
+            step["callback"](reset=True)
+        else:
+            step["callback"]()
+    return t.elapsed
+
+
+def build_manifest():
+    """
+    Returns the code version and a content hash for every file under
+    SV_ATLAS_DATA_DIR, keyed by path relative to it
+    """
+    files = {}
+    for path in iter_data_files(settings.SV_ATLAS_DATA_DIR):
+        relpath = os.path.relpath(path, settings.SV_ATLAS_DATA_DIR)
+        files[relpath] = hash_file(path, hashlib.sha256()).hexdigest()
+    return {"code_version": get_code_version(), "files": files}
+
+
+def load_manifest():
+    try:
+        with open(settings.INGESTION_MANIFEST_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_manifest(manifest):
+    with open(settings.INGESTION_MANIFEST_PATH, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def remove_manifest():
+    if os.path.exists(settings.INGESTION_MANIFEST_PATH):
+        os.remove(settings.INGESTION_MANIFEST_PATH)
+
+
+def get_changed_paths(previous, current):
+    previous_files = previous["files"]
+    current_files = current["files"]
+    return {
+        path
+        for path in set(previous_files) | set(current_files)
+        if previous_files.get(path) != current_files.get(path)
+    }
+
+
+def get_step_for_path(path):
+    for step in STEPS:
+        for data_path in step["data_paths"]:
+            if path.startswith(f"{data_path}{os.sep}"):
+                return step
+    return None
+
+
+def get_incremental_steps(previous, current):
+    """
+    Returns the steps that must be re-run to bring a database built from the
+    `previous` manifest up to date with the `current` one, or None if a full
+    rebuild is required.
+
+    Importers are re-run with `reset=True`, which replaces everything they
+    previously imported.  Tokens are only rebuilt by a full rebuild, since
+    they (and every annotation on them) are derived from the versions.
+    """
+    if previous is None or previous["code_version"] != current["code_version"]:
+        return None
+
+    changed_steps = set()
+    for path in get_changed_paths(previous, current):
+        step = get_step_for_path(path)
+        if step is None or step["name"] == "versions":
+            return None
+        changed_steps.add(step["name"])
+
+    if not changed_steps:
+        return []
+    # NOTE: the web annotation index is derived from the other steps
+    changed_steps.add("web_annotation_index")
+    return [step for step in STEPS if step["name"] in changed_steps]
+
+
+class StepScheduler:
+    """
+    Runs steps as soon as their dependencies have completed, with up to
+    `concurrency` steps running at once in worker processes.
+
+    SQLite serializes writes across processes; concurrent steps wait on
+    each other's write transactions for up to the database `timeout`.
+    """
+
+    def __init__(
+        self,
+        steps,
+        concurrency,
+        reset=False,
+        profiler=None,
+        on_start=None,
+        on_complete=None,
+    ):
+        self.steps = steps
+        # NOTE: profiled steps run serially in this process; see StepProfiler
+        self.concurrency = 1 if profiler else concurrency
+        self.reset = reset
+        self.profiler = profiler
+        self.on_start = on_start or (lambda step: None)
+        self.on_complete = on_complete or (lambda step, elapsed: None)
+
+        self.steps_by_name = {step["name"]: step for step in steps}
+        # NOTE: dependencies outside of `steps` are assumed to be satisfied
+        self.dependencies = {
+            step["name"]: set(step["depends_on"]) & set(self.steps_by_name)
+            for step in steps
+        }
+
+    def get_ready(self, completed, running):
+        return [
+            step
+            for step in self.steps
+            if step["name"] not in completed
+            and step["name"] not in running
+            and self.dependencies[step["name"]] <= completed
+        ]
+
+    def run_in_process(self, step):
+        self.on_start(step)
+        context = self.profiler.profile(step) if self.profiler else nullcontext()
+        with context:
+            elapsed = run_step(step["name"], reset=self.reset)
+        # NOTE: ensures worker processes are never forked with an open connection
+        connections.close_all()
+        self.on_complete(step, elapsed)
+
+    def run_serial(self):
+        completed = set()
+        while len(completed) < len(self.steps):
+            ready = self.get_ready(completed, set())
+            if not ready:
+                raise RuntimeError("Could not resolve step dependencies")
+            self.run_in_process(ready[0])
+            completed.add(ready[0]["name"])
+
+    def run(self):
+        if self.concurrency <= 1:
+            return self.run_serial()
+
+        # worker processes open their own connections after forking
+        connections.close_all()
+        completed = set()
+        running = {}
+        context = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(self.concurrency, mp_context=context) as executor:
+            while len(completed) < len(self.steps):
+                ready = self.get_ready(completed, running)
+                exclusive = [step for step in ready if step.get("exclusive")]
+                if exclusive and not running:
+                    self.run_in_process(exclusive[0])
+                    completed.add(exclusive[0]["name"])
+                    continue
+
+                for step in ready:
+                    if step.get("exclusive") or len(running) >= self.concurrency:
+                        continue
+                    self.on_start(step)
+                    running[step["name"]] = executor.submit(
+                        run_step, step["name"], reset=self.reset
+                    )
+
+                if not running:
+                    raise RuntimeError("Could not resolve step dependencies")
+
+                done, _ = wait(running.values(), return_when=FIRST_COMPLETED)
+                for name, future in list(running.items()):
+                    if future not in done:
+                        continue
+                    del running[name]
+                    # re-raises any exception from the worker process
+                    elapsed = future.result()
+                    completed.add(name)
+                    self.on_complete(self.steps_by_name[name], elapsed)
@@ -0,0 +1,288 @@
+import json
+import math
+import statistics
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from ...data_version import get_data_version
+from ...web_annotation.models import FolioAnnotation, FolioAnnotationCollection
+from ...web_annotation.utils import folio_exemplar_urn_to_site_urn
+
+
+# NOTE: cache_page binds its cache when the views module is imported, so the
+# benchmark cache must be configured before the URLconf is loaded
+BENCHMARK_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "benchmark_endpoints",
+    }
+}
+
+
+def percentile(samples, pct):
+    """
+    Nearest-rank percentile
+    """
+    ordered = sorted(samples)
+    index = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    """
+    Measures latency and query counts for the web annotation and TOC endpoints
+    against the current database
+    """
+
+    help = "Measures latency and query counts for the web annotation and TOC endpoints"
+    # NOTE: the URL checks would load the URLconf; see BENCHMARK_CACHES
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--iterations",
+            type=int,
+            default=20,
+            help="Number of requests to time per URL",
+        )
+        parser.add_argument(
+            "--folios",
+            type=int,
+            default=3,
+            help="Number of folios to sample per annotation kind",
+        )
+        parser.add_argument(
+            "--warm",
+            action="store_true",
+            help="Measure cached responses instead of clearing the cache before each request",
+        )
+        parser.add_argument("--output", help="Path to write the JSON results to")
+        parser.add_argument(
+            "--compare", help="Path to previous JSON results to compare against"
+        )
+        parser.add_argument(
+            "--budget",
+            help="Path to a JSON file of maximum query counts per endpoint; "
+            "exits with an error when any are exceeded",
+        )
+        parser.add_argument(
+            "--record-budget",
+            action="store_true",
+            help="Write the measured query counts to --budget instead of checking them",
+        )
+
+    def get_urls(self, folio_count):
+        """
+        Yields (endpoint, url) for a deterministic sample of folios
+        """
+        collections = (
+            FolioAnnotationCollection.objects.filter(count__gt=0)
+            .order_by("annotation_kind", "folio_urn")
+            .values_list("annotation_kind", "folio_urn", "canvas_identifier")
+        )
+        sampled = {}
+        for annotation_kind, folio_urn, canvas_identifier in collections:
+            folios = sampled.setdefault(annotation_kind, [])
+            if len(folios) < folio_count:
+                folios.append((folio_urn, canvas_identifier))
+
+        discovery_url = reverse("web_annotation_discovery")
+        for annotation_kind, folios in sampled.items():
+            for folio_urn, canvas_identifier in folios:
+                urn = folio_exemplar_urn_to_site_urn(folio_urn)
+                args = [urn, annotation_kind]
+                yield (
+                    f"serve_web_annotation_collection:{annotation_kind}",
+                    reverse("serve_web_annotation_collection", args=args),
+                )
+                yield (
+                    f"serve_web_annotation_page:{annotation_kind}",
+                    reverse("serve_web_annotation_page", args=args + [0]),
+                )
+                idx = (
+                    FolioAnnotation.objects.filter(
+                        folio_urn=folio_urn, annotation_kind=annotation_kind
+                    )
+                    .values_list("idx", flat=True)
+                    .first()
+                )
+                yield (
+                    f"serve_web_annotation:{annotation_kind}",
+                    reverse("serve_web_annotation", args=args + [idx]),
+                )
+                yield (
+                    "web_annotation_discovery",
+                    f"{discovery_url}?{urlencode({'canvas_id': canvas_identifier})}",
+                )
+
+        yield "tocs_index", reverse("tocs_index")
+
+    def get_toc_urls(self, client):
+        try:
+            response = client.get(reverse("tocs_index"))
+        except Exception:
+            return
+        if response.status_code != 200:
+            return
+        for url in json.loads(response.content)["tocs"][:1]:
+            yield "serve_toc", url
+
+    def request(self, client, url):
+        try:
+            response = client.get(url)
+        except Exception as e:
+            return repr(e)
+        if response.streaming:
+            b"".join(response.streaming_content)
+        return response.status_code
+
+    def measure(self, client, url, iterations, warm):
+        if warm:
+            self.request(client, url)
+        timings = []
+        queries = 0
+        status = None
+        for _ in range(iterations):
+            if not warm:
+                cache.clear()
+            with CaptureQueriesContext(connection) as ctx:
+                start = time.perf_counter()
+                status = self.request(client, url)
+                timings.append((time.perf_counter() - start) * 1000)
+            queries = max(queries, len(ctx.captured_queries))
+            if status != 200:
+                break
+        return {"status": status, "timings": timings, "queries": queries}
+
+    def run(self, options):
+        client = Client()
+        urls = list(self.get_urls(options["folios"]))
+        urls.extend(self.get_toc_urls(client))
+
+        samples = {}
+        for endpoint, url in urls:
+            result = self.measure(client, url, options["iterations"], options["warm"])
+            sample = samples.setdefault(
+                endpoint, {"urls": [], "timings": [], "queries": 0, "errors": []}
+            )
+            sample["urls"].append(url)
+            if result["status"] != 200:
+                sample["errors"].append({"url": url, "status": result["status"]})
+                continue
+            sample["timings"].extend(result["timings"])
+            sample["queries"] = max(sample["queries"], result["queries"])
+
+        results = {}
+        for endpoint, sample in samples.items():
+            timings = sample["timings"]
+            results[endpoint] = {
+                "urls": len(sample["urls"]),
+                "requests": len(timings),
+                "p50_ms": percentile(timings, 50) if timings else None,
+                "p95_ms": percentile(timings, 95) if timings else None,
+                "mean_ms": statistics.mean(timings) if timings else None,
+                "queries": sample["queries"] if timings else None,
+                "errors": sample["errors"],
+            }
+        return results
+
+    def format_ms(self, value):
+        return "-" if value is None else f"{value:.1f}"
+
+    def report(self, results, previous=None):
+        previous = previous or {}
+        for endpoint, result in sorted(results.items()):
+            line = (
+                f"{endpoint}: [p50={self.format_ms(result['p50_ms'])}ms "
+                f"p95={self.format_ms(result['p95_ms'])}ms "
+                f"queries={result['queries']} errors={len(result['errors'])}]"
+            )
+            before = previous.get(endpoint)
+            if before and before["p50_ms"] and result["p50_ms"]:
+                change = (result["p50_ms"] - before["p50_ms"]) / before["p50_ms"]
+                line += (
+                    f" [p50_change={change:+.0%} "
+                    f"queries_before={before['queries']}]"
+                )
+            self.stdout.write(line)
+
+    def check_budget(self, results, budget_path):
+        with open(budget_path) as f:
+            budget = json.load(f)
+        failures = []
+        for endpoint, result in sorted(results.items()):
+            # NOTE: an endpoint that errors issues no queries, so it would
+            # otherwise always be within budget
+            for error in result["errors"]:
+                failures.append(
+                    f"{endpoint} [url={error['url']} status={error['status']}]"
+                )
+        for endpoint, max_queries in sorted(budget.items()):
+            queries = results.get(endpoint, {}).get("queries")
+            if queries is None:
+                failures.append(f"{endpoint} [queries=unmeasured budget={max_queries}]")
+            elif queries > max_queries:
+                failures.append(f"{endpoint} [queries={queries} budget={max_queries}]")
+        if failures:
+            raise CommandError("Query budget not met: " + ", ".join(failures))
+        self.stdout.write(f"Query budget met: [endpoints={len(budget)}]")
+
+    def record_budget(self, results, budget_path):
+        budget = {
+            endpoint: result["queries"]
+            for endpoint, result in sorted(results.items())
+            if result["queries"] is not None
+        }
+        with open(budget_path, "w") as f:
+            json.dump(budget, f, indent=2, sort_keys=True)
+            f.write("\n")
+        self.stdout.write(f"Recorded query budget to {budget_path}")
+
+    def handle(self, *args, **options):
+        if "readhomer_atlas.urls" in sys.modules:
+            raise CommandError(
+                "The URLconf was loaded before the benchmark cache was configured"
+            )
+        if options["record_budget"] and not options["budget"]:
+            raise CommandError("--record-budget requires --budget")
+
+        # NOTE: bypasses pre-rendered files and the shared cache, so that the
+        # views themselves are measured
+        with tempfile.TemporaryDirectory() as prerender_dir, override_settings(
+            ALLOWED_HOSTS=settings.ALLOWED_HOSTS + ["testserver"],
+            CACHES=BENCHMARK_CACHES,
+            WEB_ANNOTATION_PRERENDER_DIR=prerender_dir,
+        ):
+            results = self.run(options)
+
+        previous = None
+        if options["compare"]:
+            with open(options["compare"]) as f:
+                previous = json.load(f)["results"]
+        self.report(results, previous)
+
+        if options["output"]:
+            data_version = get_data_version()
+            data = {
+                "iterations": options["iterations"],
+                "warm": options["warm"],
+                "data_version": data_version["version"] if data_version else None,
+                "results": results,
+            }
+            with open(options["output"], "w") as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+
+        if options["record_budget"]:
+            self.record_budget(results, options["budget"])
+        elif options["budget"]:
+            self.check_budget(results, options["budget"])
@@ -0,0 +1,83 @@
+import os
+import re
+import shutil
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ...data_version import iter_data_files
+
+
+# NOTE: image and text annotations are stored one file per folio, e.g.
+# `...msA-folios-VA012RN_0013.json` (12r) and `...msA-12r.json`; every
+# other file is shared by all folios and is always copied
+IMAGE_ANNOTATION_FOLIO_RE = re.compile(r"-VA(\d+)([RV])N_\d+\.json$")
+TEXT_ANNOTATION_FOLIO_RE = re.compile(r"-(\d+[rv])\.json$")
+FOLIO_DIRECTORIES = {
+    os.path.join("annotations", "image-annotations"),
+    os.path.join("annotations", "text-annotations"),
+}
+DEFAULT_FOLIOS = ["12r", "12v"]
+
+
+def get_folio(relpath):
+    """
+    Returns the folio (e.g. "12r") that the data file at `relpath` belongs to,
+    or None if it isn't specific to a folio
+    """
+    if os.path.dirname(relpath) not in FOLIO_DIRECTORIES:
+        return None
+    match = IMAGE_ANNOTATION_FOLIO_RE.search(relpath)
+    if match:
+        return f"{int(match.group(1))}{match.group(2).lower()}"
+    match = TEXT_ANNOTATION_FOLIO_RE.search(relpath)
+    if match:
+        return match.group(1)
+    return None
+
+
+class Command(BaseCommand):
+    """
+    Copies the data for a few folios into a directory laid out like `data/`,
+    for building a small database to benchmark or test against
+    """
+
+    help = "Copies the data for a few folios into a directory laid out like data/"
+
+    def add_arguments(self, parser):
+        parser.add_argument("output_dir", help="Directory to copy the data to")
+        parser.add_argument(
+            "--folio",
+            action="append",
+            dest="folios",
+            help=f"Folio(s) to copy annotations for (default: {', '.join(DEFAULT_FOLIOS)})",
+        )
+        parser.add_argument(
+            "--source-dir",
+            default=settings.SV_ATLAS_DATA_DIR,
+            help="Directory to copy the data from",
+        )
+
+    def handle(self, *args, **options):
+        output_dir = options["output_dir"]
+        if os.path.exists(output_dir) and os.listdir(output_dir):
+            raise CommandError(f"{output_dir} is not empty")
+        folios = set(options["folios"] or DEFAULT_FOLIOS)
+
+        source_dir = options["source_dir"]
+        copied = 0
+        skipped = 0
+        for path in iter_data_files(source_dir):
+            relpath = os.path.relpath(path, source_dir)
+            folio = get_folio(relpath)
+            if folio is not None and folio not in folios:
+                skipped += 1
+                continue
+            destination = os.path.join(output_dir, relpath)
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            shutil.copy2(path, destination)
+            copied += 1
+        self.stdout.write(
+            f"Copied data subset: [copied={copied} skipped={skipped} "
+            f"output_dir={output_dir}]"
+        )
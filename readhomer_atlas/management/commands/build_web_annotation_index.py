@@ -0,0 +1,111 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from scaife_viewer.atlas.models import ImageAnnotation, Node
+
+from ...web_annotation.generators import clear_folio_caches
+from ...web_annotation.models import (
+    FolioAnnotation,
+    FolioAnnotationCollection,
+    FolioLineROI,
+)
+from ...web_annotation.shims import SHIM_CLASSES
+
+
+FOLIO_EXEMPLAR_URN = "urn:cts:greekLit:tlg0012.tlg001.msA-folios:"
+
+
+class Command(BaseCommand):
+    """
+    Builds the (folio_urn, annotation_kind, idx), line ROI and
+    collection availability indexes used by the web_annotation views
+    """
+
+    help = "Builds the indexes used by the web_annotation views"
+
+    def build_folio_line_rois(self):
+        text_parts = Node.objects.filter(
+            urn__startswith=FOLIO_EXEMPLAR_URN
+        ).prefetch_related("roi")
+        to_create = []
+        for text_part in text_parts:
+            _, ref = text_part.urn.rsplit(":", maxsplit=1)
+            if "." not in ref:
+                continue
+            # @@@ strip folios
+            ref = ref.split(".", maxsplit=1)[1]
+            for roi_obj in text_part.roi.all():
+                x, y, w, h = [
+                    float(part) for part in roi_obj.coordinates_value.split(",")
+                ]
+                to_create.append(
+                    FolioLineROI(
+                        ref=ref,
+                        surface_urn=roi_obj.data["urn:cite2:hmt:va_dse.v1.surface:"],
+                        text_part_pk=text_part.pk,
+                        roi_pk=roi_obj.pk,
+                        coordinates_value=roi_obj.coordinates_value,
+                        x=x,
+                        y=y,
+                        w=w,
+                        h=h,
+                    )
+                )
+        with transaction.atomic():
+            FolioLineROI.objects.all().delete()
+            FolioLineROI.objects.bulk_create(to_create, batch_size=500)
+        self.stdout.write(f"Indexed line ROIs: [count={len(to_create)}]")
+
+    def build_folio_annotations(self):
+        folio_urns = Node.objects.filter(
+            urn__startswith=FOLIO_EXEMPLAR_URN, kind="folio"
+        ).values_list("urn", flat=True)
+
+        counts = {}
+        with transaction.atomic():
+            FolioAnnotation.objects.all().delete()
+            for folio_urn in folio_urns:
+                for shim_class in SHIM_CLASSES:
+                    shim = shim_class(folio_urn)
+                    if not shim.line_urns:
+                        continue
+                    entries = FolioAnnotation.objects.bulk_create(
+                        shim.build_index_entries(), batch_size=500
+                    )
+                    counts.setdefault(folio_urn, {})[shim.annotation_kind] = len(
+                        entries
+                    )
+        created = sum(sum(kinds.values()) for kinds in counts.values())
+        self.stdout.write(f"Indexed web annotations: [count={created}]")
+        return counts
+
+    def build_folio_annotation_collections(self, counts):
+        image_annotations = ImageAnnotation.objects.prefetch_related("text_parts")
+        to_create = []
+        for image_annotation in image_annotations:
+            text_parts = image_annotation.text_parts.all()
+            if not text_parts:
+                continue
+            folio_urn = text_parts[0].urn
+            for annotation_kind, count in counts.get(folio_urn, {}).items():
+                to_create.append(
+                    FolioAnnotationCollection(
+                        canvas_identifier=image_annotation.canvas_identifier,
+                        folio_urn=folio_urn,
+                        annotation_kind=annotation_kind,
+                        count=count,
+                    )
+                )
+        with transaction.atomic():
+            FolioAnnotationCollection.objects.all().delete()
+            FolioAnnotationCollection.objects.bulk_create(to_create, batch_size=500)
+        self.stdout.write(
+            f"Indexed web annotation collections: [count={len(to_create)}]"
+        )
+
+    def handle(self, *args, **options):
+        self.build_folio_line_rois()
+        counts = self.build_folio_annotations()
+        self.build_folio_annotation_collections(counts)
+
+        clear_folio_caches()
@@ -0,0 +1,53 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from ...web_annotation.export import (
+    EXPORT_KINDS,
+    iter_annotations,
+    iter_ndjson,
+)
+
+
+class Command(BaseCommand):
+    """
+    Writes every Web Annotation as newline-delimited JSON-LD
+    """
+
+    help = "Writes every Web Annotation as newline-delimited JSON-LD"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--kind",
+            action="append",
+            dest="kinds",
+            choices=EXPORT_KINDS,
+            help="Only export the given annotation kind(s)",
+        )
+        parser.add_argument(
+            "--output", help="Path to write to (defaults to standard output)"
+        )
+
+    def handle(self, *args, **options):
+        self.skipped = 0
+
+        def on_error(annotation_kind, urn, idx, e):
+            self.skipped += 1
+            self.stderr.write(f"Could not export {urn} {annotation_kind} {idx}: {e!r}")
+
+        exported = 0
+        annotations = iter_annotations(options["kinds"], on_error=on_error)
+        if options["output"]:
+            f = open(options["output"], "wb")
+        else:
+            f = sys.stdout.buffer
+        try:
+            for line in iter_ndjson(annotations):
+                f.write(line)
+                exported += 1
+        finally:
+            if options["output"]:
+                f.close()
+        self.stderr.write(
+            f"Exported web annotations: [exported={exported} skipped={self.skipped}]"
+        )
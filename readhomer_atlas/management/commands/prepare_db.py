@@ -2,11 +2,32 @@ import multiprocessing
 import os
 
 from django.conf import settings
+from django.core.cache import cache
 from django.core.management import call_command
 from django.core.management.base import BaseCommand
+from django.db import connections
 
 from contexttimer import Timer
-from scaife_viewer.atlas import importers, tokenizers
+
+from ...bulk_load import BulkLoader
+from ...data_version import remove_data_version, write_data_version
+from ...db_artifacts import (
+    compute_artifact_key,
+    get_artifact_path,
+    prune_artifacts,
+    restore_artifact,
+    store_artifact,
+)
+from ...ingestion import (
+    STEPS,
+    StepScheduler,
+    build_manifest,
+    get_incremental_steps,
+    load_manifest,
+    remove_manifest,
+    write_manifest,
+)
+from ...profiling import StepProfiler
 
 
 class Command(BaseCommand):
@@ -19,76 +40,161 @@ class Command(BaseCommand):
     def emit_log(self, func_name, elapsed):
         self.stdout.write(f"Step completed: [func={func_name} elapsed={elapsed:.2f}]")
 
-    def do_step(self, label, callback):
+    def start_step(self, step):
+        self.stdout.write(f"--[{step['label']}]--")
+        if self.bulk_loader and not self.reset:
+            self.bulk_loader.drop_indexes(step)
+
+    def complete_step(self, step, elapsed):
+        if self.bulk_loader and not self.reset:
+            self.bulk_loader.create_indexes(step)
+        self.emit_log(step["callback"].__name__, elapsed)
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help="Only re-run the steps whose data files changed since the last build",
+        )
+        parser.add_argument(
+            "--bulk-load",
+            action="store_true",
+            help="Relax durability and defer indexes while loading, then ANALYZE and VACUUM",
+        )
+        parser.add_argument(
+            "--profile",
+            action="store_true",
+            help="Record per-step resource usage; runs every step serially",
+        )
+        parser.add_argument(
+            "--profile-output",
+            default="prepare_db_profile.json",
+            help="Path to write the --profile JSON report to",
+        )
+        parser.add_argument(
+            "--cprofile-dir",
+            help="With --profile, also write cProfile stats for each step to this directory",
+        )
+        parser.add_argument(
+            "--artifact-dir",
+            default=settings.DB_ARTIFACT_DIR,
+            help="Restore the database from a snapshot in this directory when its inputs "
+            "are unchanged, and store a snapshot after building it",
+        )
+
+    def get_incremental_steps(self, manifest):
+        if not os.path.exists("db.sqlite3"):
+            return None
+        steps = get_incremental_steps(load_manifest(), manifest)
+        if steps is None:
+            self.stdout.write("--[Full rebuild required]--")
+        return steps
+
+    def restore_artifact(self, artifact_path, manifest):
         with Timer() as t:
-            self.stdout.write(f"--[{label}]--")
-            callback()
-        self.emit_log(callback.__name__, t.elapsed)
+            self.stdout.write(f"--[Restoring database from {artifact_path}]--")
+            connections.close_all()
+            restore_artifact(artifact_path, "db.sqlite3")
+            # NOTE: the database changed, so cached responses and
+            # validators must be replaced as if it had been built
+            cache.clear()
+            write_data_version()
+            write_manifest(manifest)
+        self.emit_log("restore_artifact", t.elapsed)
 
-    def do_stage(self, stage):
-        # NOTE: Revisit running stage callbacks in parallel in the future
-        for label, callback in stage["callbacks"]:
-            self.do_step(label, callback)
+    def store_artifact(self, artifact_path, artifact_dir):
+        with Timer() as t:
+            self.stdout.write(f"--[Storing database to {artifact_path}]--")
+            connections.close_all()
+            store_artifact("db.sqlite3", artifact_path)
+            prune_artifacts(artifact_dir, settings.DB_ARTIFACT_KEEP)
+        self.emit_log("store_artifact", t.elapsed)
 
     def handle(self, *args, **options):
+        manifest = build_manifest()
+
+        artifact_dir = options["artifact_dir"]
+        if artifact_dir:
+            artifact_path = get_artifact_path(artifact_dir, compute_artifact_key())
+            if os.path.exists(artifact_path):
+                self.restore_artifact(artifact_path, manifest)
+                return
+
+        steps = None
+        if options["incremental"]:
+            steps = self.get_incremental_steps(manifest)
+            if steps == []:
+                self.stdout.write("--[Database is up to date]--")
+                return
+
         # TODO: Factor out in favor of scaife_viewer_atlas `prepare_atlas_db` command
-        if os.path.exists("db.sqlite3"):
+        if steps is None and os.path.exists("db.sqlite3"):
             os.remove("db.sqlite3")
             self.stdout.write("--[Removed existing database]--")
+        # NOTE: removed up front so that validators are never sent for a
+        # partially built database, and so that a failed build is never
+        # treated as a baseline for an incremental one
+        remove_data_version()
+        remove_manifest()
+
+        # NOTE: cached responses are persistent, so they must be
+        # cleared along with the database
+        cache.clear()
+        self.stdout.write("--[Cleared cache]--")
 
         with Timer() as t:
             self.stdout.write("--[Creating database]--")
             call_command("migrate")
         self.emit_log("migrate", t.elapsed)
 
-        self.do_step("Loading versions", importers.versions.import_versions)
-
-        stage_1 = {
-            "name": "stage 1",
-            "callbacks": [
-                (
-                    "Loading text annotations",
-                    importers.text_annotations.import_text_annotations,
-                ),
-                (
-                    "Loading metrical annotations",
-                    importers.metrical_annotations.import_metrical_annotations,
-                ),
-                (
-                    "Loading image annotations",
-                    importers.image_annotations.import_image_annotations,
-                ),
-                (
-                    "Loading audio annotations",
-                    importers.audio_annotations.import_audio_annotations,
-                ),
-            ],
-        }
-        self.do_stage(stage_1)
-
-        # NOTE: Tokenizing should never be ran in parallel, because
-        # it is already parallel
+        reset = steps is not None
+        # NOTE: indexes are not deferred when updating an existing database,
+        # since steps run with `reset=True` delete rows via those indexes
+        self.reset = reset
+        if reset:
+            labels = ", ".join(step["name"] for step in steps)
+            self.stdout.write(f"--[Re-running steps: {labels}]--")
+        else:
+            steps = STEPS
 
         concurrency_value = (
             settings.SV_ATLAS_INGESTION_CONCURRENCY or multiprocessing.cpu_count()
         )
         self.stdout.write(f"SV_ATLAS_INGESTION_CONCURRENCY: {concurrency_value}")
-        self.do_step(
-            "Tokenizing versions/exemplars", tokenizers.tokenize_all_text_parts
+        profiler = None
+        if options["profile"]:
+            profiler = StepProfiler(cprofile_dir=options["cprofile_dir"])
+        scheduler = StepScheduler(
+            steps,
+            concurrency_value,
+            reset=reset,
+            profiler=profiler,
+            on_start=self.start_step,
+            on_complete=self.complete_step,
         )
 
-        stage_2 = {
-            "name": "stage 2",
-            "callbacks": [
-                (
-                    "Loading token annotations",
-                    importers.token_annotations.apply_token_annotations,
-                ),
-                (
-                    "Loading named entity annotations",
-                    importers.named_entities.apply_named_entities,
-                ),
-                ("Loading alignments", importers.alignments.process_alignments),
-            ],
-        }
-        self.do_stage(stage_2)
+        self.bulk_loader = None
+        if options["bulk_load"]:
+            self.bulk_loader = BulkLoader(concurrent=scheduler.concurrency > 1)
+            self.bulk_loader.enable()
+        scheduler.run()
+
+        if self.bulk_loader:
+            with Timer() as t:
+                self.stdout.write("--[Analyzing and vacuuming database]--")
+                self.bulk_loader.finalize()
+                self.bulk_loader.disable()
+            self.emit_log("finalize_bulk_load", t.elapsed)
+
+        if profiler:
+            profiler.write_report(options["profile_output"])
+            self.stdout.write(f"--[Wrote profile to {options['profile_output']}]--")
+
+        with Timer() as t:
+            data_version = write_data_version()
+            self.stdout.write(f"--[Data version: {data_version['version']}]--")
+        self.emit_log("write_data_version", t.elapsed)
+        write_manifest(manifest)
+
+        if artifact_dir:
+            self.store_artifact(artifact_path, artifact_dir)
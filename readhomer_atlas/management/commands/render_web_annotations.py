@@ -0,0 +1,215 @@
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.paginator import Paginator
+from django.http import Http404
+
+from ...web_annotation.models import FolioAnnotationCollection
+from ...web_annotation.prerender import (
+    MANIFEST_FILENAME,
+    annotation_path,
+    collection_path,
+    get_data_version_key,
+    get_manifest_path,
+    page_path,
+    read_manifest,
+    write_manifest,
+    write_prerendered,
+)
+from ...web_annotation.shims import get_shim_for_kind
+from ...web_annotation.utils import folio_exemplar_urn_to_site_urn
+from ...web_annotation.views import (
+    PAGE_SIZE,
+    get_annotation_data,
+    get_collection_data,
+    get_page_data,
+)
+
+
+class Command(BaseCommand):
+    """
+    Writes the collection, page and item JSON for every folio and annotation
+    kind to disk, to be served by the web_annotation views
+    """
+
+    help = "Writes the collection, page and item JSON for every folio and annotation kind to disk"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--output-dir",
+            default=settings.WEB_ANNOTATION_PRERENDER_DIR,
+            help="Directory to write JSON to; served when it matches WEB_ANNOTATION_PRERENDER_DIR",
+        )
+        parser.add_argument(
+            "--gzip",
+            action="store_true",
+            help="Also write pre-compressed .gz variants of each file",
+        )
+        parser.add_argument(
+            "--kind",
+            action="append",
+            dest="kinds",
+            help="Only render the given annotation kind(s), keeping the files "
+            "previously rendered for other kinds",
+        )
+
+    def render(self, path, get_data, *args):
+        try:
+            data = get_data(*args)
+        except Http404:
+            # NOTE: matches the dynamic views, so there is nothing to write
+            return False
+        except Exception as e:
+            # NOTE: the dynamic views will continue to serve anything that
+            # fails to render here
+            self.stderr.write(f"Could not render {path}: {e!r}")
+            self.failed += 1
+            return False
+        write_prerendered(path, data, compress=self.compress)
+        self.written += 1
+        return True
+
+    def render_all(self, output_dir, kinds):
+        collections = FolioAnnotationCollection.objects.values_list(
+            "folio_urn", "annotation_kind"
+        ).distinct()
+        if kinds:
+            collections = collections.filter(annotation_kind__in=kinds)
+
+        for folio_urn, annotation_kind in collections:
+            urn = folio_exemplar_urn_to_site_urn(folio_urn)
+            kwargs = {"annotation_kind": annotation_kind, "urn": urn}
+
+            self.render(
+                collection_path(root=output_dir, **kwargs),
+                get_collection_data,
+                annotation_kind,
+                urn,
+            )
+
+            shim = get_shim_for_kind(annotation_kind)(urn)
+            paginator = Paginator(shim.get_index_queryset(), per_page=PAGE_SIZE)
+            for page_number in paginator.page_range:
+                zero_page_number = page_number - 1
+                self.render(
+                    page_path(
+                        root=output_dir, zero_page_number=zero_page_number, **kwargs
+                    ),
+                    get_page_data,
+                    annotation_kind,
+                    urn,
+                    zero_page_number,
+                )
+
+            for idx in shim.get_index_queryset().values_list("idx", flat=True):
+                self.render(
+                    annotation_path(root=output_dir, idx=idx, **kwargs),
+                    get_annotation_data,
+                    annotation_kind,
+                    urn,
+                    idx,
+                )
+
+    def check_output_dir(self, output_dir):
+        """
+        Refuses to replace an existing directory unless it is empty or was
+        written by this command
+        """
+        if not os.path.exists(output_dir):
+            return
+        if not os.path.isdir(output_dir):
+            raise CommandError(f"{output_dir} is not a directory")
+        if os.listdir(output_dir) and not os.path.exists(get_manifest_path(output_dir)):
+            raise CommandError(
+                f"{output_dir} was not written by render_web_annotations; "
+                "choose another --output-dir or remove it first"
+            )
+
+    def get_kinds(self, output_dir, kinds):
+        """
+        Returns the kinds the output will hold once `kinds` are rendered into
+        it (None for all of them), or raises CommandError if the files already
+        rendered for other kinds can't be kept
+        """
+        if not kinds or not os.path.exists(output_dir):
+            return kinds
+        manifest = read_manifest(output_dir)
+        if manifest is None:
+            return kinds
+        if manifest.get("data_version") != get_data_version_key():
+            raise CommandError(
+                f"{output_dir} was rendered from other data; render every kind "
+                "(without --kind) first"
+            )
+        previous_kinds = manifest.get("kinds")
+        if previous_kinds is None:
+            return None
+        return sorted(set(previous_kinds) | set(kinds))
+
+    def copy_other_kinds(self, output_dir, render_dir, kinds):
+        """
+        Links the files previously rendered for kinds other than `kinds`
+        into `render_dir`
+        """
+
+        def ignore(directory, names):
+            # NOTE: files are laid out as `<urn>/<annotation kind>/...`
+            if os.path.dirname(directory) == output_dir:
+                return [name for name in names if name in kinds]
+            if directory == output_dir:
+                return [MANIFEST_FILENAME]
+            return []
+
+        # NOTE: rendered files are always written anew, never in place, so
+        # links are never modified
+        shutil.copytree(output_dir, render_dir, ignore=ignore, copy_function=os.link)
+
+    def replace_output_dir(self, render_dir, output_dir):
+        """
+        Swaps the rendered files into place, so that the views never serve
+        a mix of files from different runs
+        """
+        if not os.path.exists(output_dir):
+            os.rename(render_dir, output_dir)
+            return
+        previous_dir = tempfile.mkdtemp(
+            prefix=".previous-", dir=os.path.dirname(output_dir)
+        )
+        os.rename(output_dir, previous_dir)
+        os.rename(render_dir, output_dir)
+        shutil.rmtree(previous_dir)
+
+    def handle(self, *args, **options):
+        output_dir = os.path.abspath(options["output_dir"])
+        self.check_output_dir(output_dir)
+        self.compress = options["gzip"]
+        self.written = 0
+        self.failed = 0
+
+        kinds = options["kinds"]
+        manifest_kinds = self.get_kinds(output_dir, kinds)
+
+        # NOTE: rendered into a sibling directory and swapped in once
+        # complete, which also removes any stale files from a previous run
+        os.makedirs(os.path.dirname(output_dir), exist_ok=True)
+        render_dir = tempfile.mkdtemp(
+            prefix=".render-", dir=os.path.dirname(output_dir)
+        )
+        try:
+            if kinds and os.path.exists(output_dir):
+                os.rmdir(render_dir)
+                self.copy_other_kinds(output_dir, render_dir, kinds)
+            os.chmod(render_dir, 0o755)
+            self.render_all(render_dir, kinds)
+            write_manifest(render_dir, written=self.written, kinds=manifest_kinds)
+        except BaseException:
+            shutil.rmtree(render_dir)
+            raise
+        self.replace_output_dir(render_dir, output_dir)
+
+        self.stdout.write(
+            f"Rendered web annotations: [written={self.written} failed={self.failed} output_dir={output_dir}]"
+        )
@@ -0,0 +1,322 @@
+import bisect
+import json
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.urls import Resolver404, resolve
+
+from django.contrib.sites.models import Site
+
+from ...metrics import parse_server_timing
+from ...profiling import QueryRecorder
+from .benchmark_endpoints import percentile
+
+
+# upper bounds (in milliseconds) of the latency histogram buckets
+HISTOGRAM_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+
+def load_request_log(path):
+    """
+    Reads a JSON-lines request log; each line is an object with a `path`
+    (or an absolute `url`) and optional `headers`.
+
+    Returns the requests and the number of lines that could not be replayed.
+    """
+    entries = []
+    skipped = 0
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                skipped += 1
+                continue
+            if not isinstance(entry, dict):
+                skipped += 1
+                continue
+            # NOTE: only GETs are replayed; the site is read-only
+            if entry.get("method", "GET").upper() != "GET":
+                skipped += 1
+                continue
+            path = entry.get("path")
+            if not path and entry.get("url"):
+                parts = urlsplit(entry["url"])
+                path = parts.path + (f"?{parts.query}" if parts.query else "")
+            if not path:
+                skipped += 1
+                continue
+            entries.append({"path": path, "headers": entry.get("headers") or {}})
+    return entries, skipped
+
+
+def get_endpoint(path):
+    try:
+        return resolve(urlsplit(path).path).url_name or "unnamed"
+    except Resolver404:
+        return "unresolved"
+
+
+def header_to_meta(name):
+    return "HTTP_" + name.upper().replace("-", "_")
+
+
+class Command(BaseCommand):
+    """
+    Replays a JSON-lines request log against the Django test client (in
+    process) or a running server, reporting throughput, latency, cache hits
+    and SQL usage per endpoint
+    """
+
+    help = "Replays a JSON-lines request log and reports throughput, latency, cache hits and SQL usage"
+
+    def add_arguments(self, parser):
+        parser.add_argument("log", help="Path to the JSON-lines request log")
+        parser.add_argument(
+            "--base-url",
+            help="Replay over HTTP against a running server (e.g. http://localhost:8000) "
+            "instead of the Django test client; SQL usage and cache hits are then "
+            "read from the Server-Timing header",
+        )
+        parser.add_argument(
+            "--host",
+            help="Host to request URLs with via the test client "
+            "(defaults to the current Site domain)",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=1,
+            help="Number of requests to issue in parallel",
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=0,
+            help="Maximum requests per second across all workers (0 for unlimited)",
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=1, help="Number of times to replay the log"
+        )
+        parser.add_argument("--output", help="Path to write the JSON results to")
+
+    def get_client(self, host):
+        # NOTE: the test client is not thread-safe; one is created per worker
+        if not hasattr(self.local, "client"):
+            self.local.client = Client(HTTP_HOST=host)
+        return self.local.client
+
+    def request_with_client(self, entry, host):
+        client = self.get_client(host)
+        extra = {
+            header_to_meta(name): value for name, value in entry["headers"].items()
+        }
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(recorder):
+                response = client.get(entry["path"], **extra)
+                size = sum(len(chunk) for chunk in response)
+        except Exception as e:
+            return {"status": repr(e), "elapsed": time.perf_counter() - start}
+        elapsed = time.perf_counter() - start
+
+        # NOTE: set by FetchFromCacheMiddleware (used by cache_page) on the
+        # request; absent for views that are not cached
+        update_cache = getattr(response.wsgi_request, "_cache_update_cache", None)
+        cache_hit = None if update_cache is None else not update_cache
+        return {
+            "status": response.status_code,
+            "elapsed": elapsed,
+            "size": size,
+            "cache_hit": cache_hit,
+            "sql_queries": recorder.count,
+            "sql_time": recorder.elapsed,
+        }
+
+    def request_with_http(self, entry, base_url):
+        request = urllib.request.Request(
+            base_url.rstrip("/") + entry["path"], headers=entry["headers"]
+        )
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as response:
+                size = len(response.read())
+                status = response.status
+                headers = response.headers
+        except urllib.error.HTTPError as e:
+            size = len(e.read())
+            status = e.code
+            headers = e.headers
+        except OSError as e:
+            return {"status": repr(e), "elapsed": time.perf_counter() - start}
+        result = {
+            "status": status,
+            "elapsed": time.perf_counter() - start,
+            "size": size,
+        }
+
+        # NOTE: SQL usage is only included for requests sampled by the server;
+        # see `readhomer_atlas.metrics`
+        server_timing = parse_server_timing(headers.get("Server-Timing", ""))
+        caches = server_timing["caches"]
+        if "page" in caches:
+            result["cache_hit"] = caches["page"]
+        if "sql_queries" in server_timing:
+            result["sql_queries"] = server_timing["sql_queries"]
+        return result
+
+    def replay(self, entries, options):
+        host = None
+        if not options["base_url"]:
+            host = options["host"] or Site.objects.get_current().domain
+            # NOTE: worker threads open their own connections
+            connections.close_all()
+
+        interval = 1 / options["rate"] if options["rate"] else 0
+        lock = threading.Lock()
+        schedule = {"next": time.perf_counter()}
+
+        def wait_for_slot():
+            if not interval:
+                return
+            with lock:
+                slot = schedule["next"]
+                schedule["next"] = max(slot, time.perf_counter()) + interval
+            delay = slot - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        def run(entry):
+            wait_for_slot()
+            if options["base_url"]:
+                result = self.request_with_http(entry, options["base_url"])
+            else:
+                result = self.request_with_client(entry, host)
+            result["endpoint"] = get_endpoint(entry["path"])
+            result["path"] = entry["path"]
+            return result
+
+        self.local = threading.local()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+            results = list(executor.map(run, entries * options["repeat"]))
+        return results, time.perf_counter() - start
+
+    def build_histogram(self, timings):
+        counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        for timing in timings:
+            counts[bisect.bisect_left(HISTOGRAM_BUCKETS, timing)] += 1
+        labels = [f"<={bucket}ms" for bucket in HISTOGRAM_BUCKETS]
+        labels.append(f">{HISTOGRAM_BUCKETS[-1]}ms")
+        return dict(zip(labels, counts))
+
+    def summarize(self, results):
+        timings = [result["elapsed"] * 1000 for result in results]
+        cache_results = [
+            result["cache_hit"]
+            for result in results
+            if result.get("cache_hit") is not None
+        ]
+        summary = {
+            "requests": len(results),
+            "statuses": dict(Counter(str(result["status"]) for result in results)),
+            "p50_ms": percentile(timings, 50) if timings else None,
+            "p95_ms": percentile(timings, 95) if timings else None,
+            "p99_ms": percentile(timings, 99) if timings else None,
+            "mean_ms": statistics.mean(timings) if timings else None,
+            "bytes": sum(result.get("size", 0) for result in results),
+            "cache_hit_ratio": (
+                sum(cache_results) / len(cache_results) if cache_results else None
+            ),
+        }
+        sql_queries = [
+            result["sql_queries"] for result in results if "sql_queries" in result
+        ]
+        if sql_queries:
+            summary["sql_queries_mean"] = statistics.mean(sql_queries)
+            summary["sql_queries_max"] = max(sql_queries)
+            sql_times = [
+                result["sql_time"] for result in results if "sql_time" in result
+            ]
+            if sql_times:
+                summary["sql_time_ms"] = sum(sql_times) * 1000
+        return summary
+
+    def format_value(self, value, suffix=""):
+        if value is None:
+            return "-"
+        if isinstance(value, float):
+            return f"{value:.1f}{suffix}"
+        return f"{value}{suffix}"
+
+    def report(self, overall, endpoints, histogram):
+        self.stdout.write(
+            f"Replayed requests: [requests={overall['requests']} "
+            f"elapsed={overall['elapsed']:.1f}s "
+            f"throughput={overall['throughput']:.1f}/s "
+            f"cache_hit_ratio={self.format_value(overall['cache_hit_ratio'])}]"
+        )
+        self.stdout.write("Latency histogram:")
+        for label, count in histogram.items():
+            self.stdout.write(f"  {label}: {count}")
+        for endpoint, summary in sorted(endpoints.items()):
+            self.stdout.write(
+                f"{endpoint}: [requests={summary['requests']} "
+                f"p50={self.format_value(summary['p50_ms'], 'ms')} "
+                f"p95={self.format_value(summary['p95_ms'], 'ms')} "
+                f"cache_hit_ratio={self.format_value(summary['cache_hit_ratio'])} "
+                f"sql_queries_mean={self.format_value(summary.get('sql_queries_mean'))} "
+                f"statuses={summary['statuses']}]"
+            )
+
+    def handle(self, *args, **options):
+        if options["concurrency"] < 1:
+            raise CommandError("--concurrency must be at least 1")
+
+        entries, skipped = load_request_log(options["log"])
+        if skipped:
+            self.stderr.write(f"Skipped unreplayable log lines: [count={skipped}]")
+        if not entries:
+            raise CommandError(f"No requests to replay in {options['log']}")
+
+        results, elapsed = self.replay(entries, options)
+
+        by_endpoint = {}
+        for result in results:
+            by_endpoint.setdefault(result["endpoint"], []).append(result)
+        endpoints = {
+            endpoint: self.summarize(endpoint_results)
+            for endpoint, endpoint_results in by_endpoint.items()
+        }
+        overall = self.summarize(results)
+        overall["elapsed"] = elapsed
+        overall["throughput"] = len(results) / elapsed if elapsed else 0
+        histogram = self.build_histogram(
+            [result["elapsed"] * 1000 for result in results]
+        )
+        self.report(overall, endpoints, histogram)
+
+        if options["output"]:
+            data = {
+                "concurrency": options["concurrency"],
+                "rate": options["rate"],
+                "target": options["base_url"] or "client",
+                "overall": overall,
+                "histogram": histogram,
+                "endpoints": endpoints,
+            }
+            with open(options["output"], "w") as f:
+                json.dump(data, f, indent=2, sort_keys=True)
@@ -0,0 +1,161 @@
+import math
+import os
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.core.paginator import Paginator
+from django.test import Client
+from django.urls import reverse
+
+from django.contrib.sites.models import Site
+
+from scaife_viewer.atlas.models import ImageAnnotation
+
+from ...web_annotation.models import FolioAnnotationCollection
+from ...web_annotation.prerender import (
+    annotation_path,
+    collection_path,
+    is_prerendered_current,
+    page_path,
+)
+from ...web_annotation.shims import get_shim_for_kind
+from ...web_annotation.utils import folio_exemplar_urn_to_site_urn
+from ...web_annotation.views import PAGE_SIZE
+
+
+# NOTE: `cache_page` stores the headers and the response of each URL
+CACHE_ENTRIES_PER_URL = 2
+# leaves room for responses cached while serving other URLs
+CACHE_HEADROOM = 1.25
+
+
+class Command(BaseCommand):
+    """
+    Requests every Web Annotation collection, page and discovery URL
+    to populate the cache used by `cache_page`.
+
+    URLs answered from pre-rendered files never reach the cache, so they are
+    skipped; run this after `render_web_annotations`.  TOCs are held in
+    memory by each process rather than cached, and are loaded as it starts;
+    see `readhomer_atlas.wsgi`.
+    """
+
+    help = "Requests every Web Annotation collection, page and discovery URL to populate the cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--host",
+            help="Host to request URLs with; must match the host used in production, "
+            "since it is part of the cache key (defaults to the current Site domain)",
+        )
+        parser.add_argument(
+            "--secure",
+            action="store_true",
+            help="Request URLs over HTTPS; must match the scheme seen in production",
+        )
+        parser.add_argument(
+            "--include-items",
+            action="store_true",
+            help="Also request the URL of each annotation",
+        )
+
+    def is_prerendered(self, path):
+        # NOTE: views fall back to the cache for files that failed to render
+        if self.prerendered and os.path.exists(path):
+            self.skipped += 1
+            return True
+        return False
+
+    def get_urls(self, include_items=False):
+        collections = FolioAnnotationCollection.objects.values_list(
+            "folio_urn", "annotation_kind"
+        ).distinct()
+        for folio_urn, annotation_kind in collections:
+            urn = folio_exemplar_urn_to_site_urn(folio_urn)
+            kwargs = {"annotation_kind": annotation_kind, "urn": urn}
+            if not self.is_prerendered(collection_path(**kwargs)):
+                yield reverse(
+                    "serve_web_annotation_collection", args=[urn, annotation_kind]
+                )
+
+            shim = get_shim_for_kind(annotation_kind)(urn)
+            paginator = Paginator(shim.get_index_queryset(), per_page=PAGE_SIZE)
+            for page_number in paginator.page_range:
+                zero_page_number = page_number - 1
+                if self.is_prerendered(
+                    page_path(zero_page_number=zero_page_number, **kwargs)
+                ):
+                    continue
+                yield reverse(
+                    "serve_web_annotation_page",
+                    args=[urn, annotation_kind, zero_page_number],
+                )
+
+            if include_items:
+                for idx in shim.get_index_queryset().values_list("idx", flat=True):
+                    if self.is_prerendered(annotation_path(idx=idx, **kwargs)):
+                        continue
+                    yield reverse(
+                        "serve_web_annotation", args=[urn, annotation_kind, idx]
+                    )
+
+        # NOTE: discovery answers for every canvas with an image annotation,
+        # including those without any collections
+        canvas_ids = (
+            ImageAnnotation.objects.values_list("canvas_identifier", flat=True)
+            .order_by("canvas_identifier")
+            .distinct()
+        )
+        discovery_url = reverse("web_annotation_discovery")
+        for canvas_id in canvas_ids:
+            yield f"{discovery_url}?{urlencode({'canvas_id': canvas_id})}"
+
+    def check_capacity(self, urls):
+        """
+        Raises CommandError if warming `urls` would fill the cache, since
+        backends cull entries (FileBasedCache a random third of them) once
+        they hold `MAX_ENTRIES`
+        """
+        max_entries = getattr(
+            caches[settings.CACHE_MIDDLEWARE_ALIAS], "_max_entries", None
+        )
+        if max_entries is None:
+            return
+        required = math.ceil(len(urls) * CACHE_ENTRIES_PER_URL * CACHE_HEADROOM)
+        if required > max_entries:
+            raise CommandError(
+                f"Warming {len(urls)} URLs requires a cache of at least {required} "
+                f"entries, but it is limited to {max_entries}; raise CACHE_MAX_ENTRIES"
+            )
+
+    def handle(self, *args, **options):
+        host = options["host"] or Site.objects.get_current().domain
+        client = Client(HTTP_HOST=host)
+        self.prerendered = is_prerendered_current()
+        self.skipped = 0
+
+        urls = list(self.get_urls(include_items=options["include_items"]))
+        self.check_capacity(urls)
+
+        warmed = 0
+        failed = 0
+        for url in urls:
+            try:
+                response = client.get(url, secure=options["secure"])
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f"Could not warm {url}: {e!r}")
+                continue
+            if response.status_code == 200:
+                warmed += 1
+            else:
+                failed += 1
+                self.stderr.write(
+                    f"Could not warm {url}: [status={response.status_code}]"
+                )
+        self.stdout.write(
+            f"Warmed caches: [warmed={warmed} failed={failed} "
+            f"prerendered={self.skipped} host={host}]"
+        )
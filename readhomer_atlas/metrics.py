@@ -0,0 +1,286 @@
+"""
+Records per-request timing, SQL usage, cache results and response sizes.
+
+Each response carries a `Server-Timing` header; a sample of requests is also
+aggregated per view (and annotation kind) and served in the Prometheus text
+format by `serve_metrics`.
+
+Aggregates are held in memory, so each gunicorn worker reports its own.
+"""
+import bisect
+import heapq
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.cache import never_cache
+
+from .profiling import QueryRecorder
+from .web_annotation.shims import SHIM_CLASSES
+
+
+# upper bounds (in seconds) of the request duration histogram buckets
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+SERVER_TIMING_QUERIES_RE = re.compile(r'desc="(\d+) queries"')
+
+# NOTE: annotation kinds come from the URL, so anything unknown is reported
+# as "other" to keep the number of series bounded
+ANNOTATION_KINDS = {shim_class.annotation_kind for shim_class in SHIM_CLASSES}
+OTHER_ANNOTATION_KIND = "other"
+
+
+def record_cache(request, name, hit):
+    """
+    Records whether the named cache (or pre-rendered file) served the request
+    """
+    caches = getattr(request, "_metrics_caches", None)
+    if caches is None:
+        caches = request._metrics_caches = {}
+    caches[name] = hit
+
+
+def get_caches(request):
+    caches = dict(getattr(request, "_metrics_caches", {}))
+    # NOTE: set by FetchFromCacheMiddleware (used by cache_page), which also
+    # sets it to False for requests it never caches
+    update_cache = getattr(request, "_cache_update_cache", None)
+    if update_cache is not None and request.method in ("GET", "HEAD"):
+        caches.setdefault("page", not update_cache)
+    return caches
+
+
+def get_kind_label(annotation_kind):
+    if not annotation_kind or annotation_kind in ANNOTATION_KINDS:
+        return annotation_kind
+    return OTHER_ANNOTATION_KIND
+
+
+def get_response_size(response):
+    if not response.streaming:
+        return len(response.content)
+    # NOTE: streamed bodies are only counted when their length is known upfront
+    if response.has_header("Content-Length"):
+        return int(response["Content-Length"])
+    return None
+
+
+def parse_server_timing(value):
+    """
+    Reads the SQL query count and cache results from a `Server-Timing` header
+    written by `MetricsMiddleware`
+    """
+    parsed = {"caches": {}}
+    for metric in value.split(","):
+        name, *params = [part.strip() for part in metric.split(";")]
+        if name == "sql":
+            match = SERVER_TIMING_QUERIES_RE.search(metric)
+            if match:
+                parsed["sql_queries"] = int(match.group(1))
+        elif name.startswith("cache-"):
+            parsed["caches"][name[len("cache-") :]] = 'desc="hit"' in params
+    return parsed
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(**labels):
+    return ",".join(f'{name}="{escape_label(value)}"' for name, value in labels.items())
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (view, annotation kind, status) -> aggregates
+        self.series = {}
+        # min-heap of (duration, path, view) for the slowest requests seen
+        self.slowest = []
+
+    def observe(self, labels, path, duration, sql, caches, response_size):
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = {
+                    "count": 0,
+                    "duration_sum": 0.0,
+                    "buckets": [0] * (len(DURATION_BUCKETS) + 1),
+                    "sql_queries": 0,
+                    "sql_time": 0.0,
+                    "response_bytes": 0,
+                    "caches": Counter(),
+                }
+            series["count"] += 1
+            series["duration_sum"] += duration
+            series["buckets"][bisect.bisect_left(DURATION_BUCKETS, duration)] += 1
+            series["sql_queries"] += sql.count
+            series["sql_time"] += sql.elapsed
+            if response_size is not None:
+                series["response_bytes"] += response_size
+            for name, hit in caches.items():
+                series["caches"][(name, "hit" if hit else "miss")] += 1
+
+            entry = (duration, path, labels[0])
+            if len(self.slowest) < settings.METRICS_SLOWEST_REQUESTS:
+                heapq.heappush(self.slowest, entry)
+            elif self.slowest and entry > self.slowest[0]:
+                heapq.heapreplace(self.slowest, entry)
+
+    def reset(self):
+        with self.lock:
+            self.series = {}
+            self.slowest = []
+
+    def render(self):
+        with self.lock:
+            series = sorted(self.series.items())
+            slowest = sorted(self.slowest, reverse=True)
+
+        lines = [
+            "# HELP readhomer_metrics_sample_rate Fraction of requests aggregated",
+            "# TYPE readhomer_metrics_sample_rate gauge",
+            f"readhomer_metrics_sample_rate {settings.METRICS_SAMPLE_RATE}",
+            "# HELP readhomer_requests_total Sampled requests",
+            "# TYPE readhomer_requests_total counter",
+        ]
+        for (view, kind, status), data in series:
+            labels = format_labels(view=view, kind=kind, status=status)
+            lines.append(f"readhomer_requests_total{{{labels}}} {data['count']}")
+
+        lines.extend(
+            [
+                "# HELP readhomer_request_duration_seconds Sampled request durations",
+                "# TYPE readhomer_request_duration_seconds histogram",
+            ]
+        )
+        for (view, kind, status), data in series:
+            labels = format_labels(view=view, kind=kind, status=status)
+            cumulative = 0
+            bounds = [str(bound) for bound in DURATION_BUCKETS] + ["+Inf"]
+            for bound, count in zip(bounds, data["buckets"]):
+                cumulative += count
+                lines.append(
+                    f'readhomer_request_duration_seconds_bucket{{{labels},le="{bound}"}} '
+                    f"{cumulative}"
+                )
+            lines.append(
+                f"readhomer_request_duration_seconds_sum{{{labels}}} "
+                f"{data['duration_sum']}"
+            )
+            lines.append(
+                f"readhomer_request_duration_seconds_count{{{labels}}} {data['count']}"
+            )
+
+        counters = [
+            ("sql_queries", "readhomer_sql_queries_total", "SQL queries"),
+            ("sql_time", "readhomer_sql_duration_seconds_total", "SQL query time"),
+            ("response_bytes", "readhomer_response_bytes_total", "Response bytes"),
+        ]
+        for key, name, description in counters:
+            lines.extend(
+                [
+                    f"# HELP {name} {description} for sampled requests",
+                    f"# TYPE {name} counter",
+                ]
+            )
+            for (view, kind, status), data in series:
+                labels = format_labels(view=view, kind=kind, status=status)
+                lines.append(f"{name}{{{labels}}} {data[key]}")
+
+        lines.extend(
+            [
+                "# HELP readhomer_cache_requests_total Cache results for sampled requests",
+                "# TYPE readhomer_cache_requests_total counter",
+            ]
+        )
+        for (view, kind, status), data in series:
+            for (cache, result), count in sorted(data["caches"].items()):
+                labels = format_labels(
+                    view=view, kind=kind, status=status, cache=cache, result=result
+                )
+                lines.append(f"readhomer_cache_requests_total{{{labels}}} {count}")
+
+        lines.extend(
+            [
+                "# HELP readhomer_slowest_request_seconds Slowest sampled requests",
+                "# TYPE readhomer_slowest_request_seconds gauge",
+            ]
+        )
+        for duration, path, view in slowest:
+            labels = format_labels(view=view, path=path)
+            lines.append(f"readhomer_slowest_request_seconds{{{labels}}} {duration}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+class MetricsMiddleware:
+    """
+    Adds a `Server-Timing` header to every response and aggregates a sample
+    of requests into `registry`.
+
+    The duration of streamed responses excludes generating their bodies.
+    """
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sampled = random.random() < settings.METRICS_SAMPLE_RATE
+        sql = QueryRecorder()
+        start = time.perf_counter()
+        with connection.execute_wrapper(sql) if sampled else nullcontext():
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        caches = get_caches(request)
+        server_timing = [f"app;dur={duration * 1000:.2f}"]
+        if sampled:
+            server_timing.append(
+                f'sql;dur={sql.elapsed * 1000:.2f};desc="{sql.count} queries"'
+            )
+        for name, hit in sorted(caches.items()):
+            server_timing.append(f'cache-{name};desc="{"hit" if hit else "miss"}"')
+        response["Server-Timing"] = ", ".join(server_timing)
+
+        if sampled:
+            match = request.resolver_match
+            view, kind = "unresolved", ""
+            if match:
+                view = match.url_name or match.view_name
+                kind = get_kind_label(match.kwargs.get("annotation_kind", ""))
+            labels = (view, kind, str(response.status_code))
+            registry.observe(
+                labels,
+                request.path,
+                duration,
+                sql,
+                caches,
+                get_response_size(response),
+            )
+        return response
+
+
+@never_cache
+def serve_metrics(request):
+    # NOTE: metrics expose request paths and timings, so they are never public
+    if not settings.METRICS_ENABLED or not settings.METRICS_TOKEN:
+        raise Http404
+    authorization = request.META.get("HTTP_AUTHORIZATION", "")
+    if not constant_time_compare(authorization, f"Bearer {settings.METRICS_TOKEN}"):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
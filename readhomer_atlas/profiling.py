@@ -0,0 +1,116 @@
+"""
+Collects per-step resource usage for `prepare_db --profile`.
+"""
+import cProfile
+import json
+import os
+import resource
+import time
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.db import connection
+
+
+class QueryRecorder:
+    """
+    Counts and times queries; installed via `connection.execute_wrapper`
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.elapsed = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.elapsed += time.perf_counter() - start
+
+
+def count_rows():
+    # NOTE: includes the through models for many-to-many fields
+    return {
+        model._meta.label: model.objects.count()
+        for model in apps.get_models(include_auto_created=True)
+    }
+
+
+class StepProfiler:
+    """
+    Records CPU time, peak RSS, rows inserted per model and SQL usage
+    for each step.
+
+    Rows are recorded as the net change per model, so steps run with
+    `reset=True` only report rows beyond those they replaced.
+
+    Steps must run serially in the current process, since row counts are
+    taken from the database as a whole.
+    """
+
+    def __init__(self, cprofile_dir=None):
+        self.cprofile_dir = cprofile_dir
+        self.steps = []
+
+    @contextmanager
+    def profile(self, step):
+        rows_before = count_rows()
+        recorder = QueryRecorder()
+        profiler = cProfile.Profile() if self.cprofile_dir else None
+
+        usage_before = resource.getrusage(resource.RUSAGE_SELF)
+        # NOTE: includes any processes a step forks, e.g. the tokenizer
+        children_usage_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        start = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            if profiler:
+                profiler.enable()
+            try:
+                yield
+            finally:
+                if profiler:
+                    profiler.disable()
+        elapsed = time.perf_counter() - start
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+        rows_after = count_rows()
+        rows = {
+            label: count - rows_before.get(label, 0)
+            for label, count in rows_after.items()
+            if count != rows_before.get(label, 0)
+        }
+        if profiler:
+            os.makedirs(self.cprofile_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(self.cprofile_dir, f"{step['name']}.prof"))
+
+        self.steps.append(
+            {
+                "name": step["name"],
+                "label": step["label"],
+                "elapsed": elapsed,
+                "cpu_user": usage.ru_utime - usage_before.ru_utime,
+                "cpu_system": usage.ru_stime - usage_before.ru_stime,
+                "children_cpu_user": children_usage.ru_utime
+                - children_usage_before.ru_utime,
+                "children_cpu_system": children_usage.ru_stime
+                - children_usage_before.ru_stime,
+                # NOTE: ru_maxrss is a high-water mark for the lifetime of the
+                # process (in kilobytes on Linux), not for the step alone
+                "peak_rss_kb": usage.ru_maxrss,
+                "children_peak_rss_kb": children_usage.ru_maxrss,
+                "sql_queries": recorder.count,
+                "sql_time": recorder.elapsed,
+                "rows": rows,
+            }
+        )
+
+    def write_report(self, path):
+        report = {
+            "elapsed": sum(step["elapsed"] for step in self.steps),
+            "steps": self.steps,
+        }
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
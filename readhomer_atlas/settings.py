@@ -19,6 +19,22 @@ DATABASES = {
         "OPTIONS": {"timeout": 5 * 60},
     }
 }
+
+# NOTE: the database is never written to once it is built, so when serving it
+# can be opened read-only and immutable, which skips locking; mmap lets every
+# gunicorn worker share its pages through the OS page cache
+DB_READ_ONLY = bool(int(os.environ.get("DB_READ_ONLY", "0")))
+DB_MMAP_SIZE = int(os.environ.get("DB_MMAP_SIZE", 1024 * 1024 * 1024))
+# the page cache private to each connection (in KiB) when DB_READ_ONLY is set
+DB_READ_ONLY_CACHE_SIZE = int(os.environ.get("DB_READ_ONLY_CACHE_SIZE", 16 * 1024))
+if DB_READ_ONLY:
+    DATABASES["default"].update(
+        {
+            "NAME": f"file:{DATABASES['default']['NAME']}?mode=ro&immutable=1",
+            # connections are cheap to keep, since nothing is ever written
+            "CONN_MAX_AGE": None,
+        }
+    )
 ALLOWED_HOSTS = ["localhost"]
 if "HEROKU_APP_NAME" in os.environ:
     ALLOWED_HOSTS = ["*"]
@@ -107,7 +123,7 @@ TEMPLATES = [
 ]
 
 MIDDLEWARE = [
-    "querycount.middleware.QueryCountMiddleware",
+    "readhomer_atlas.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "corsheaders.middleware.CorsMiddleware",
@@ -118,6 +134,9 @@ MIDDLEWARE = [
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
+if DEBUG:
+    # prints query counts to the console
+    MIDDLEWARE.insert(0, "querycount.middleware.QueryCountMiddleware")
 
 ROOT_URLCONF = "readhomer_atlas.urls"
 
@@ -185,18 +204,125 @@ CORS_ORIGIN_ALLOW_ALL = True
 GRAPHENE = {
     "SCHEMA": "readhomer_atlas.schema.schema",
     # setting RELAY_CONNECTION_MAX_LIMIT to None removes the limit; for backwards compatability with current API
-    # @@@ restore the limit
+    # NOTE: connections are instead given a default `first` (see
+    # GRAPHQL_DEFAULT_CONNECTION_SIZE) and bounded by the cost of the query
     "RELAY_CONNECTION_MAX_LIMIT": None,
 }
 
+# queries nested more deeply, or that may resolve more fields (counting each
+# connection as `first` / `last` items, or GRAPHQL_DEFAULT_CONNECTION_SIZE
+# when neither is given), are rejected by `readhomer_atlas.graphql_api`;
+# connections requested without `first` or `last` return at most
+# GRAPHQL_DEFAULT_CONNECTION_SIZE items
+# NOTE: the costliest sample query in the README costs about 50000, with
+# each of its connections holding up to 100 items
+GRAPHQL_MAX_DEPTH = int(os.environ.get("GRAPHQL_MAX_DEPTH", 15))
+GRAPHQL_MAX_COST = int(os.environ.get("GRAPHQL_MAX_COST", 100000))
+GRAPHQL_DEFAULT_CONNECTION_SIZE = int(
+    os.environ.get("GRAPHQL_DEFAULT_CONNECTION_SIZE", 100)
+)
+# the number of parsed and validated queries kept by each process
+GRAPHQL_DOCUMENT_CACHE_SIZE = int(os.environ.get("GRAPHQL_DOCUMENT_CACHE_SIZE", 256))
+# queries persisted by clients are kept in the "graphql" cache, by each
+# process, for this many seconds
+GRAPHQL_PERSISTED_QUERY_TIMEOUT = int(
+    os.environ.get("GRAPHQL_PERSISTED_QUERY_TIMEOUT", 24 * 60 * 60)
+)
+GRAPHQL_PERSISTED_QUERY_MAX_ENTRIES = int(
+    os.environ.get("GRAPHQL_PERSISTED_QUERY_MAX_ENTRIES", 1000)
+)
+# a JSON object of SHA-256 hashes to queries that are always persisted, e.g.
+# those used by the reader; set GRAPHQL_PERSISTED_QUERY_REGISTRATION=0 to
+# only allow these
+GRAPHQL_PERSISTED_QUERIES_PATH = os.environ.get("GRAPHQL_PERSISTED_QUERIES_PATH")
+GRAPHQL_PERSISTED_QUERY_REGISTRATION = bool(
+    int(os.environ.get("GRAPHQL_PERSISTED_QUERY_REGISTRATION", "1"))
+)
+
+# NOTE: file-based by default, so that cached responses are shared across
+# gunicorn workers and survive restarts without requiring an external service;
+# set CACHE_BACKEND / CACHE_LOCATION to use e.g. Redis instead
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get(
+            "CACHE_BACKEND", "django.core.cache.backends.filebased.FileBasedCache"
+        ),
+        "LOCATION": os.environ.get(
+            "CACHE_LOCATION", os.path.join(PROJECT_ROOT, ".django_cache")
+        ),
+        # NOTE: `cache_page` stores two entries per URL; this fits the URLs
+        # warmed by `warm_caches` (one per canvas, and per collection and page
+        # of each folio), which fails if they don't.  FileBasedCache lists the
+        # whole directory on every set, and culls a random third of it once
+        # full, so use another backend for larger caches
+        "OPTIONS": {"MAX_ENTRIES": int(os.environ.get("CACHE_MAX_ENTRIES", 20000))},
+    },
+    # NOTE: kept apart (and bounded) so that queries registered by clients
+    # can't evict cached responses or fill the disk
+    "graphql": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "graphql-persisted-queries",
+        "TIMEOUT": GRAPHQL_PERSISTED_QUERY_TIMEOUT,
+        "OPTIONS": {"MAX_ENTRIES": GRAPHQL_PERSISTED_QUERY_MAX_ENTRIES},
+    },
+}
+
 # @@@ review
 DEFAULT_HTTP_CACHE_DURATION = int(
     os.environ.get("DEFAULT_HTTP_CACHE_DURATION", 60 * 60)
 )
 DEFAULT_HTTP_PROTOCOL = os.environ.get("DEFAULT_HTTP_PROTOCOL", "http")
 
+# the maximum number of folios to cache IIIF image resolvers for, per process
+FOLIO_IMAGE_CACHE_SIZE = int(os.environ.get("FOLIO_IMAGE_CACHE_SIZE", 1024))
+
+# written to by the `render_web_annotations` management command
+WEB_ANNOTATION_PRERENDER_DIR = os.environ.get(
+    "WEB_ANNOTATION_PRERENDER_DIR",
+    os.path.join(PROJECT_ROOT, "prerendered", "web_annotation"),
+)
+
+# the largest page of annotations that can be requested via `?page_size`;
+# pages larger than the default are streamed
+WEB_ANNOTATION_MAX_PAGE_SIZE = int(os.environ.get("WEB_ANNOTATION_MAX_PAGE_SIZE", 1000))
+
+# the number of seconds between checks for changes to the TOC files
+# held in memory; see `readhomer_atlas.tocs.store`
+TOC_RELOAD_INTERVAL = int(os.environ.get("TOC_RELOAD_INTERVAL", 5))
+# load every TOC as each process starts, rather than on its first request
+TOC_PRELOAD = bool(int(os.environ.get("TOC_PRELOAD", "1")))
+
+# written to by the `prepare_db` management command; used to compute
+# ETag / Last-Modified validators
+DATA_VERSION_PATH = os.environ.get(
+    "DATA_VERSION_PATH", os.path.join(PROJECT_ROOT, "data_version.json")
+)
+
+# written to by the `prepare_db` management command; used by
+# `prepare_db --incremental` to find the data files changed since the last build
+INGESTION_MANIFEST_PATH = os.environ.get(
+    "INGESTION_MANIFEST_PATH", os.path.join(PROJECT_ROOT, "ingestion_manifest.json")
+)
+
+# when set, `prepare_db` restores the database from (and stores it to)
+# compressed snapshots in this directory, keyed by its inputs
+DB_ARTIFACT_DIR = os.environ.get("DB_ARTIFACT_DIR")
+# the number of snapshots to keep in DB_ARTIFACT_DIR
+DB_ARTIFACT_KEEP = int(os.environ.get("DB_ARTIFACT_KEEP", 2))
+
+# see `readhomer_atlas.metrics`; metrics are only served at /metrics when
+# METRICS_TOKEN is set, and require an `Authorization: Bearer <METRICS_TOKEN>` header
+METRICS_ENABLED = bool(int(os.environ.get("METRICS_ENABLED", "1")))
+# the fraction of requests whose SQL usage is recorded and aggregated
+METRICS_SAMPLE_RATE = float(os.environ.get("METRICS_SAMPLE_RATE", "0.1"))
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+# the number of slowest sampled requests to report, per process
+METRICS_SLOWEST_REQUESTS = int(os.environ.get("METRICS_SLOWEST_REQUESTS", 20))
+
 SV_ATLAS_DB_LABEL = "default"  # NOTE: Ensures we pick up ATLAS pragma customizations on the default database
-SV_ATLAS_DATA_DIR = os.path.join(PROJECT_ROOT, "data")
+SV_ATLAS_DATA_DIR = os.environ.get(
+    "SV_ATLAS_DATA_DIR", os.path.join(PROJECT_ROOT, "data")
+)
 
 if "SV_ATLAS_INGESTION_CONCURRENCY" in os.environ:
     SV_ATLAS_INGESTION_CONCURRENCY = int(os.environ["SV_ATLAS_INGESTION_CONCURRENCY"])
@@ -0,0 +1,111 @@
+import os
+
+import pytest
+
+from . import ingestion
+from .ingestion import STEPS, StepScheduler, get_incremental_steps
+
+
+AUDIO_ANNOTATION = os.path.join(
+    "annotations", "audio-annotations", "iliad-1.1-1.5.json"
+)
+VERSION_METADATA = os.path.join("library", "tlg0012", "tlg001", "metadata.json")
+
+
+def get_manifest(code_version="abc", **files):
+    manifest_files = {
+        AUDIO_ANNOTATION: "1",
+        VERSION_METADATA: "2",
+    }
+    for path, digest in files.items():
+        path = {"audio": AUDIO_ANNOTATION, "library": VERSION_METADATA}.get(path, path)
+        if digest is None:
+            manifest_files.pop(path)
+        else:
+            manifest_files[path] = digest
+    return {"code_version": code_version, "files": manifest_files}
+
+
+def get_names(steps):
+    return [step["name"] for step in steps]
+
+
+def test_incremental_steps_without_changes():
+    assert get_incremental_steps(get_manifest(), get_manifest()) == []
+
+
+def test_incremental_steps_require_a_previous_build():
+    assert get_incremental_steps(None, get_manifest()) is None
+    assert (
+        get_incremental_steps(get_manifest(), get_manifest(code_version="def")) is None
+    )
+
+
+def test_incremental_steps_rerun_changed_importers():
+    steps = get_incremental_steps(get_manifest(), get_manifest(audio="3"))
+    assert get_names(steps) == ["audio_annotations", "web_annotation_index"]
+
+    # NOTE: removed files are changes too
+    steps = get_incremental_steps(get_manifest(), get_manifest(audio=None))
+    assert get_names(steps) == ["audio_annotations", "web_annotation_index"]
+
+
+def test_incremental_steps_rebuild_for_versions_and_unknown_paths():
+    assert get_incremental_steps(get_manifest(), get_manifest(library="3")) is None
+    unclaimed = {os.path.join("tocs", "toc.iliad.json"): "3"}
+    assert get_incremental_steps(get_manifest(), get_manifest(**unclaimed)) is None
+
+
+def fake_run_step(name, reset=False):
+    return 0
+
+
+def run_scheduler(monkeypatch, steps, concurrency):
+    monkeypatch.setattr(ingestion, "run_step", fake_run_step)
+    monkeypatch.setattr(ingestion.connections, "close_all", lambda: None)
+    started = []
+    completed = []
+    scheduler = StepScheduler(
+        steps,
+        concurrency,
+        on_start=lambda step: started.append(step["name"]),
+        on_complete=lambda step, elapsed: completed.append(step["name"]),
+    )
+    scheduler.run()
+    return started, completed
+
+
+def assert_dependencies_respected(steps, started, completed):
+    names = get_names(steps)
+    assert sorted(completed) == sorted(names)
+    for step in steps:
+        for dependency in step["depends_on"]:
+            if dependency in names:
+                assert completed.index(dependency) < started.index(step["name"])
+
+
+@pytest.mark.parametrize("concurrency", [1, 4])
+def test_scheduler_runs_steps_after_their_dependencies(monkeypatch, concurrency):
+    started, completed = run_scheduler(monkeypatch, STEPS, concurrency)
+    assert_dependencies_respected(STEPS, started, completed)
+
+
+def test_scheduler_ignores_dependencies_outside_its_steps(monkeypatch):
+    steps = [
+        step
+        for step in STEPS
+        if step["name"] in {"alignments", "named_entities", "web_annotation_index"}
+    ]
+    started, completed = run_scheduler(monkeypatch, steps, 1)
+    assert completed == ["named_entities", "alignments", "web_annotation_index"]
+
+
+def test_scheduler_rejects_cycles(monkeypatch):
+    steps = [
+        {"name": "a", "depends_on": ["b"]},
+        {"name": "b", "depends_on": ["a"]},
+    ]
+    with pytest.raises(RuntimeError):
+        run_scheduler(monkeypatch, steps, 1)
+    with pytest.raises(RuntimeError):
+        run_scheduler(monkeypatch, steps, 2)
@@ -0,0 +1,200 @@
+"""
+Holds the TOC files in memory as encoded (and pre-compressed) bytes, so that
+they are served without touching the disk.
+
+Files are reloaded when their modification time or size changes, and the
+index when the directory's does; both are checked at most once every
+`TOC_RELOAD_INTERVAL` seconds.  Files are read and compressed outside of the
+store's lock, so reloading one never blocks serving the others.
+"""
+import gzip
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from ..data_version import get_accepted_encodings
+from .tree import TocTree
+
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# NOTE: compression happens while serving the request that reloads a file, so
+# trades some ratio for speed (11 is the slowest and smallest)
+BROTLI_QUALITY = 5
+
+
+def gzip_compress(content):
+    buffer = io.BytesIO()
+    # mtime=0 keeps the output deterministic across processes
+    with gzip.GzipFile(fileobj=buffer, mode="wb", mtime=0) as f:
+        f.write(content)
+    return buffer.getvalue()
+
+
+class EncodedContent:
+    def __init__(self, content, modified=None):
+        self.variants = {"gzip": gzip_compress(content), None: content}
+        if brotli is not None:
+            self.variants["br"] = brotli.compress(content, quality=BROTLI_QUALITY)
+        # used in validators; see `condition_on_data_version`
+        self.digest = hashlib.sha256(content).hexdigest()
+        self.modified = modified
+
+    @property
+    def version(self):
+        return self.digest, self.modified
+
+    def select(self, request):
+        """
+        Returns the encoding and content to send for the request
+        """
+        for encoding in get_accepted_encodings(request):
+            if encoding in self.variants:
+                return encoding, self.variants[encoding]
+        return None, self.variants[None]
+
+
+class TocStore:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # filename -> ((mtime, size), EncodedContent)
+        self.tocs = {}
+        self.tocs_checked = {}
+        self.index = None
+        self.index_stat = None
+        self.index_checked = None
+        # (filenames, EncodedContent)
+        self.index_content = None
+        # filename -> (EncodedContent, TocTree)
+        self.trees = {}
+
+    def is_stale(self, checked):
+        if checked is None:
+            return True
+        return time.monotonic() - checked >= settings.TOC_RELOAD_INTERVAL
+
+    def stat(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def get_filenames(self):
+        """
+        Returns the sorted TOC filenames and whether they were served from memory
+        """
+        with self.lock:
+            if not self.is_stale(self.index_checked):
+                return self.index, True
+            self.index_checked = time.monotonic()
+            stat = self.stat(self.path)
+            if self.index is not None and stat == self.index_stat:
+                return self.index, True
+            if stat is None:
+                filenames = []
+            else:
+                filenames = sorted(f for f in os.listdir(self.path) if f.count(".json"))
+            self.index = filenames
+            self.index_stat = stat
+            # NOTE: drops TOCs whose files were removed
+            self.tocs = {
+                filename: toc
+                for filename, toc in self.tocs.items()
+                if filename in filenames
+            }
+            self.trees = {
+                filename: tree
+                for filename, tree in self.trees.items()
+                if filename in filenames
+            }
+            return filenames, False
+
+    def get(self, filename):
+        """
+        Returns the EncodedContent for a TOC (or None if it does not exist)
+        and whether it was served from memory
+        """
+        filenames, _ = self.get_filenames()
+        # NOTE: only files found in the index can be served, which also
+        # guards against paths escaping the directory
+        if filename not in filenames:
+            return None, True
+        with self.lock:
+            toc = self.tocs.get(filename)
+            if toc is not None and not self.is_stale(self.tocs_checked.get(filename)):
+                return toc[1], True
+            self.tocs_checked[filename] = time.monotonic()
+
+        path = os.path.join(self.path, filename)
+        stat = self.stat(path)
+        if stat is None:
+            with self.lock:
+                self.tocs.pop(filename, None)
+            return None, False
+        if toc is not None and toc[0] == stat:
+            return toc[1], True
+        # NOTE: concurrent reloads of the same file duplicate work, but
+        # store the same content
+        with open(path, "rb") as f:
+            content = EncodedContent(f.read(), modified=stat[0] / 1e9)
+        with self.lock:
+            self.tocs[filename] = (stat, content)
+        return content, False
+
+    def get_tree(self, filename):
+        """
+        Returns the EncodedContent and TocTree for a TOC (both None if it does
+        not exist), parsed once per version of the file, and whether they were
+        served from memory
+        """
+        content, hit = self.get(filename)
+        if content is None:
+            return None, None, hit
+        with self.lock:
+            tree = self.trees.get(filename)
+        if tree is not None and tree[0] is content:
+            return content, tree[1], hit
+        tree = TocTree.from_bytes(content.variants[None])
+        with self.lock:
+            self.trees[filename] = (content, tree)
+        return content, tree, False
+
+    def preload(self, build_index):
+        """
+        Loads the index and every TOC, so that requests for them are served
+        from memory
+        """
+        filenames, _ = self.get_filenames()
+        for filename in filenames:
+            self.get_tree(filename)
+        self.get_index(build_index)
+
+    def get_index(self, build_index):
+        """
+        Returns the EncodedContent for the index, built by `build_index`
+        from the TOC filenames whenever they change, and whether it was
+        served from memory
+        """
+        filenames, _ = self.get_filenames()
+        with self.lock:
+            index_content = self.index_content
+            modified = self.index_stat[0] / 1e9 if self.index_stat else None
+        if index_content is not None and index_content[0] == filenames:
+            return index_content[1], True
+        content = EncodedContent(
+            json.dumps(build_index(filenames)).encode("utf-8"), modified=modified
+        )
+        with self.lock:
+            self.index_content = (filenames, content)
+        return content, False
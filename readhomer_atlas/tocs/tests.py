@@ -0,0 +1,125 @@
+import json
+
+from django.urls import reverse
+
+import pytest
+
+from . import views
+from .store import TocStore
+from .tree import TocTree
+
+
+TOC = {
+    "@id": "urn:cite:scaife-viewer:toc.iliad",
+    "title": "Iliad",
+    "items": [
+        {
+            "title": "Book 1",
+            "uri": "urn:cts:greekLit:tlg0012.tlg001.perseus-grc2:1",
+            "items": [
+                {
+                    "title": f"Lines {start}-{start + 9}",
+                    "uri": f"urn:cts:greekLit:tlg0012.tlg001.perseus-grc2:1.{start}",
+                }
+                for start in range(1, 51, 10)
+            ],
+        },
+        {
+            "@id": "urn:cite:scaife-viewer:toc.iliad-2",
+            "title": "Book 2",
+            "uri": "urn:cts:greekLit:tlg0012.tlg001.perseus-grc2:2",
+        },
+    ],
+}
+
+
+def get_tree():
+    return TocTree.from_bytes(json.dumps(TOC).encode("utf-8"))
+
+
+def test_find_by_path_and_urn():
+    tree = get_tree()
+    assert tree.find() == 0
+    lines = tree.find(path="0.2")
+    assert tree.entries[lines]["fields"]["title"] == "Lines 21-30"
+    # NOTE: entries without an `@id` are numbered from their parent
+    assert tree.find(urn="urn:cite:scaife-viewer:toc.iliad:0:2") == lines
+    assert tree.find(urn="urn:cite:scaife-viewer:toc.iliad-2") == tree.find(path="1")
+    assert tree.find(path="0.5") is None
+    assert tree.find(urn="urn:cite:scaife-viewer:toc.missing") is None
+
+
+def test_ancestors_run_from_the_root():
+    tree = get_tree()
+    lines = tree.find(path="0.4")
+    ancestors = tree.get_ancestors(lines)
+    assert [tree.entries[index]["path"] for index in ancestors] == ["", "0"]
+    assert tree.get_ancestors(tree.find()) == []
+
+
+def test_serialize_child_ranges():
+    tree = get_tree()
+    book = tree.find(path="0")
+    data = tree.serialize(book, depth=1, offset=1, limit=2)
+    assert data["childCount"] == 5
+    assert [item["path"] for item in data["items"]] == ["0.1", "0.2"]
+    assert all("items" not in item for item in data["items"])
+
+    data = tree.serialize(book, depth=1, offset=4, limit=2)
+    assert [item["path"] for item in data["items"]] == ["0.4"]
+
+    data = tree.serialize(book, depth=1, offset=5, limit=2)
+    assert data["items"] == []
+
+
+def test_serialize_depth():
+    tree = get_tree()
+    root = tree.serialize(0)
+    assert root["childCount"] == 2
+    assert "items" not in root
+
+    root = tree.serialize(0, depth=None)
+    assert [item["title"] for item in root["items"][0]["items"]][-1] == "Lines 41-50"
+    # NOTE: leaves are never given `items`
+    assert "items" not in root["items"][1]
+
+
+def test_serialize_deeply_nested_entries():
+    data = {"title": "0"}
+    for level in range(1, 5000):
+        data = {"title": str(level), "items": [data]}
+    tree = TocTree(data)
+    entry = tree.serialize(0, depth=None)
+    for level in reversed(range(1, 5000)):
+        assert entry["title"] == str(level)
+        entry = entry["items"][0]
+    assert entry["title"] == "0"
+    assert "items" not in entry
+
+
+@pytest.fixture
+def toc_store(tmp_path, monkeypatch):
+    (tmp_path / "toc.iliad.json").write_text(json.dumps(TOC))
+    toc_store = TocStore(str(tmp_path))
+    monkeypatch.setattr(views, "store", toc_store)
+    return toc_store
+
+
+def test_serve_toc_entry_loads_the_toc_once(client, monkeypatch, toc_store):
+    loads = []
+    get = toc_store.get
+
+    def counted_get(filename):
+        loads.append(filename)
+        return get(filename)
+
+    monkeypatch.setattr(toc_store, "get", counted_get)
+    url = reverse("serve_toc_entry", args=["toc.iliad.json"])
+    response = client.get(url, {"path": "0", "limit": 2, "ancestors": 1})
+    assert response.status_code == 200
+    assert loads == ["toc.iliad.json"]
+
+    data = response.json()
+    assert [item["path"] for item in data["items"]] == ["0.0", "0.1"]
+    assert data["next"].endswith("offset=2")
+    assert [ancestor["title"] for ancestor in data["ancestors"]] == ["Iliad"]
@@ -0,0 +1,116 @@
+"""
+Indexes a TOC by URN and by position, so that individual entries, their
+ancestors and ranges of their children can be served without the rest of
+the file.
+
+TOCs follow the format ingested by `scaife_viewer.atlas.importers.tocs`:
+nested entries with a `title`, `uri`, optional `@id` and `items`.
+"""
+import json
+
+
+class TocTree:
+    def __init__(self, data):
+        # each entry is a dict of its fields (less `items`) along with its
+        # `path`, `parent` and `children` (indices into `entries`)
+        self.entries = []
+        self.by_urn = {}
+        self.by_path = {}
+        self.add_entries(data)
+
+    @classmethod
+    def from_bytes(cls, content):
+        return cls(json.loads(content))
+
+    def add_entries(self, root):
+        # NOTE: iterative, since TOCs may be deeply nested
+        stack = [(root, None, None)]
+        while stack:
+            data, parent, position = stack.pop()
+            index = len(self.entries)
+            fields = {key: value for key, value in data.items() if key != "items"}
+            if parent is None:
+                path = ""
+                urn = data.get("@id")
+            else:
+                parent_entry = self.entries[parent]
+                path = (
+                    f"{parent_entry['path']}.{position}"
+                    if parent_entry["path"]
+                    else str(position)
+                )
+                # NOTE: matches the URNs assigned by the atlas TOC importer
+                urn = data.get("@id") or f"{parent_entry['urn']}:{position}"
+                parent_entry["children"].append(index)
+            self.entries.append(
+                {
+                    "fields": fields,
+                    "urn": urn,
+                    "path": path,
+                    "parent": parent,
+                    "children": [],
+                }
+            )
+            if urn is not None:
+                self.by_urn.setdefault(urn, index)
+            self.by_path[path] = index
+            children = data.get("items") or []
+            # reversed, so that children are added in order
+            for child_position in reversed(range(len(children))):
+                stack.append((children[child_position], index, child_position))
+
+    def find(self, urn=None, path=None):
+        """
+        Returns the index of the entry with the given URN or path (the root if
+        neither is given), or None if there is no such entry
+        """
+        if urn is not None:
+            return self.by_urn.get(urn)
+        if path is not None:
+            return self.by_path.get(path)
+        return 0
+
+    def get_ancestors(self, index):
+        ancestors = []
+        parent = self.entries[index]["parent"]
+        while parent is not None:
+            ancestors.append(parent)
+            parent = self.entries[parent]["parent"]
+        return list(reversed(ancestors))
+
+    def serialize_entry(self, index):
+        entry = self.entries[index]
+        data = dict(entry["fields"])
+        if entry["urn"] is not None:
+            data["@id"] = entry["urn"]
+        data["path"] = entry["path"]
+        data["childCount"] = len(entry["children"])
+        return data
+
+    def serialize(self, index, depth=0, offset=0, limit=None):
+        """
+        Returns the entry along with `depth` levels of descendants (all of
+        them when `depth` is None); `offset` and `limit` select a range of the
+        entry's own children
+        """
+        end = None if limit is None else offset + limit
+        root = None
+        # NOTE: iterative, since TOCs may be deeply nested
+        stack = [(index, depth, slice(offset, end), None)]
+        while stack:
+            index, depth, children_slice, siblings = stack.pop()
+            data = self.serialize_entry(index)
+            if siblings is None:
+                root = data
+            else:
+                siblings.append(data)
+
+            children = self.entries[index]["children"]
+            if depth == 0 or not children:
+                continue
+            data["items"] = []
+            child_depth = None if depth is None else depth - 1
+            # reversed, so that children are serialized in order
+            for child in reversed(children[children_slice]):
+                stack.append((child, child_depth, slice(None), data["items"]))
+        return root
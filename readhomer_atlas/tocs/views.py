@@ -1,29 +1,171 @@
 import os
 
 from django.conf import settings
-from django.core.cache import cache
-from django.http import FileResponse, Http404, JsonResponse
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseBadRequest,
+    JsonResponse,
+)
 from django.urls import reverse
+from django.utils.cache import patch_vary_headers
 
+from ..data_version import condition_on_data_version
+from ..metrics import record_cache
+from .store import TocStore
 
-TOC_DATA_PATH = os.path.join(settings.PROJECT_ROOT, "data", "tocs")
-CACHE_FOREVER = None
 
+TOC_DATA_PATH = os.path.join(settings.SV_ATLAS_DATA_DIR, "tocs")
+# the default and maximum number of children returned for a TOC entry
+CHILDREN_PAGE_SIZE = 100
+MAX_CHILDREN_PAGE_SIZE = 1000
+# requested via `?depth=all` to return every descendant of a TOC entry
+ALL_DESCENDANTS = "all"
 
+store = TocStore(TOC_DATA_PATH)
+
+
+def build_index(filenames):
+    return {"tocs": [reverse("serve_toc", args=[filename]) for filename in filenames]}
+
+
+def preload():
+    store.preload(build_index)
+
+
+def encoded_response(request, content):
+    encoding, body = content.select(request)
+    response = HttpResponse(body, content_type="application/json")
+    if encoding:
+        response["Content-Encoding"] = encoding
+    patch_vary_headers(response, ["Accept-Encoding"])
+    return response
+
+
+def get_index(request):
+    """
+    Returns the index content, loading it once per request (for both the
+    validators and the response)
+    """
+    if not hasattr(request, "_toc_index"):
+        content, hit = store.get_index(build_index)
+        record_cache(request, "tocs", hit)
+        request._toc_index = content
+    return request._toc_index
+
+
+def get_toc(request, filename):
+    """
+    Returns the content of a TOC (or None if it does not exist), loading it
+    once per request (for both the validators and the response)
+    """
+    if not hasattr(request, "_toc"):
+        content, hit = store.get(filename)
+        record_cache(request, "tocs", hit)
+        request._toc = content
+    return request._toc
+
+
+def get_toc_tree(request, filename):
+    """
+    Returns the content and TocTree of a TOC (both None if it does not
+    exist), loading them once per request (for both the validators and the
+    response)
+    """
+    if not hasattr(request, "_toc_tree"):
+        content, tree, hit = store.get_tree(filename)
+        record_cache(request, "tocs", hit)
+        request._toc_tree = content, tree
+    return request._toc_tree
+
+
+def get_index_version(request):
+    return get_index(request).version
+
+
+def get_toc_version(request, filename):
+    # NOTE: validators must change when a TOC is reloaded, even though the
+    # data version does not
+    content = get_toc(request, filename)
+    return content.version if content is not None else None
+
+
+@condition_on_data_version(vary_on_encoding=True, get_content_version=get_index_version)
 def tocs_index(request):
-    key = "tocs-index"
-    data = cache.get(key)
-    if data is None:
-        data = []
-        files = [f for f in os.listdir(TOC_DATA_PATH) if f.count(".json")]
-        for filename in files:
-            data.append(reverse("serve_toc", args=[filename]))
-        cache.set(key, data, CACHE_FOREVER)
-    return JsonResponse({"tocs": data})
+    return encoded_response(request, get_index(request))
 
 
+@condition_on_data_version(vary_on_encoding=True, get_content_version=get_toc_version)
 def serve_toc(request, filename):
-    path = os.path.join(TOC_DATA_PATH, filename)
-    if not os.path.exists(path):
+    content = get_toc(request, filename)
+    if content is None:
         raise Http404
-    return FileResponse(open(path, "rb"))
+    return encoded_response(request, content)
+
+
+def get_int_param(request, name, default, minimum=0, maximum=None):
+    """
+    Returns the integer query parameter, or raises ValueError if it is invalid
+    """
+    value = int(request.GET.get(name, default))
+    if value < minimum or (maximum is not None and value > maximum):
+        raise ValueError(name)
+    return value
+
+
+def get_toc_tree_version(request, filename):
+    content, _ = get_toc_tree(request, filename)
+    return content.version if content is not None else None
+
+
+@condition_on_data_version(get_content_version=get_toc_tree_version)
+def serve_toc_entry(request, filename):
+    """
+    Serves a single TOC entry, selected by `?urn` or `?path` (positions
+    separated by `.`, e.g. `0.3`) and defaulting to the root, with:
+
+    - `?depth`: levels of descendants to include (default 1, or `all`)
+    - `?offset` / `?limit`: the range of the entry's children to include
+    - `?ancestors`: when set, the entries from the root to its parent
+    """
+    _, tree = get_toc_tree(request, filename)
+    if tree is None:
+        raise Http404
+
+    index = tree.find(urn=request.GET.get("urn"), path=request.GET.get("path"))
+    if index is None:
+        raise Http404
+
+    try:
+        if request.GET.get("depth") == ALL_DESCENDANTS:
+            depth = None
+        else:
+            depth = get_int_param(request, "depth", 1)
+        offset = get_int_param(request, "offset", 0)
+        limit = get_int_param(
+            request,
+            "limit",
+            CHILDREN_PAGE_SIZE,
+            minimum=1,
+            maximum=MAX_CHILDREN_PAGE_SIZE,
+        )
+    except ValueError:
+        return HttpResponseBadRequest(
+            "depth and offset must be non-negative integers (depth may also be "
+            f'"{ALL_DESCENDANTS}") and limit between 1 and {MAX_CHILDREN_PAGE_SIZE}'
+        )
+
+    data = tree.serialize(index, depth=depth, offset=offset, limit=limit)
+    child_count = data["childCount"]
+    if depth != 0 and child_count:
+        data["offset"] = offset
+        data["limit"] = limit
+        if offset + limit < child_count:
+            params = request.GET.copy()
+            params["offset"] = offset + limit
+            data["next"] = f"{request.path}?{params.urlencode()}"
+    if request.GET.get("ancestors"):
+        data["ancestors"] = [
+            tree.serialize(ancestor) for ancestor in tree.get_ancestors(index)
+        ]
+    return JsonResponse(data)
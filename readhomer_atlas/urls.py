@@ -1,14 +1,25 @@
 from django.urls import include, path
+from django.views.decorators.csrf import csrf_exempt
 
 from django.contrib import admin
 
-from .tocs.views import serve_toc, tocs_index
+from .graphql_api.views import AtlasGraphQLView
+from .metrics import serve_metrics
+from .tocs.views import serve_toc, serve_toc_entry, tocs_index
 
 
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path("metrics", serve_metrics, name="metrics"),
+    path("tocs/<filename>/entry/", serve_toc_entry, name="serve_toc_entry"),
     path("tocs/<filename>", serve_toc, name="serve_toc"),
     path("tocs/", tocs_index, name="tocs_index"),
     path("wa/", include("readhomer_atlas.web_annotation.urls")),
+    # NOTE: takes precedence over the atlas' own endpoint
+    path(
+        "graphql/",
+        csrf_exempt(AtlasGraphQLView.as_view(graphiql=True)),
+        name="graphql_endpoint",
+    ),
     path("", include("scaife_viewer.atlas.urls")),
 ]
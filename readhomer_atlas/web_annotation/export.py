@@ -0,0 +1,57 @@
+"""
+Exports every annotation in the FolioAnnotation index as newline-delimited
+JSON-LD, in a single pass over the index.
+"""
+from itertools import groupby
+
+from .generators import (
+    ITEM_BATCH_SIZE,
+    WebAnnotationCollectionGenerator,
+    get_generator_for_kind,
+)
+from .models import FolioAnnotation
+from .shims import SHIM_CLASSES, get_shim_for_kind
+from .streaming import dumps
+from .utils import folio_exemplar_urn_to_site_urn
+
+
+EXPORT_KINDS = [shim_class.annotation_kind for shim_class in SHIM_CLASSES]
+
+
+def iter_annotations(kinds=None, on_error=None):
+    """
+    Yields each annotation of the given kinds (every kind by default),
+    ordered by kind, folio and idx.
+
+    Annotations that fail to generate (e.g. those missing bounding box
+    data) are skipped, calling `on_error` with their kind, folio URN, idx
+    (None when the rest of the folio was skipped) and the exception.
+    """
+    entries = FolioAnnotation.objects.order_by("annotation_kind", "folio_urn", "idx")
+    if kinds:
+        entries = entries.filter(annotation_kind__in=kinds)
+    # NOTE: streamed via a server-side cursor where supported (SQLite
+    # fetches rows in chunks from a regular cursor)
+    entries = entries.iterator(chunk_size=ITEM_BATCH_SIZE)
+    for (annotation_kind, folio_urn), folio_entries in groupby(
+        entries, key=lambda entry: (entry.annotation_kind, entry.folio_urn)
+    ):
+        urn = folio_exemplar_urn_to_site_urn(folio_urn)
+        shim = get_shim_for_kind(annotation_kind)(urn)
+        objects = shim.iter_resolved_entries(folio_entries, batch_size=ITEM_BATCH_SIZE)
+        collection = WebAnnotationCollectionGenerator(
+            get_generator_for_kind(annotation_kind), urn, objects
+        )
+
+        def on_object_error(wa, e):
+            # NOTE: matches `render_web_annotations`, which skips anything
+            # that fails to render
+            if on_error:
+                on_error(annotation_kind, urn, wa.idx if wa else None, e)
+
+        yield from collection.iter_objects(on_error=on_object_error)
+
+
+def iter_ndjson(annotations):
+    for annotation in annotations:
+        yield dumps(annotation) + b"\n"
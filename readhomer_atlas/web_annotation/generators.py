@@ -1,15 +1,25 @@
-from django.db.models import Q
+from functools import lru_cache
+from itertools import islice
+
+from django.conf import settings
 from django.shortcuts import Http404
 from django.urls import reverse_lazy
 from django.utils.functional import cached_property
 
-from scaife_viewer.atlas.models import ImageROI, Node
+from scaife_viewer.atlas.models import Node
 
+from ..data_version import get_data_version
 from ..iiif import IIIFResolver
+from .models import FolioLineROI
 from .shortcuts import build_absolute_url
 from .utils import preferred_folio_urn
 
 
+# the number of objects to resolve bounding boxes for at a time when
+# generating items for a collection
+ITEM_BATCH_SIZE = 100
+
+
 def map_dimensions_to_integers(dimensions):
     """
     FragmentSelector requires percentages expressed as integers.
@@ -22,11 +32,56 @@ def map_dimensions_to_integers(dimensions):
     return int_dimensions
 
 
+def get_union_extent(coords):
+    """
+    Returns the smallest box (as percentages) containing every (x, y, w, h)
+    box in `coords`, regardless of their order
+    """
+    # NOTE: scaled before summing, to match the rounding of the percentages
+    # computed previously
+    boxes = [[value * 100 for value in box] for box in coords]
+    x0 = min(x for x, y, w, h in boxes)
+    y0 = min(y for x, y, w, h in boxes)
+    x1 = max(x + w for x, y, w, h in boxes)
+    y1 = max(y + h for x, y, w, h in boxes)
+    return {"x": x0, "y": y0, "w": x1 - x0, "h": y1 - y0}
+
+
+def build_folio_iiif_resolver(folio_urn):
+    folio = Node.objects.get(urn=folio_urn)
+    return IIIFResolver(folio.image_annotations.first().urn)
+
+
+@lru_cache(maxsize=settings.FOLIO_IMAGE_CACHE_SIZE)
+def get_versioned_folio_iiif_resolver(folio_urn, version):
+    return build_folio_iiif_resolver(folio_urn)
+
+
+def get_folio_iiif_resolver(folio_urn):
+    """
+    Returns an IIIFResolver for the image of the folio; cached per process,
+    since every annotation on a folio targets the same image.
+
+    Keyed on the data version, so that running processes stop using
+    resolvers built before the database was rebuilt; also cleared via
+    `clear_folio_caches` when the web annotation index is rebuilt.  Without
+    a data version (when the database wasn't built by `prepare_db`) nothing
+    would tell a rebuild apart, so resolvers aren't cached.
+    """
+    data_version = get_data_version()
+    if data_version is None:
+        return build_folio_iiif_resolver(folio_urn)
+    return get_versioned_folio_iiif_resolver(folio_urn, data_version["version"])
+
+
+def clear_folio_caches():
+    get_versioned_folio_iiif_resolver.cache_clear()
+
+
 class FolioImageAnnotationMixin:
     @cached_property
     def folio_image_urn(self):
-        folio = Node.objects.get(urn=preferred_folio_urn(self.urn))
-        return folio.image_annotations.first().urn
+        return self.iiif_obj.urn
 
     def get_absolute_url(self):
         url = reverse_lazy(
@@ -37,51 +92,69 @@ class FolioImageAnnotationMixin:
 
     @cached_property
     def iiif_obj(self):
-        image_urn = self.folio_image_urn
-        return IIIFResolver(image_urn)
+        return get_folio_iiif_resolver(preferred_folio_urn(self.urn))
 
 
-class FolioBoundingBoxAnnotationMixin(FolioImageAnnotationMixin):
-    def get_urn_coordinates(self, urns):
-        # first convert urns to folio exmplar URNS
-        predicate = Q()
+class BoundingBoxResolver:
+    """
+    Resolves references to ROI coordinates for a folio in bulk, so that
+    every generator on a page can share the same lookup
+    """
+
+    def __init__(self, folio_urn):
+        self.urn = folio_urn
+        # ref -> {roi pk: coordinates}
+        self.lookup = {}
+
+    @staticmethod
+    def get_ref(urn):
+        _, ref = urn.rsplit(":", maxsplit=1)
+        return ref
+
+    def resolve(self, urns):
+        refs = {self.get_ref(urn) for urn in urns} - set(self.lookup)
+        if not refs:
+            return
+
+        for ref in refs:
+            self.lookup[ref] = {}
+        # NOTE: FolioLineROI is keyed by the surface URN, which validates
+        # that the URNs are found within the current folio
+        rois = FolioLineROI.objects.filter(
+            surface_urn=self.urn, ref__in=refs
+        ).values_list("ref", "roi_pk", "x", "y", "w", "h")
+        for ref, roi_pk, *coords in rois:
+            self.lookup[ref][roi_pk] = coords
+
+    def get_coordinates(self, urns):
+        self.resolve(urns)
+        rois = {}
         for urn in urns:
-            _, ref = urn.rsplit(":", maxsplit=1)
-            predicate.add(Q(urn__endswith=f".{ref}"), Q.OR)
+            rois.update(self.lookup[self.get_ref(urn)])
+        # NOTE: ordered for determinism; extents do not depend on the order
+        return [rois[pk] for pk in sorted(rois)]
 
-        # retrieve folio exemplar URNs
-        text_parts = Node.objects.filter(
-            urn__startswith="urn:cts:greekLit:tlg0012.tlg001.msA-folios:"
-        ).filter(predicate)
 
-        # @@@ order of these ROIs is really important; do we ensure it?
-        roi_qs = ImageROI.objects.filter(text_parts__in=text_parts)
-        if not roi_qs:
+class FolioBoundingBoxAnnotationMixin(FolioImageAnnotationMixin):
+    @cached_property
+    def bounding_box_resolver(self):
+        """
+        Replaced by WebAnnotationCollectionGenerator with a resolver
+        shared across the page
+        """
+        return BoundingBoxResolver(self.urn)
+
+    def get_urn_coordinates(self, urns):
+        coordinates = self.bounding_box_resolver.get_coordinates(urns)
+        if not coordinates:
             # @@@ we should handle this further up the chain;
             # this ensures we don't serve a 500 when we're missing
             # bounding box data
             raise Http404
-        coordinates = []
-        for roi_obj in roi_qs:
-            if roi_obj.data["urn:cite2:hmt:va_dse.v1.surface:"] != self.urn:
-                # @@@ validates that the URNs are found within the current folio
-                # @@@ prefer we don't look at data to handle that
-                continue
-            coords = [float(part) for part in roi_obj.coordinates_value.split(",")]
-            coordinates.append(coords)
         return coordinates
 
     def get_bounding_box_dimensions(self, coords):
-        dimensions = {}
-        y_coords = []
-        for x, y, w, h in coords:
-            dimensions["x"] = min(dimensions.get("x", 100.0), x * 100)
-            dimensions["y"] = min(dimensions.get("y", 100.0), y * 100)
-            dimensions["w"] = max(dimensions.get("w", 0.0), w * 100)
-            y_coords.append(y * 100)
-
-        dimensions["h"] = y_coords[-1] - y_coords[0] + h * 100
-        return dimensions
+        return get_union_extent(coords)
 
     def get_bounding_boxes_for_urns(self, urns):
         urn_coordinates = self.get_urn_coordinates(urns)
@@ -230,18 +303,18 @@ class NamedEntitiesGenerator(FolioImageAnnotationMixin):
                 },
             ],
             "type": "Annotation",
-            "label": f'Named Entity data for {work_label} {self.iiif_obj.munged_image_path} text "{self.named_entity["token"].word_value}"',
+            "label": f'Named Entity data for {work_label} {self.iiif_obj.munged_image_path} text "{self.named_entity["word_value"]}"',
             "creator": "https://scaife-viewer.org/",
             "body": [
                 {
                     "purpose": "commenting",
                     "type": "TextualBody",
-                    "value": f'{self.named_entity["named_entity_obj"].title}',
+                    "value": f'{self.named_entity["title"]}',
                     "format": "text/plain",
                 },
                 {
                     "purpose": "identifying",
-                    "source": f'{self.named_entity["named_entity_obj"].url}',
+                    "source": f'{self.named_entity["url"]}',
                     "format": "text/html",
                 },
             ],
@@ -257,7 +330,7 @@ class NamedEntitiesGenerator(FolioImageAnnotationMixin):
                     "source": {"id": f"{self.iiif_obj.canvas_url}", "type": "Canvas"},
                 },
                 # @@@ URI / ASCII requirements and our subpaths
-                f'{self.named_entity["token"].text_part.urn}@{self.named_entity["token"].subref_value}',
+                f'{self.named_entity["text_part_urn"]}@{self.named_entity["subref_value"]}',
             ],
         }
 
@@ -268,13 +341,11 @@ class AudioAnnotationsGenerator(FolioBoundingBoxAnnotationMixin):
     def __init__(self, folio_urn, audio_annotation):
         self.urn = folio_urn
         self.audio_annotation = audio_annotation["obj"]
+        # NOTE: resolved in bulk by `AudioAnnotationsShim`
+        self.annotation_references = audio_annotation["text_part_urns"]
         # @@@
         self.idx = audio_annotation["idx"]
 
-    @cached_property
-    def annotation_references(self):
-        return list(self.audio_annotation.text_parts.values_list("urn", flat=True))
-
     def get_references_for_bounding_box(self):
         return self.annotation_references
 
@@ -312,22 +383,77 @@ class AudioAnnotationsGenerator(FolioBoundingBoxAnnotationMixin):
 class WebAnnotationCollectionGenerator:
     def __init__(self, generator_class, urn, objects):
         self.generator_class = generator_class
+        # NOTE: may be an iterator, in which case `iter_items` consumes it
+        # in batches
         self.objects = objects
         self.urn = urn
-        self.item_list = []
 
-    def append_to_item_list(self, data):
+    def prepare_item(self, data):
         # strip @context key
         # @@@@
         data.pop("@context", None)
-        self.item_list.append(data)
+        return data
+
+    def prepare_bounding_boxes(self, generators, resolver):
+        """
+        Resolves the bounding boxes for every generator in a single pass
+        """
+        references = []
+        for wa in generators:
+            if not isinstance(wa, FolioBoundingBoxAnnotationMixin):
+                continue
+            wa.bounding_box_resolver = resolver
+            references.extend(wa.get_references_for_bounding_box())
+        resolver.resolve(references)
+
+    def iter_generators(self, batch_size=ITEM_BATCH_SIZE):
+        """
+        Yields a generator for each object, with the bounding boxes for each
+        batch of `batch_size` objects resolved together
+        """
+        resolver = BoundingBoxResolver(self.urn)
+        objects = iter(self.objects)
+        while True:
+            batch = list(islice(objects, batch_size))
+            if not batch:
+                return
+            generators = [self.generator_class(self.urn, obj) for obj in batch]
+            self.prepare_bounding_boxes(generators, resolver)
+            yield from generators
+
+    def iter_items(self, batch_size=ITEM_BATCH_SIZE):
+        """
+        Yields items one at a time; see `iter_generators`
+        """
+        for wa in self.iter_generators(batch_size=batch_size):
+            yield self.prepare_item(wa.obj)
+
+    def iter_objects(self, on_error=None, batch_size=ITEM_BATCH_SIZE):
+        """
+        Yields annotations one at a time, skipping those that fail to generate
+        (e.g. those missing bounding box data) and calling `on_error` with
+        their generator (None when the rest of the objects were skipped) and
+        the exception
+        """
+        generators = self.iter_generators(batch_size=batch_size)
+        while True:
+            wa = None
+            try:
+                wa = next(generators)
+                obj = wa.obj
+            except StopIteration:
+                return
+            except Exception as e:
+                # NOTE: a failure while preparing a batch (when `wa` is None)
+                # ends `generators`, skipping the rest of the objects
+                if on_error:
+                    on_error(wa, e)
+                continue
+            yield obj
 
     @property
     def items(self):
-        for obj in self.objects:
-            wa = self.generator_class(self.urn, obj)
-            self.append_to_item_list(wa.obj)
-        return self.item_list
+        return list(self.iter_items())
 
 
 def get_generator_for_kind(annotation_kind):
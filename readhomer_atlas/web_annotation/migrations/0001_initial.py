@@ -0,0 +1,36 @@
+# Generated by Django 2.2.15 on 2026-10-17 02:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="FolioAnnotation",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("folio_urn", models.CharField(max_length=255)),
+                ("annotation_kind", models.CharField(max_length=255)),
+                ("idx", models.IntegerField(help_text="0-based index")),
+                ("object_pk", models.IntegerField()),
+                ("token_pk", models.IntegerField(blank=True, null=True)),
+            ],
+            options={
+                "ordering": ["folio_urn", "annotation_kind", "idx"],
+                "unique_together": {("folio_urn", "annotation_kind", "idx")},
+            },
+        ),
+    ]
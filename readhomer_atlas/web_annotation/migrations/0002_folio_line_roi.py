@@ -0,0 +1,39 @@
+# Generated by Django 2.2.15 on 2026-10-17 02:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("web_annotation", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FolioLineROI",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("ref", models.CharField(max_length=255)),
+                ("surface_urn", models.CharField(max_length=255)),
+                ("text_part_pk", models.IntegerField()),
+                ("roi_pk", models.IntegerField()),
+                ("coordinates_value", models.CharField(max_length=255)),
+            ],
+            options={"ordering": ["surface_urn", "ref", "roi_pk"],},
+        ),
+        migrations.AddIndex(
+            model_name="foliolineroi",
+            index=models.Index(
+                fields=["surface_urn", "ref"], name="web_annotat_surface_72f98c_idx"
+            ),
+        ),
+    ]
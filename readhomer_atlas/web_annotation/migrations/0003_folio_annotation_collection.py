@@ -0,0 +1,32 @@
+# Generated by Django 2.2.15 on 2026-10-17 02:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("web_annotation", "0002_folio_line_roi"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FolioAnnotationCollection",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("canvas_identifier", models.CharField(db_index=True, max_length=255)),
+                ("folio_urn", models.CharField(max_length=255)),
+                ("annotation_kind", models.CharField(max_length=255)),
+                ("count", models.IntegerField()),
+            ],
+            options={"ordering": ["canvas_identifier", "annotation_kind"],},
+        ),
+    ]
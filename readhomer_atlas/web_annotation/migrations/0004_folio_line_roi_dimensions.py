@@ -0,0 +1,49 @@
+# Generated by Django 2.2.15 on 2026-10-17 09:12
+
+from django.db import migrations, models
+
+
+def populate_dimensions(apps, schema_editor):
+    FolioLineROI = apps.get_model("web_annotation", "FolioLineROI")
+    to_update = []
+    for roi in FolioLineROI.objects.all():
+        roi.x, roi.y, roi.w, roi.h = [
+            float(part) for part in roi.coordinates_value.split(",")
+        ]
+        to_update.append(roi)
+    FolioLineROI.objects.bulk_update(to_update, ["x", "y", "w", "h"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("web_annotation", "0003_folio_annotation_collection"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="foliolineroi",
+            name="h",
+            field=models.FloatField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="foliolineroi",
+            name="w",
+            field=models.FloatField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="foliolineroi",
+            name="x",
+            field=models.FloatField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="foliolineroi",
+            name="y",
+            field=models.FloatField(default=0),
+            preserve_default=False,
+        ),
+        migrations.RunPython(populate_dimensions, migrations.RunPython.noop),
+    ]
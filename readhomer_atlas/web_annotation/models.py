@@ -0,0 +1,79 @@
+from django.db import models
+
+
+class FolioAnnotation(models.Model):
+    """
+    Materialized (folio_urn, annotation_kind, idx) lookup for the annotations
+    served by the web_annotation views.
+
+    Populated via the `build_web_annotation_index` management command.
+    """
+
+    # @@@ the folio exemplar URN, see `utils.preferred_folio_urn`
+    folio_urn = models.CharField(max_length=255)
+    annotation_kind = models.CharField(max_length=255)
+    idx = models.IntegerField(help_text="0-based index")
+
+    # @@@ pk of the TextAlignmentRecord, NamedEntity or AudioAnnotation
+    object_pk = models.IntegerField()
+    # @@@ only populated for named entities
+    token_pk = models.IntegerField(blank=True, null=True)
+
+    class Meta:
+        ordering = ["folio_urn", "annotation_kind", "idx"]
+        unique_together = [("folio_urn", "annotation_kind", "idx")]
+
+    def __str__(self):
+        return f"{self.folio_urn} {self.annotation_kind} {self.idx}"
+
+
+class FolioLineROI(models.Model):
+    """
+    Maps line refs (e.g. `1.1`) to the folio exemplar text parts and ImageROIs
+    used to compute bounding boxes, replacing suffix scans against Node URNs.
+
+    Populated via the `build_web_annotation_index` management command.
+    """
+
+    ref = models.CharField(max_length=255)
+    # @@@ denormed from ImageROI.data; matches the CITE URN of the folio
+    surface_urn = models.CharField(max_length=255)
+
+    # @@@ pk of the folio exemplar Node
+    text_part_pk = models.IntegerField()
+    roi_pk = models.IntegerField()
+    coordinates_value = models.CharField(max_length=255)
+    # @@@ parsed from `coordinates_value` (fractions of the image dimensions)
+    # so that bounding boxes can be computed without parsing it per request
+    x = models.FloatField()
+    y = models.FloatField()
+    w = models.FloatField()
+    h = models.FloatField()
+
+    class Meta:
+        ordering = ["surface_urn", "ref", "roi_pk"]
+        indexes = [models.Index(fields=["surface_urn", "ref"])]
+
+    def __str__(self):
+        return f"{self.surface_urn} {self.ref}"
+
+
+class FolioAnnotationCollection(models.Model):
+    """
+    Precomputed availability of annotation collections for the canvas
+    of each folio, used by the discovery view.
+
+    Populated via the `build_web_annotation_index` management command.
+    """
+
+    canvas_identifier = models.CharField(max_length=255, db_index=True)
+    # @@@ the folio exemplar URN, see `utils.preferred_folio_urn`
+    folio_urn = models.CharField(max_length=255)
+    annotation_kind = models.CharField(max_length=255)
+    count = models.IntegerField()
+
+    class Meta:
+        ordering = ["canvas_identifier", "annotation_kind"]
+
+    def __str__(self):
+        return f"{self.canvas_identifier} {self.annotation_kind} {self.count}"
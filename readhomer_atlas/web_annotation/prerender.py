@@ -0,0 +1,147 @@
+"""
+Serves Web Annotation JSON written to disk by the `render_web_annotations`
+management command, falling back to the dynamic views when a file is missing.
+
+Files are only served while the data version recorded in the directory's
+manifest matches the current one, so that they are bypassed after the
+database is rebuilt until they are rendered again.
+"""
+import gzip
+import json
+import os
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import FileResponse
+from django.utils.cache import patch_response_headers, patch_vary_headers
+
+from ..data_version import (
+    WatchedJsonFile,
+    get_accepted_encodings,
+    get_data_version,
+)
+from ..metrics import record_cache
+
+
+MANIFEST_FILENAME = "manifest.json"
+
+
+def get_manifest_path(root=None):
+    if root is None:
+        root = settings.WEB_ANNOTATION_PRERENDER_DIR
+    return os.path.join(root, MANIFEST_FILENAME)
+
+
+manifest_file = WatchedJsonFile(get_manifest_path)
+
+
+def get_data_version_key():
+    data_version = get_data_version()
+    return data_version["version"] if data_version else None
+
+
+def write_manifest(root, **data):
+    data["data_version"] = get_data_version_key()
+    with open(get_manifest_path(root), "w") as f:
+        json.dump(data, f)
+
+
+def read_manifest(root):
+    try:
+        with open(get_manifest_path(root)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_prerendered_current():
+    """
+    Returns whether the pre-rendered files were rendered from the current data
+    """
+    manifest = manifest_file.get()
+    if manifest is None:
+        return False
+    return manifest.get("data_version") == get_data_version_key()
+
+
+def build_prerendered_path(*parts, root=None):
+    if root is None:
+        root = settings.WEB_ANNOTATION_PRERENDER_DIR
+    root = os.path.abspath(root)
+    path = os.path.abspath(os.path.join(root, *parts))
+    # guards against URL segments like `..` escaping the directory
+    if not path.startswith(f"{root}{os.sep}"):
+        return None
+    return path
+
+
+def annotation_path(annotation_kind, urn, idx, **kwargs):
+    return build_prerendered_path(urn, annotation_kind, f"{idx}.json", **kwargs)
+
+
+def collection_path(annotation_kind, urn, **kwargs):
+    return build_prerendered_path(urn, annotation_kind, "collection.json", **kwargs)
+
+
+def page_path(annotation_kind, urn, zero_page_number, **kwargs):
+    return build_prerendered_path(
+        urn, annotation_kind, "collection", f"{zero_page_number}.json", **kwargs
+    )
+
+
+def write_prerendered(path, data, compress=False):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # NOTE: matches the serialization used by JsonResponse
+    content = json.dumps(data, cls=DjangoJSONEncoder).encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(content)
+    if compress:
+        # mtime=0 keeps the output deterministic across builds
+        with gzip.GzipFile(f"{path}.gz", mode="wb", mtime=0) as f:
+            f.write(content)
+
+
+def get_prerendered_response(request, path):
+    if path is None:
+        return None
+
+    accepts_gzip = "gzip" in get_accepted_encodings(request)
+    if accepts_gzip and os.path.exists(f"{path}.gz"):
+        response = FileResponse(
+            open(f"{path}.gz", "rb"), content_type="application/json"
+        )
+        response["Content-Encoding"] = "gzip"
+    elif os.path.exists(path):
+        response = FileResponse(open(path, "rb"), content_type="application/json")
+    else:
+        return None
+    patch_vary_headers(response, ["Accept-Encoding"])
+    patch_response_headers(response, settings.DEFAULT_HTTP_CACHE_DURATION)
+    return response
+
+
+def serve_prerendered(get_path):
+    """
+    Serves the pre-rendered file for a view when present.
+
+    `get_path` is called with the view's URL kwargs.
+    """
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapped_view(request, *args, **kwargs):
+            # NOTE: files are only rendered for the default query parameters
+            if request.GET:
+                return view_func(request, *args, **kwargs)
+            response = None
+            if is_prerendered_current():
+                response = get_prerendered_response(request, get_path(**kwargs))
+            record_cache(request, "prerendered", response is not None)
+            if response is None:
+                return view_func(request, *args, **kwargs)
+            return response
+
+        return wrapped_view
+
+    return decorator
@@ -1,7 +1,11 @@
+from collections import defaultdict
+from itertools import islice
+
 from django.utils.functional import cached_property
 
 from scaife_viewer.atlas.models import (
     AudioAnnotation,
+    NamedEntity,
     Node,
     TextAlignmentRecord,
     Token,
@@ -11,10 +15,13 @@ from scaife_viewer.atlas.utils import (
     get_textparts_from_passage_reference,
 )
 
+from .models import FolioAnnotation
 from .utils import preferred_folio_urn
 
 
 class FolioShimBase:
+    annotation_kind = None
+    label = None
     version_urn = "urn:cts:greekLit:tlg0012.tlg001.perseus-grc2:"
 
     def __init__(self, folio_urn):
@@ -51,6 +58,64 @@ class FolioShimBase:
 
         return get_textparts_from_passage_reference(passage_reference, version)
 
+    def get_index_entries(self):
+        """
+        Returns (idx, object_pk, token_pk) tuples used to populate
+        the FolioAnnotation index
+        """
+        raise NotImplementedError("Subclasses must implement this method")
+
+    def build_index_entries(self):
+        return [
+            FolioAnnotation(
+                folio_urn=self.folio_urn,
+                annotation_kind=self.annotation_kind,
+                idx=idx,
+                object_pk=object_pk,
+                token_pk=token_pk,
+            )
+            for idx, object_pk, token_pk in self.get_index_entries()
+        ]
+
+    def get_index_queryset(self):
+        """
+        Returns a lazy, sliceable queryset of FolioAnnotation entries
+        for the folio, suitable for use with a Paginator
+        """
+        return FolioAnnotation.objects.filter(
+            folio_urn=self.folio_urn, annotation_kind=self.annotation_kind
+        ).order_by("idx")
+
+    def resolve_index_entries(self, entries, fields=None):
+        """
+        Resolves FolioAnnotation entries to the objects
+        consumed by the generators, preserving order
+        """
+        raise NotImplementedError("Subclasses must implement this method")
+
+    def iter_resolved_entries(self, entries, batch_size=100):
+        """
+        Resolves FolioAnnotation entries in batches, so that only a batch
+        of objects is held in memory at a time
+        """
+        entries = iter(entries)
+        while True:
+            batch = list(islice(entries, batch_size))
+            if not batch:
+                return
+            yield from self.resolve_index_entries(batch)
+
+    def get_object(self, idx, fields=None):
+        """
+        Resolves a single object via the FolioAnnotation index,
+        rather than building the entire object list for the folio
+        """
+        entries = self.get_index_queryset().filter(idx=idx)
+        object_list = self.resolve_index_entries(entries, fields=fields)
+        if not object_list:
+            return None
+        return object_list[0]
+
 
 class AlignmentsShim(FolioShimBase):
     """
@@ -59,6 +124,9 @@ class AlignmentsShim(FolioShimBase):
     and ship to explorehomer directly.
     """
 
+    annotation_kind = "translation-alignment"
+    label = "Translation Alignments"
+
     def get_object_list(self, idx=None, fields=None):
         if fields is None:
             fields = [
@@ -74,28 +142,105 @@ class AlignmentsShim(FolioShimBase):
         ).values(*fields)
         return list(alignments)
 
+    def get_index_entries(self):
+        textparts_queryset = self.get_textparts_queryset()
+        alignments = TextAlignmentRecord.objects.filter(
+            relations__tokens__text_part__in=textparts_queryset
+        ).values_list("idx", "pk")
+        # NOTE: records are joined via tokens, so we only keep the first
+        # row for each idx
+        seen = set()
+        for idx, pk in alignments:
+            if idx in seen:
+                continue
+            seen.add(idx)
+            yield idx, pk, None
+
+    def resolve_index_entries(self, entries, fields=None):
+        if fields is None:
+            fields = ["idx"]
+        entries = list(entries)
+        alignments = TextAlignmentRecord.objects.filter(
+            pk__in=[entry.object_pk for entry in entries]
+        ).values("pk", *fields)
+        lookup = {}
+        for alignment in alignments:
+            lookup[alignment.pop("pk")] = alignment
+        return [lookup[entry.object_pk] for entry in entries]
+
 
 class NamedEntitiesShim(FolioShimBase):
+    annotation_kind = "named-entities"
+    label = "Named Entities"
+
+    @staticmethod
+    def build_row(idx, token, named_entity):
+        token_pk, word_value, subref_value, text_part_urn = token
+        named_entity_pk, title, url = named_entity
+        return {
+            "idx": idx,
+            "token_pk": token_pk,
+            "word_value": word_value,
+            "subref_value": subref_value,
+            "text_part_urn": text_part_urn,
+            "named_entity_pk": named_entity_pk,
+            "title": title,
+            "url": url,
+        }
+
     def get_object_list(self, idx=None, fields=None):
         textparts_queryset = self.get_textparts_queryset()
 
-        named_entities = []
+        # NOTE: query from the entity side, so we only retrieve
+        # tokens that have named entities
+        through_model = NamedEntity.tokens.through
+        rows = (
+            through_model.objects.filter(token__text_part__in=textparts_queryset)
+            .order_by("token_id", "namedentity_id")
+            .values_list(
+                "token_id",
+                "token__word_value",
+                "token__subref_value",
+                "token__text_part__urn",
+                "namedentity_id",
+                "namedentity__title",
+                "namedentity__url",
+            )
+        )
         # @@@ fake idx
-        idx = 0
+        return [self.build_row(idx, row[:4], row[4:]) for idx, row in enumerate(rows)]
+
+    def get_index_entries(self):
+        for named_entity in self.get_object_list():
+            yield (
+                named_entity["idx"],
+                named_entity["named_entity_pk"],
+                named_entity["token_pk"],
+            )
+
+    def resolve_index_entries(self, entries, fields=None):
+        entries = list(entries)
         tokens = Token.objects.filter(
-            text_part__in=textparts_queryset
-        ).prefetch_related("named_entities")
-        for token in tokens:
-            for named_entity in token.named_entities.all():
-                print(idx)
-                named_entities.append(
-                    {"token": token, "named_entity_obj": named_entity, "idx": idx}
-                )
-                idx += 1
-        return named_entities
+            pk__in=[entry.token_pk for entry in entries]
+        ).values_list("pk", "word_value", "subref_value", "text_part__urn")
+        tokens = {token[0]: token for token in tokens}
+        named_entities = NamedEntity.objects.filter(
+            pk__in=[entry.object_pk for entry in entries]
+        ).values_list("pk", "title", "url")
+        named_entities = {
+            named_entity[0]: named_entity for named_entity in named_entities
+        }
+        return [
+            self.build_row(
+                entry.idx, tokens[entry.token_pk], named_entities[entry.object_pk]
+            )
+            for entry in entries
+        ]
 
 
 class AudioAnnotationsShim(FolioShimBase):
+    annotation_kind = "audio-annotations"
+    label = "Audio Annotations"
     version_urn = "urn:cts:greekLit:tlg0012.tlg001.msA:"
 
     def get_object_list(self, idx=None, fields=None):
@@ -106,3 +251,49 @@ class AudioAnnotationsShim(FolioShimBase):
                 AudioAnnotation.objects.filter(text_parts__in=textparts_queryset)
             )
         ]
+
+    def get_index_entries(self):
+        for audio_annotation in self.get_object_list():
+            yield audio_annotation["idx"], audio_annotation["obj"].pk, None
+
+    @staticmethod
+    def get_text_part_urns(audio_annotation_pks):
+        """
+        Returns the URNs of the text parts of each audio annotation, in
+        order, via a single query against the through table
+        """
+        through_model = AudioAnnotation.text_parts.through
+        rows = (
+            through_model.objects.filter(audioannotation_id__in=audio_annotation_pks)
+            .order_by("audioannotation_id", through_model._sort_field_name)
+            .values_list("audioannotation_id", "node__urn")
+        )
+        text_part_urns = defaultdict(list)
+        for audio_annotation_pk, urn in rows:
+            text_part_urns[audio_annotation_pk].append(urn)
+        return text_part_urns
+
+    def resolve_index_entries(self, entries, fields=None):
+        entries = list(entries)
+        pks = [entry.object_pk for entry in entries]
+        audio_annotations = AudioAnnotation.objects.in_bulk(pks)
+        text_part_urns = self.get_text_part_urns(pks)
+        return [
+            {
+                "idx": entry.idx,
+                "obj": audio_annotations[entry.object_pk],
+                "text_part_urns": text_part_urns[entry.object_pk],
+            }
+            for entry in entries
+        ]
+
+
+SHIM_CLASSES = [AlignmentsShim, NamedEntitiesShim, AudioAnnotationsShim]
+
+
+def get_shim_for_kind(annotation_kind):
+    return {
+        "translation-alignment": AlignmentsShim,
+        "named-entities": NamedEntitiesShim,
+        "audio-annotations": AudioAnnotationsShim,
+    }[annotation_kind]
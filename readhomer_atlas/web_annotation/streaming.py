@@ -0,0 +1,74 @@
+"""
+Encodes JSON incrementally, so that large annotation pages can be streamed
+as their items are generated rather than built up in memory first.
+"""
+import json
+from collections.abc import Iterator
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# the number of encoded chunks to join before writing to the response
+CHUNKS_PER_WRITE = 64
+
+
+def dumps(value):
+    if orjson is not None:
+        # NOTE: orjson omits the whitespace between separators
+        return orjson.dumps(value, default=DjangoJSONEncoder().default)
+    return json.dumps(value, cls=DjangoJSONEncoder).encode("utf-8")
+
+
+def iter_json(value):
+    """
+    Yields `value` encoded as JSON; iterators (e.g. generators) are
+    encoded as arrays, one item at a time
+    """
+    if isinstance(value, dict):
+        yield b"{"
+        for position, (key, item) in enumerate(value.items()):
+            if position:
+                yield b", "
+            yield dumps(str(key)) + b": "
+            yield from iter_json(item)
+        yield b"}"
+    elif isinstance(value, Iterator):
+        yield b"["
+        for position, item in enumerate(value):
+            if position:
+                yield b", "
+            yield from iter_json(item)
+        yield b"]"
+    else:
+        yield dumps(value)
+
+
+def buffer_chunks(chunks, size=CHUNKS_PER_WRITE):
+    buffer = []
+    for chunk in chunks:
+        buffer.append(chunk)
+        if len(buffer) >= size:
+            yield b"".join(buffer)
+            buffer = []
+    if buffer:
+        yield b"".join(buffer)
+
+
+class StreamingJsonResponse(StreamingHttpResponse):
+    """
+    Streams `data` as JSON; see `iter_json`.
+
+    Errors raised while items are generated truncate the response, since the
+    status and headers have already been sent.
+    """
+
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault("content_type", "application/json")
+        super().__init__(buffer_chunks(iter_json(data)), **kwargs)
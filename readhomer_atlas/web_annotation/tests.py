@@ -0,0 +1,330 @@
+import json
+import math
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.urls import reverse
+
+import pytest
+from hypothesis import given
+from hypothesis import strategies as st
+from scaife_viewer.atlas.models import (
+    AudioAnnotation,
+    ImageAnnotation,
+    ImageROI,
+    Node,
+)
+
+from ..data_version import data_version_file
+from ..metrics import parse_server_timing
+from . import generators
+from .generators import (
+    clear_folio_caches,
+    get_folio_iiif_resolver,
+    get_union_extent,
+)
+from .prerender import manifest_file
+from .shortcuts import build_absolute_url
+from .streaming import buffer_chunks, iter_json
+from .views import PAGE_SIZE
+
+
+FOLIO_URN = "urn:cite2:hmt:msA.v1:12r"
+CANVAS_ID = (
+    "https://rosetest.library.jhu.edu/rosademo/iiif/homer/VA/VA012RN-0013/canvas"
+)
+EMPTY_CANVAS_ID = (
+    "https://rosetest.library.jhu.edu/rosademo/iiif/homer/VA/VA012VN-0014/canvas"
+)
+LINE_COUNT = 12
+
+coordinates = st.floats(min_value=0, max_value=1, allow_nan=False)
+boxes = st.lists(
+    st.tuples(coordinates, coordinates, coordinates, coordinates), min_size=1
+)
+
+json_values = st.recursive(
+    st.none()
+    | st.booleans()
+    | st.integers(min_value=-(2 ** 53), max_value=2 ** 53)
+    | st.floats(allow_nan=False, allow_infinity=False)
+    | st.text(),
+    lambda children: st.lists(children) | st.dictionaries(st.text(), children),
+)
+
+
+def as_iterators(value):
+    """
+    Replaces every list within `value` with an iterator, as streamed pages do
+    """
+    if isinstance(value, dict):
+        return {key: as_iterators(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return (as_iterators(item) for item in value)
+    return value
+
+
+@given(boxes, st.randoms())
+def test_union_extent_ignores_order(coords, random):
+    shuffled = list(coords)
+    random.shuffle(shuffled)
+    assert get_union_extent(shuffled) == get_union_extent(coords)
+
+
+@given(boxes)
+def test_union_extent_contains_every_box(coords):
+    extent = get_union_extent(coords)
+    for x, y, w, h in coords:
+        assert extent["x"] <= x * 100
+        assert extent["y"] <= y * 100
+        assert extent["x"] + extent["w"] >= x * 100 + w * 100 - 1e-9
+        assert extent["y"] + extent["h"] >= y * 100 + h * 100 - 1e-9
+
+
+def test_union_extent_of_overlapping_boxes():
+    extent = get_union_extent([(0.5, 0.5, 0.25, 0.25), (0.1, 0.2, 0.5, 0.1)])
+    expected = {"x": 10, "y": 20, "w": 65, "h": 55}
+    for key, value in expected.items():
+        assert math.isclose(extent[key], value)
+
+
+@given(json_values)
+def test_iter_json_encodes_iterators_as_arrays(value):
+    encoded = b"".join(iter_json(as_iterators(value)))
+    assert json.loads(encoded) == value
+
+
+@given(json_values, st.integers(min_value=1, max_value=8))
+def test_buffer_chunks_preserves_content(value, size):
+    chunks = list(iter_json(as_iterators(value)))
+    assert b"".join(buffer_chunks(iter(chunks), size=size)) == b"".join(chunks)
+
+
+def test_folio_iiif_resolvers_are_cached_per_data_version(monkeypatch):
+    built = []
+    monkeypatch.setattr(
+        generators, "build_folio_iiif_resolver", lambda urn: built.append(urn) or urn
+    )
+    clear_folio_caches()
+    urn = "urn:cts:greekLit:tlg0012.tlg001.msA-folios:12r"
+
+    monkeypatch.setattr(generators, "get_data_version", lambda: None)
+    get_folio_iiif_resolver(urn)
+    get_folio_iiif_resolver(urn)
+    assert len(built) == 2
+
+    for version in ["a", "a", "b"]:
+        monkeypatch.setattr(
+            generators, "get_data_version", lambda: {"version": version}
+        )
+        get_folio_iiif_resolver(urn)
+    assert len(built) == 4
+    clear_folio_caches()
+
+
+@pytest.fixture
+def web_annotations(db, settings, tmp_path):
+    """
+    A folio of lines with an audio annotation for each, and a folio without
+    lines, indexed by `build_web_annotation_index`
+    """
+    settings.DATA_VERSION_PATH = str(tmp_path / "data_version.json")
+    settings.WEB_ANNOTATION_PRERENDER_DIR = str(tmp_path / "prerendered")
+    work = Node.add_root(urn="urn:cts:", kind="nid")
+    for urn, kind in [
+        ("urn:cts:greekLit:", "namespace"),
+        ("urn:cts:greekLit:tlg0012:", "textgroup"),
+        ("urn:cts:greekLit:tlg0012.tlg001:", "work"),
+    ]:
+        work = work.add_child(urn=urn, kind=kind)
+
+    for name in ["perseus-grc2", "msA"]:
+        version = work.add_child(
+            urn=f"urn:cts:greekLit:tlg0012.tlg001.{name}:",
+            kind="version",
+            metadata={"citation_scheme": ["book", "line"]},
+        )
+        book = version.add_child(urn=f"{version.urn}1", kind="book", ref="1", rank=1)
+        for position in range(1, LINE_COUNT + 1):
+            line = book.add_child(
+                urn=f"{version.urn}1.{position}",
+                kind="line",
+                ref=f"1.{position}",
+                rank=2,
+                idx=position - 1,
+            )
+            if name == "msA":
+                audio_annotation = AudioAnnotation.objects.create(
+                    asset_url=f"https://example.org/audio/{position}.mp4",
+                    idx=position - 1,
+                    urn=f"urn:audio:{position}",
+                )
+                audio_annotation.text_parts.add(line)
+
+    folios = work.add_child(
+        urn="urn:cts:greekLit:tlg0012.tlg001.msA-folios:",
+        kind="version",
+        metadata={"citation_scheme": ["folio", "book", "line"]},
+    )
+    for idx, (ref, canvas_id) in enumerate(
+        [("12r", CANVAS_ID), ("12v", EMPTY_CANVAS_ID)]
+    ):
+        folio = folios.add_child(
+            urn=f"{folios.urn}{ref}", kind="folio", ref=ref, rank=1, idx=idx
+        )
+        image_annotation = ImageAnnotation.objects.create(
+            idx=idx,
+            urn=f"urn:cite2:hmt:vaimg.2017a:VA{ref.upper()}N_00{idx}",
+            canvas_identifier=canvas_id,
+            image_identifier=f"VA{ref.upper()}N_00{idx}",
+            data={},
+        )
+        image_annotation.text_parts.add(folio)
+        if ref != "12r":
+            continue
+        book = folio.add_child(
+            urn=f"{folio.urn}.1", kind="book", ref=f"{ref}.1", rank=2
+        )
+        for position in range(1, LINE_COUNT + 1):
+            line = book.add_child(
+                urn=f"{book.urn}.{position}",
+                kind="line",
+                ref=f"{book.ref}.{position}",
+                rank=3,
+                idx=position - 1,
+            )
+            roi = ImageROI.objects.create(
+                image_annotation=image_annotation,
+                image_identifier=image_annotation.image_identifier,
+                coordinates_value=f"0.1,{0.05 * position:.2f},0.5,0.025",
+                data={"urn:cite2:hmt:va_dse.v1.surface:": FOLIO_URN},
+            )
+            roi.text_parts.add(line)
+
+    call_command("build_web_annotation_index", stdout=StringIO())
+    # NOTE: `cache_page` uses the configured cache, rather than a test one
+    data_version_file.clear()
+    manifest_file.clear()
+    cache.clear()
+    yield
+    cache.clear()
+    clear_folio_caches()
+
+
+def test_discovery_lists_collections_for_a_canvas(client, web_annotations):
+    url = reverse("web_annotation_discovery")
+    assert client.get(url).status_code == 400
+    assert (
+        client.get(url, {"canvas_id": "https://example.org/canvas"}).status_code == 404
+    )
+
+    response = client.get(url, {"canvas_id": EMPTY_CANVAS_ID})
+    assert response.json() == {"collections": []}
+
+    response = client.get(url, {"canvas_id": CANVAS_ID})
+    collection_url = reverse(
+        "serve_web_annotation_collection", args=[FOLIO_URN, "audio-annotations"]
+    )
+    assert response.json() == {"collections": [build_absolute_url(collection_url)]}
+
+
+def test_pages_are_linked_and_bounded(client, web_annotations):
+    args = [FOLIO_URN, "audio-annotations"]
+    collection = client.get(
+        reverse("serve_web_annotation_collection", args=args)
+    ).json()
+    assert collection["total"] == LINE_COUNT
+    first_url = reverse("serve_web_annotation_page", args=[*args, 0])
+    last_url = reverse("serve_web_annotation_page", args=[*args, 1])
+    assert collection["first"] == build_absolute_url(first_url)
+    assert collection["last"] == build_absolute_url(last_url)
+
+    first = client.get(first_url).json()
+    assert "prev" not in first
+    assert first["next"] == build_absolute_url(last_url)
+    assert len(first["items"]) == PAGE_SIZE
+
+    last = client.get(last_url).json()
+    assert last["prev"] == build_absolute_url(first_url)
+    assert "next" not in last
+    assert last["startIndex"] == PAGE_SIZE
+    assert len(last["items"]) == LINE_COUNT - PAGE_SIZE
+
+    past_last_url = reverse("serve_web_annotation_page", args=[*args, 2])
+    assert client.get(past_last_url).status_code == 404
+
+
+def write_data_version(settings, version):
+    with open(settings.DATA_VERSION_PATH, "w") as f:
+        json.dump({"version": version, "created": 1577836800}, f)
+    data_version_file.clear()
+
+
+def test_conditional_requests_are_not_modified(client, settings, web_annotations):
+    url = reverse(
+        "serve_web_annotation_collection", args=[FOLIO_URN, "audio-annotations"]
+    )
+    assert not client.get(url).has_header("ETag")
+
+    write_data_version(settings, "a")
+    response = client.get(url)
+    assert response.status_code == 200
+    etag = response["ETag"]
+    assert response["Last-Modified"] == "Wed, 01 Jan 2020 00:00:00 GMT"
+
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+    assert response["ETag"] == etag
+    response = client.get(url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+    assert response.status_code == 304
+
+    write_data_version(settings, "b")
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response["ETag"] != etag
+
+
+def test_responses_report_server_timing(client, settings, web_annotations):
+    settings.METRICS_SAMPLE_RATE = 1
+    url = reverse("serve_web_annotation_page", args=[FOLIO_URN, "audio-annotations", 0])
+
+    server_timing = client.get(url)["Server-Timing"]
+    assert server_timing.startswith("app;dur=")
+    timing = parse_server_timing(server_timing)
+    assert timing["sql_queries"] > 0
+    assert timing["caches"] == {"page": False, "prerendered": False}
+
+    timing = parse_server_timing(client.get(url)["Server-Timing"])
+    assert timing["sql_queries"] == 0
+    assert timing["caches"] == {"page": True, "prerendered": False}
+
+
+def get_json(response):
+    if response.streaming:
+        return json.loads(b"".join(response.streaming_content))
+    return response.json()
+
+
+def test_prerendered_files_are_served(client, settings, web_annotations):
+    urls = [
+        reverse("serve_web_annotation_collection", args=[FOLIO_URN, kind])
+        for kind in ["audio-annotations", "named-entities"]
+    ]
+    rendered = [client.get(url).json() for url in urls]
+
+    call_command("render_web_annotations", "--gzip", stdout=StringIO())
+    for url, data in zip(urls, rendered):
+        response = client.get(url)
+        assert 'cache-prerendered;desc="hit"' in response["Server-Timing"]
+        assert get_json(response) == data
+    response = client.get(urls[0], HTTP_ACCEPT_ENCODING="gzip")
+    assert response["Content-Encoding"] == "gzip"
+
+    # NOTE: files rendered for other kinds are kept
+    call_command(
+        "render_web_annotations", "--kind", "audio-annotations", stdout=StringIO()
+    )
+    response = client.get(urls[1])
+    assert 'cache-prerendered;desc="hit"' in response["Server-Timing"]
+    assert get_json(response) == rendered[1]
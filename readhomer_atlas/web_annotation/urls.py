@@ -2,6 +2,7 @@ from django.urls import path
 
 from .views import (
     discovery,
+    export,
     serve_wa,
     serve_web_annotation_collection,
     serve_web_annotation_page,
@@ -25,4 +26,5 @@ urlpatterns = [
         name="serve_web_annotation",
     ),
     path("discovery/", discovery, name="web_annotation_discovery",),
+    path("export/", export, name="web_annotation_export"),
 ]
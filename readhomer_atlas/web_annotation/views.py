@@ -1,18 +1,36 @@
+from urllib.parse import urlencode
+
 from django.conf import settings
 from django.core.paginator import EmptyPage, Paginator
-from django.http import Http404, HttpResponseBadRequest, JsonResponse
+from django.http import (
+    Http404,
+    HttpResponseBadRequest,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.shortcuts import get_object_or_404
 from django.urls import reverse_lazy
 from django.views.decorators.cache import cache_page
 
 from scaife_viewer.atlas.models import ImageAnnotation, Node
 
+from ..data_version import condition_on_data_version
+from .export import EXPORT_KINDS, iter_annotations, iter_ndjson
 from .generators import (
+    ITEM_BATCH_SIZE,
     WebAnnotationCollectionGenerator,
     get_generator_for_kind,
 )
-from .shims import AlignmentsShim, AudioAnnotationsShim, NamedEntitiesShim
+from .models import FolioAnnotationCollection
+from .prerender import (
+    annotation_path,
+    collection_path,
+    page_path,
+    serve_prerendered,
+)
+from .shims import SHIM_CLASSES, get_shim_for_kind
 from .shortcuts import build_absolute_url
+from .streaming import StreamingJsonResponse, buffer_chunks
 from .utils import (
     as_zero_based,
     folio_exemplar_urn_to_site_urn,
@@ -21,50 +39,75 @@ from .utils import (
 
 
 PAGE_SIZE = 10
+# requested via `?page_size=all` to return every item on a single page
+ALL_ITEMS = "all"
+INVALID_PAGE_SIZE_MESSAGE = (
+    f"page_size must be between 1 and {settings.WEB_ANNOTATION_MAX_PAGE_SIZE}, "
+    f'or "{ALL_ITEMS}"'
+)
+
+
+def get_page_size(request):
+    """
+    Returns the page size requested via `?page_size`, or None if it is invalid
+    """
+    value = request.GET.get("page_size")
+    if value is None:
+        return PAGE_SIZE
+    if value == ALL_ITEMS:
+        return ALL_ITEMS
+    try:
+        page_size = int(value)
+    except ValueError:
+        return None
+    if not 0 < page_size <= settings.WEB_ANNOTATION_MAX_PAGE_SIZE:
+        return None
+    return page_size
+
+
+def is_streamed(page_size):
+    # NOTE: pages larger than the default are for bulk consumers, so they
+    # are streamed rather than cached
+    return page_size == ALL_ITEMS or page_size > PAGE_SIZE
+
+
+def get_paginator(queryset, page_size):
+    if page_size == ALL_ITEMS:
+        page_size = max(queryset.count(), 1)
+    return Paginator(queryset, per_page=page_size)
+
+
+def with_page_size(url, page_size):
+    url = build_absolute_url(url)
+    if page_size == PAGE_SIZE:
+        return url
+    return f"{url}?{urlencode({'page_size': page_size})}"
 
 
 def get_folio_obj(urn):
     return get_object_or_404(Node, **{"urn": preferred_folio_urn(urn)})
 
 
-@cache_page(settings.DEFAULT_HTTP_CACHE_DURATION)
-def serve_wa(request, annotation_kind, urn, idx):
-    # @@@ query alignments from Postgres
-    obj = None
-    if annotation_kind == "translation-alignment":
-        object_list = AlignmentsShim(urn).get_object_list()
-    elif annotation_kind == "named-entities":
-        object_list = NamedEntitiesShim(urn).get_object_list()
-    elif annotation_kind == "audio-annotations":
-        object_list = AudioAnnotationsShim(urn).get_object_list()
-
-    for obj_ in object_list:
-        if obj_["idx"] == idx:
-            obj = obj_
-            break
+def get_annotation_data(annotation_kind, urn, idx):
+    shim_class = get_shim_for_kind(annotation_kind)
+    # NOTE: resolved via the FolioAnnotation index;
+    # see the `build_web_annotation_index` management command
+    obj = shim_class(urn).get_object(idx)
     if not obj:
         raise Http404
 
     generator_class = get_generator_for_kind(annotation_kind)
     wa = generator_class(urn, obj)
-    return JsonResponse(data=wa.obj)
+    return wa.obj
 
 
-@cache_page(settings.DEFAULT_HTTP_CACHE_DURATION)
-def serve_web_annotation_collection(request, annotation_kind, urn):
+def get_collection_data(annotation_kind, urn, page_size=PAGE_SIZE):
     get_folio_obj(urn)
 
-    if annotation_kind == "translation-alignment":
-        # @@@ query alignments from Postgres
-        object_list = AlignmentsShim(urn).get_object_list(fields=["idx"])
-        label = f"Translation Alignments for {urn}"
-    elif annotation_kind == "named-entities":
-        object_list = NamedEntitiesShim(urn).get_object_list(fields=["idx"])
-        label = f"Named Entities for {urn}"
-    elif annotation_kind == "audio-annotations":
-        object_list = AudioAnnotationsShim(urn).get_object_list(fields=["idx"])
-        label = f"Audio Annotations for {urn}"
-    paginator = Paginator(object_list, per_page=PAGE_SIZE)
+    shim = get_shim_for_kind(annotation_kind)(urn)
+    label = f"{shim.label} for {urn}"
+    # NOTE: `paginator.count` is computed via COUNT against the index
+    paginator = get_paginator(shim.get_index_queryset(), page_size)
 
     urls = {
         "id": reverse_lazy(
@@ -85,34 +128,41 @@ def serve_web_annotation_collection(request, annotation_kind, urn):
         "type": "AnnotationCollection",
         "label": label,
         "total": paginator.count,
-        "first": build_absolute_url(urls["first"]),
-        "last": build_absolute_url(urls["last"]),
+        "first": with_page_size(urls["first"], page_size),
+        "last": with_page_size(urls["last"], page_size),
     }
-    return JsonResponse(data)
+    return data
 
 
-@cache_page(settings.DEFAULT_HTTP_CACHE_DURATION)
-def serve_web_annotation_page(request, annotation_kind, urn, zero_page_number):
+def get_page_data(annotation_kind, urn, zero_page_number, page_size=PAGE_SIZE):
+    """
+    Returns the data for a page of annotations; when `page_size` is streamed
+    (see `is_streamed`), items are a generator to be encoded incrementally
+    """
     get_folio_obj(urn)
 
-    if annotation_kind == "translation-alignment":
-        # @@@ query alignments from Postgres
-        object_list = AlignmentsShim(urn).get_object_list()
-    elif annotation_kind == "named-entities":
-        object_list = NamedEntitiesShim(urn).get_object_list()
-    elif annotation_kind == "audio-annotations":
-        object_list = AudioAnnotationsShim(urn).get_object_list()
-
+    shim = get_shim_for_kind(annotation_kind)(urn)
     page_number = zero_page_number + 1
-    paginator = Paginator(object_list, per_page=PAGE_SIZE)
+    paginator = get_paginator(shim.get_index_queryset(), page_size)
     try:
         page = paginator.page(page_number)
     except EmptyPage:
         raise Http404
     generator_class = get_generator_for_kind(annotation_kind)
-    collection = WebAnnotationCollectionGenerator(
-        generator_class, urn, page.object_list
-    )
+    if is_streamed(page_size):
+        # NOTE: entries are read via a server-side cursor where supported
+        entries = page.object_list.iterator(chunk_size=ITEM_BATCH_SIZE)
+        object_list = shim.iter_resolved_entries(entries, batch_size=ITEM_BATCH_SIZE)
+        collection = WebAnnotationCollectionGenerator(generator_class, urn, object_list)
+        # NOTE: the status has already been sent by the time items are
+        # generated, so items that fail are skipped (as in the export) rather
+        # than truncating the response
+        items = map(collection.prepare_item, collection.iter_objects())
+    else:
+        # NOTE: only the entries for the current page are resolved
+        object_list = shim.resolve_index_entries(page.object_list)
+        collection = WebAnnotationCollectionGenerator(generator_class, urn, object_list)
+        items = collection.items
     urls = {
         "id": reverse_lazy(
             "serve_web_annotation_page",
@@ -124,53 +174,105 @@ def serve_web_annotation_page(request, annotation_kind, urn, zero_page_number):
     }
     data = {
         "@context": "http://www.w3.org/ns/anno.jsonld",
-        "id": build_absolute_url(urls["id"]),
+        "id": with_page_size(urls["id"], page_size),
         "type": "AnnotationPage",
-        "partOf": build_absolute_url(urls["part_of"]),
+        "partOf": with_page_size(urls["part_of"], page_size),
         "startIndex": as_zero_based(page.start_index()),
-        "items": collection.items,
     }
     if page.has_previous():
         prev_url = reverse_lazy(
             "serve_web_annotation_page",
             args=[urn, annotation_kind, as_zero_based(page.previous_page_number())],
         )
-        data["prev"] = build_absolute_url(prev_url)
+        data["prev"] = with_page_size(prev_url, page_size)
     if page.has_next():
         next_url = reverse_lazy(
             "serve_web_annotation_page",
             args=[urn, annotation_kind, as_zero_based(page.next_page_number())],
         )
-        data["next"] = build_absolute_url(next_url)
+        data["next"] = with_page_size(next_url, page_size)
+    # NOTE: last, so that the rest of the page is written before any items
+    # when streamed
+    data["items"] = items
+    return data
+
+
+@condition_on_data_version(vary_on_encoding=True)
+@serve_prerendered(annotation_path)
+@cache_page(settings.DEFAULT_HTTP_CACHE_DURATION)
+def serve_wa(request, annotation_kind, urn, idx):
+    return JsonResponse(data=get_annotation_data(annotation_kind, urn, idx))
+
+
+@condition_on_data_version(vary_on_encoding=True)
+@serve_prerendered(collection_path)
+@cache_page(settings.DEFAULT_HTTP_CACHE_DURATION)
+def serve_web_annotation_collection(request, annotation_kind, urn):
+    page_size = get_page_size(request)
+    if page_size is None:
+        return HttpResponseBadRequest(INVALID_PAGE_SIZE_MESSAGE)
+    return JsonResponse(get_collection_data(annotation_kind, urn, page_size))
+
+
+@condition_on_data_version(vary_on_encoding=True)
+@serve_prerendered(page_path)
+@cache_page(settings.DEFAULT_HTTP_CACHE_DURATION)
+def serve_web_annotation_page(request, annotation_kind, urn, zero_page_number):
+    page_size = get_page_size(request)
+    if page_size is None:
+        return HttpResponseBadRequest(INVALID_PAGE_SIZE_MESSAGE)
+    data = get_page_data(annotation_kind, urn, zero_page_number, page_size)
+    if is_streamed(page_size):
+        return StreamingJsonResponse(data)
     return JsonResponse(data)
 
 
+@condition_on_data_version()
 @cache_page(settings.DEFAULT_HTTP_CACHE_DURATION)
 def discovery(request):
     canvas_id = request.GET.get("canvas_id")
     if not canvas_id:
         return HttpResponseBadRequest("canvas_id is required")
 
-    image_annotation = get_object_or_404(ImageAnnotation, canvas_identifier=canvas_id)
-    folio_exemplar_urn = image_annotation.text_parts.first().urn
-    cite_urn = folio_exemplar_urn_to_site_urn(folio_exemplar_urn)
+    # NOTE: availability is precomputed by the `build_web_annotation_index`
+    # management command
+    available = {
+        collection.annotation_kind: collection
+        for collection in FolioAnnotationCollection.objects.filter(
+            canvas_identifier=canvas_id
+        )
+    }
+    if not available:
+        # NOTE: folios without lines have no precomputed availability, but
+        # known canvases still return an empty list
+        if not ImageAnnotation.objects.filter(canvas_identifier=canvas_id).exists():
+            raise Http404
+
     collections = []
-    # @@@ move metadata to shim classes
-    # or otherwise encapsulate the queries required
-    possible_collections = [
-        {"annotation_kind": "translation-alignment", "shim_class": AlignmentsShim},
-        {"annotation_kind": "named-entities", "shim_class": NamedEntitiesShim},
-        {"annotation_kind": "audio-annotations", "shim_class": AudioAnnotationsShim},
-    ]
-    for possibility in possible_collections:
-        shim_obj = possibility["shim_class"](cite_urn)
-        if shim_obj.get_object_list(fields=["idx"]):
-            collection_url = reverse_lazy(
-                "serve_web_annotation_collection",
-                kwargs={
-                    "urn": cite_urn,
-                    "annotation_kind": possibility["annotation_kind"],
-                },
-            )
-            collections.append(build_absolute_url(collection_url))
+    for shim_class in SHIM_CLASSES:
+        collection = available.get(shim_class.annotation_kind)
+        if not collection or not collection.count:
+            continue
+        cite_urn = folio_exemplar_urn_to_site_urn(collection.folio_urn)
+        collection_url = reverse_lazy(
+            "serve_web_annotation_collection",
+            kwargs={"urn": cite_urn, "annotation_kind": collection.annotation_kind},
+        )
+        collections.append(build_absolute_url(collection_url))
     return JsonResponse({"collections": collections})
+
+
+@condition_on_data_version()
+def export(request):
+    """
+    Streams every annotation (or those of the kinds given via `?kind`)
+    as newline-delimited JSON-LD
+    """
+    kinds = request.GET.getlist("kind")
+    unknown = set(kinds) - set(EXPORT_KINDS)
+    if unknown:
+        return HttpResponseBadRequest(f"kind must be one of: {', '.join(EXPORT_KINDS)}")
+    return StreamingHttpResponse(
+        buffer_chunks(iter_ndjson(iter_annotations(kinds))),
+        content_type="application/x-ndjson",
+    )
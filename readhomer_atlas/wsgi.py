@@ -9,9 +9,17 @@ https://docs.djangoproject.com/en/2.2/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "readhomer_atlas.settings")
 
 application = get_wsgi_application()
+
+if settings.TOC_PRELOAD:
+    # NOTE: TOCs are held in memory by each process, so are loaded as each
+    # gunicorn worker starts rather than by the first requests for them
+    from readhomer_atlas.tocs.views import preload as preload_tocs
+
+    preload_tocs()